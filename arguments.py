@@ -0,0 +1,192 @@
+import argparse
+import os
+
+from thread_tuner import DEFAULT_FILE
+
+
+RNAME_TAIL = {'sector_industry': '_industry_relation.npy',
+              'wikidata': '_wiki_relation.npy'}
+
+
+def relation_path(data_path, market_name, relation_name, geom=False,
+                  thresh=None):
+    if geom:
+        return os.path.join(data_path, '..', 'relation', relation_name,
+                            market_name + RNAME_TAIL[relation_name][:-4] +
+                            "_geom_{}.npy".format(thresh))
+    return os.path.join(data_path, '..', 'relation', relation_name,
+                        market_name + RNAME_TAIL[relation_name])
+
+
+def part_path(data_path, market_name, gp):
+    return os.path.join(data_path, '..',
+                        "{}_part_{}.npy".format(market_name, gp))
+
+
+def market_file(fname, market_name, market):
+    '''
+    the file of market for fname, a file of market_name: {market} is
+    replaced by market, as is a leading market_name, e.g.
+    NASDAQ_tickers.csv -> NYSE_tickers.csv
+    '''
+    if '{market}' in fname:
+        return fname.format(market=market)
+    if fname.startswith(market_name):
+        return market + fname[len(market_name):]
+    return fname
+
+
+def parse_args(argv=None):
+    desc = 'train a relational rank lstm model'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-p', help='path of EOD data',
+                        default='../data/2013-01-01')
+    parser.add_argument('-m', help='market name', default='NASDAQ')
+    parser.add_argument('-t', help='fname for selected tickers')
+    parser.add_argument('-l', default=4,
+                        help='length of historical sequence for feature')
+    parser.add_argument('-u', default=64,
+                        help='number of hidden units in lstm')
+    parser.add_argument('-s', default=1,
+                        help='steps to make prediction')
+    parser.add_argument('-r', default=0.001,
+                        help='learning rate')
+    parser.add_argument('-a', default=1,
+                        help='alpha, the weight of ranking loss')
+    parser.add_argument('-g', '--gpu', type=int, default=0, help='use gpu')
+    parser.add_argument('-e', '--emb_file', type=str,
+                        default='NASDAQ_rank_lstm_seq-16_unit-64_2.csv.npy',
+                        help='fname for pretrained sequential embedding')
+    parser.add_argument('-emb_day_major', action='store_true',
+                        help='the embedding file is stored as T x N x U, '
+                             'see embedding_store.py')
+    parser.add_argument('-raw_windows', action='store_true',
+                        help='train the rank lstm on the raw EOD windows '
+                             'instead of reading the pretrained embedding')
+    parser.add_argument('-timing_log', type=str, default=None,
+                        help='JSON lines file of per-phase timings, '
+                             '- for stdout')
+    parser.add_argument('-trace_steps', type=str, default=None,
+                        help='train steps to trace with the TF timeline, '
+                             'e.g. 100-110')
+    parser.add_argument('-trace_dir', type=str, default='trace',
+                        help='folder of the timeline traces')
+    parser.add_argument('-mem_budget', type=float, default=None,
+                        help='memory budget in MB, warn before exceeding it')
+    parser.add_argument('-tune_threads', action='store_true',
+                        help='benchmark CPU thread settings before training')
+    parser.add_argument('-thread_file', type=str, default=DEFAULT_FILE,
+                        help='tuned thread settings per host, empty to '
+                             'ignore them')
+    parser.add_argument('-workers', type=int, default=1,
+                        help='data-parallel training processes')
+    parser.add_argument('-rn', '--rel_name', type=str,
+                        default='sector_industry',
+                        help='relation type: sector_industry or wikidata')
+    parser.add_argument('-rel_deltas', type=str, default=None,
+                        help='folder of relation delta files applied on top '
+                             'of the relation file, see relation_store.py')
+    parser.add_argument('-ip', '--inner_prod', type=int, default=0)
+    parser.add_argument('-attn_block', type=int, default=0,
+                        help='compute the relational attention this many '
+                             'columns at a time to bound its memory, 0 for '
+                             'the dense N x N attention')
+    parser.add_argument('-fanout', type=int, default=0,
+                        help='in-neighbors per ticker sampled at every '
+                             'train step, evaluation uses all of them; 0 '
+                             'to train on all')
+    parser.add_argument('-clusters', type=int, default=0,
+                        help='graph partitions (-gp) whose tickers make up '
+                             'every train step, evaluation uses all '
+                             'tickers; 0 to train on all')
+    parser.add_argument('-markets', type=str, default=None,
+                        help='markets trained jointly by one model, comma '
+                             'separated, e.g. NASDAQ,NYSE; the tickers and '
+                             'embedding files of -m are renamed per market, '
+                             'see market_file')
+    parser.add_argument('-market_heads', action='store_true',
+                        help='a prediction layer per market instead of a '
+                             'shared one')
+    parser.add_argument('-epoch', '--epoch', type=int, default=50)
+    parser.add_argument('-geom', action='store_true')
+    parser.add_argument('-unify', type=str, default="add",
+                            help='self supervised loss type: add or 2way')
+    parser.add_argument('-two_way_b', type=float, default=0.95,
+                            help='unify parameter for 2way')
+    parser.add_argument('-self', type=str, default="None",
+                help='self supervised loss type: part or reg')
+    parser.add_argument('-thresh', type=float, default=1.49,
+                help='threshold')
+    parser.add_argument('-gp', type=int, default=32,
+                help='number of graph partitions for loss part')
+    parser.add_argument('-self_b', type=float, default=1e-4)
+    parser.add_argument('-ratio', type=float, default=1)
+    parser.add_argument('-valid_index', type=int, default=756,
+                        help='first validation day')
+    parser.add_argument('-test_index', type=int, default=1008,
+                        help='first test day')
+    parser.add_argument('-horizons', type=str, default=None,
+                        help='prediction horizons in days trained jointly, '
+                             'comma separated, e.g. 1,5,20')
+    parser.add_argument('-group_eval', action='store_true',
+                        help='report the test metrics of every industry of '
+                             'the sector_industry relation')
+    parser.add_argument('-pred_archive', type=str, default=None,
+                        help='folder of the on-disk prediction archive, see '
+                             'prediction_archive.py')
+    parser.add_argument('-archive_run', type=str, default='run',
+                        help='run name in the prediction archive')
+    parser.add_argument('-archive_keep', type=str, default='best',
+                        help='archive the best epoch only (best) or every '
+                             'epoch (all)')
+    parser.add_argument('-walk_forward', type=int, default=0,
+                        help='stride in days of walk-forward retraining, 0 '
+                             'to train on the fixed split')
+    parser.add_argument('-wf_epochs', type=int, default=None,
+                        help='epochs of the warm-started walk-forward '
+                             'windows, a quarter of -epoch by default')
+    parser.add_argument('-wf_output', type=str, default=None,
+                        help='.npz file of the stitched walk-forward test '
+                             'predictions')
+    parser.add_argument('-checkpoint_dir', type=str, default='checkpoint',
+                        help='folder of the walk-forward and export '
+                             'checkpoints')
+    parser.add_argument('-export', type=str, default=None,
+                        help='folder the frozen scoring graph of the best '
+                             'epoch of every seed is written to, see '
+                             'frozen_graph.py')
+    parser.add_argument('-export_sparse', action='store_true',
+                        help='export the relation logits of related pairs '
+                             'only')
+    args = parser.parse_args(argv)
+
+    if args.t is None:
+        args.t = args.m + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
+    parameters = {'seq': int(args.l), 'unit': int(args.u), 'lr': float(args.r),
+                  'alpha': float(args.a)}
+    args.inner_prod = (args.inner_prod == 1)
+    if args.horizons is not None:
+        args.horizons = [int(h) for h in args.horizons.split(',')]
+    if args.walk_forward > 0 and args.workers > 1:
+        parser.error('-walk_forward trains every window in one process, '
+                     'without -workers')
+    if args.workers > 1:
+        unsupported = [flag for flag, value in [
+            ('-export', args.export is not None),
+            ('-pred_archive', args.pred_archive is not None),
+            ('-group_eval', args.group_eval)] if value]
+        if unsupported:
+            parser.error('-workers evaluates the reduced metrics only, '
+                         'without %s' % ', '.join(unsupported))
+    if args.markets is not None:
+        args.markets = args.markets.split(',')
+        unsupported = [flag for flag, value in [
+            ('-tune_threads', args.tune_threads),
+            ('-walk_forward', args.walk_forward > 0),
+            ('-workers', args.workers > 1),
+            ('-export', args.export is not None),
+            ('-pred_archive', args.pred_archive is not None)] if value]
+        if unsupported:
+            parser.error('-markets trains all markets in one session, '
+                         'without %s' % ', '.join(unsupported))
+    return args, parameters
@@ -0,0 +1,88 @@
+import numpy as np
+
+
+# weight of the long and the short leg of every strategy
+STRATEGIES = {
+    'long': (1.0, 0.0),
+    'long_short': (1.0, 1.0)
+}
+
+
+def rank_valid(scores, valid, axis):
+    '''
+    scores, valid: ... x N x ... arrays
+    returns: rank of every score among the valid ones along axis (0 is the
+        highest), invalid entries are ranked last
+    '''
+    order = np.argsort(-np.where(valid, scores, -np.inf), axis=axis,
+                       kind='stable')
+    return np.argsort(order, axis=axis, kind='stable')
+
+
+def backtest(prediction, ground_truth, mask, top_k=(1, 5, 10),
+             strategies=('long', 'long_short'), steps=1, cost=0.0,
+             periods_per_year=252):
+    '''
+    prediction: N x T, or S x N x T for S runs (e.g. seeds) over the same days
+    ground_truth: N x T (shared by all runs) or S x N x T, steps-day returns
+    mask: same shape as ground_truth
+    top_k: numbers of tickers held in each leg, each at weight 1/k; on days
+        with fewer than k valid tickers the rest of the leg is not invested,
+        as in btl5 and btl10 of evaluate
+    strategies: names in STRATEGIES, long holds the predicted top-k,
+        long_short also shorts the predicted bottom-k
+    steps: holding period, the portfolio is rebalanced every steps days
+    cost: proportional transaction cost charged on the traded weight
+    returns: dict of S x len(strategies) x len(top_k) arrays (without the S
+        dimension for N x T prediction)
+        'wealth': compounded value of one unit invested
+        'cum_return': one plus the sum of period returns, as btl in evaluate
+        'turnover': mean traded weight per rebalance
+        'sharpe': annualized Sharpe ratio of the period returns
+        'returns': net period returns, with a trailing period dimension
+    '''
+    single = prediction.ndim == 2
+    if single:
+        prediction = prediction[None]
+    ground_truth = np.broadcast_to(ground_truth, prediction.shape)
+    mask = np.broadcast_to(mask, prediction.shape)
+
+    # rebalance days, S x N x P
+    rebalance = np.arange(0, prediction.shape[2], steps)
+    prediction = prediction[:, :, rebalance]
+    ground_truth = ground_truth[:, :, rebalance]
+    valid = mask[:, :, rebalance] >= 0.5
+
+    # long and short leg weights for all k at once, S x K x N x P
+    ks = np.array(top_k)[None, :, None, None]
+    legs = []
+    for sign in (1.0, -1.0):
+        picked = np.logical_and(
+            rank_valid(sign * prediction, valid, axis=1)[:, None] < ks,
+            valid[:, None]
+        )
+        legs.append(picked / ks)
+
+    # portfolio weights for all strategies, S x G x K x N x P
+    leg_sizes = np.array([STRATEGIES[name] for name in strategies])
+    weights = leg_sizes[None, :, 0, None, None, None] * legs[0][:, None] - \
+        leg_sizes[None, :, 1, None, None, None] * legs[1][:, None]
+
+    gross = np.sum(
+        weights * np.where(valid, ground_truth, 0.0)[:, None, None], axis=3)
+    traded = np.sum(np.abs(np.diff(weights, axis=4, prepend=0.0)), axis=3)
+    returns = gross - cost * traded
+
+    std = np.std(returns, axis=3)
+    performance = {
+        'wealth': np.prod(1.0 + returns, axis=3),
+        'cum_return': 1.0 + np.sum(returns, axis=3),
+        'turnover': np.mean(traded, axis=3),
+        'sharpe': np.mean(returns, axis=3) / np.where(std > 0, std, np.inf) *
+        np.sqrt(periods_per_year / steps),
+        'returns': returns
+    }
+    if single:
+        performance = dict((name, value[0])
+                           for name, value in performance.items())
+    return performance
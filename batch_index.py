@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class BatchIndex:
+    def __init__(self, mask_data, gt_data, price_data, seq, horizons):
+        '''
+        the masks, base prices and ground truths of every offset, computed
+        once and stored day-major so that a batch is a view
+        mask_data: N x T, 1 on valid days and 0 on missing ones
+        gt_data: N x T x H, or N x T for one horizon
+        price_data: N x T
+        seq: window length
+        horizons: prediction horizons in days, one per column of gt_data
+        '''
+        self.seq = seq
+        horizons = np.asarray(horizons, dtype=int)
+        if gt_data.ndim == 2:
+            gt_data = gt_data[:, :, None]
+        # offsets whose longest horizon is within the data
+        self.count = mask_data.shape[1] - seq - np.max(horizons) + 1
+        # missing days before every day, so that a window is valid when the
+        # count does not change over it: the rolling minimum of the 0/1 mask
+        missing = np.concatenate([
+            np.zeros((1, mask_data.shape[0])),
+            np.cumsum(np.transpose(mask_data) == 0, axis=0)])
+        # offsets x N x H: every day of the sequence and of the horizon is
+        # valid
+        self.masks = np.stack(
+            [missing[seq + h: seq + h + self.count] == missing[:self.count]
+             for h in horizons], axis=2).astype(np.float32)
+        # offsets x N x 1: the price of the last day of the sequence
+        self.prices = np.ascontiguousarray(np.transpose(
+            price_data[:, seq - 1: seq - 1 + self.count])[:, :, None],
+            dtype=np.float32)
+        # offsets x N x H: the return over every horizon
+        self.targets = np.stack(
+            [np.transpose(gt_data[:, seq + h - 1: seq + h - 1 + self.count,
+                                  i]) for i, h in enumerate(horizons)],
+            axis=2).astype(np.float32)
+
+    def batch(self, offset):
+        '''
+        returns: N x H mask, N x 1 base price and N x H ground truth of the
+            window at offset, views without a copy
+        '''
+        return self.masks[offset], self.prices[offset], self.targets[offset]
@@ -0,0 +1,252 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import time
+
+import numpy as np
+
+
+RESULT_TAG = 'BENCHMARK_RESULT '
+# higher is better for these metrics, lower for all others
+HIGHER_BETTER = ('train_steps_per_sec', 'valid_mrrt')
+# the validation and test splits start at these shares of the days, so that
+# the train split grows with -t days
+VALID_SHARE = 0.75
+TEST_SHARE = 0.9
+
+
+def generate_market(root, market='NASDAQ', tickers=100, days=1100,
+                    relations=5, density=0.01, units=64, parts=32,
+                    missing=0.01, seed=0):
+    '''
+    writes a synthetic market in the layout read by ReRaLSTM
+    root/data/2013-01-01/<market>_<ticker>_1.csv: day, 4 moving averages
+        and close, normalized, -1234 for missing days
+    root/data/<market>_tickers_qualify_dr-0.98_min-5_smooth.csv
+    root/data/relation/wikidata/<market>_wiki_relation.npy: N x N x K, with
+        random typed edges of the given density and self loops in the last
+        relation type
+    root/data/pretrain/<market>_synthetic_emb.npy: N x T x U
+    root/data/<market>_part_<parts>.npy: partition label of every ticker
+    returns: path of the EOD data, tickers and embedding file names
+    '''
+    rng = np.random.RandomState(seed)
+    data_root = os.path.join(root, 'data')
+    eod_path = os.path.join(data_root, '2013-01-01')
+    for folder in [eod_path, os.path.join(data_root, 'relation', 'wikidata'),
+                   os.path.join(data_root, 'pretrain')]:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    names = ['SYN%05d' % i for i in range(tickers)]
+    tickers_fname = market + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
+    np.savetxt(os.path.join(data_root, tickers_fname), names, fmt='%s')
+    # load_EOD_data drops the last NASDAQ day
+    rows = days + 1 if market == 'NASDAQ' else days
+    for name in names:
+        close = np.cumprod(1.0 + 0.02 * rng.randn(rows))
+        columns = [np.arange(rows)]
+        for window in [5, 10, 20, 30]:
+            cum = np.cumsum(np.concatenate([[0.0], close]))
+            lag = np.maximum(np.arange(1, rows + 1) - window, 0)
+            columns.append((cum[1:] - cum[lag]) /
+                           (np.arange(1, rows + 1) - lag))
+        columns.append(close)
+        single_EOD = np.stack(columns, axis=1)
+        single_EOD[:, 1:] /= np.max(close)
+        single_EOD[rng.rand(rows) < missing, 1:] = -1234
+        np.savetxt(os.path.join(eod_path, market + '_' + name + '_1.csv'),
+                   single_EOD, fmt='%.6f', delimiter=',')
+
+    relation = np.zeros([tickers, tickers, relations], dtype=np.uint8)
+    src, dst = np.nonzero(np.triu(rng.rand(tickers, tickers) < density, 1))
+    types = rng.randint(max(relations - 1, 1), size=len(src))
+    relation[src, dst, types] = 1
+    relation[dst, src, types] = 1
+    relation[np.arange(tickers), np.arange(tickers), -1] = 1
+    np.save(os.path.join(data_root, 'relation', 'wikidata',
+                         market + '_wiki_relation.npy'), relation)
+
+    emb_fname = market + '_synthetic_emb.npy'
+    embedding = np.lib.format.open_memmap(
+        os.path.join(data_root, 'pretrain', emb_fname), mode='w+',
+        dtype=np.float32, shape=(tickers, days, units))
+    for start in range(0, days, 256):
+        embedding[:, start: start + 256, :] = rng.randn(
+            tickers, min(256, days - start), units)
+    embedding.flush()
+    del embedding
+    np.save(os.path.join(data_root, '%s_part_%d.npy' % (market, parts)),
+            rng.randint(parts, size=tickers))
+    return eod_path, tickers_fname, emb_fname
+
+
+def run_config(config):
+    '''
+    trains one epoch on a generated market and measures it, meant to run in
+    a fresh process so that the peak memory belongs to this config only
+    '''
+    from relation_rank_lstm_all import ReRaLSTM, parse_args
+    timing_log = os.path.join(config['root'], 'timing.jsonl')
+    args, parameters = parse_args([
+        '-p', config['eod_path'], '-m', config['market'],
+        '-t', config['tickers_fname'], '-e', config['emb_fname'],
+        '-rn', 'wikidata', '-l', str(config['seq']), '-u', str(config['units']),
+        '-epoch', '1', '-ratio', str(config['ratio']),
+        '-valid_index', str(int(config['days'] * VALID_SHARE)),
+        '-test_index', str(int(config['days'] * TEST_SHARE)),
+        '-self', 'part', '-gp', str(config['parts']),
+        '-timing_log', timing_log
+    ] + config['extra'])
+    model = ReRaLSTM(
+        data_path=args.p, market_name=args.m, tickers_fname=args.t,
+        relation_name=args.rel_name, emb_fname=args.emb_file,
+        parameters=parameters, steps=1, epochs=args.epoch, batch_size=None,
+        in_pro=args.inner_prod, seed=0, geom=args.geom, args=args,
+        keep_pred=False
+    )
+    model.train()
+
+    # timed phases, without the memory snapshots
+    records = [record for record in map(json.loads, open(timing_log))
+               if 'seconds' in record]
+    seconds = {}
+    for record in records:
+        seconds[record['phase']] = seconds.get(record['phase'], 0.0) + \
+            record['seconds']
+    train = [record for record in records if record['phase'] == 'train'][0]
+    return {
+        'load_sec': seconds['load_eod'] + seconds['load_relation'] +
+        seconds['load_embedding'],
+        'graph_sec': seconds['graph'],
+        'train_steps_per_sec': train['steps'] / train['seconds'],
+        'inference_sec': seconds['valid_inference'] +
+        seconds['test_inference'],
+        'evaluate_sec': seconds['evaluate'],
+        # the accuracy traded for speed by e.g. -clusters or -fanout
+        'valid_mse': float(model.best_valid_perf['mse']),
+        'valid_mrrt': float(model.best_valid_perf['mrrt']),
+        # kilobytes on linux
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }
+
+
+def compare(results, baseline_file, tolerance):
+    '''
+    prints the relative change of every metric against a previous run of the
+    same configs, flagging regressions beyond tolerance
+    '''
+    baseline = {}
+    for line in open(baseline_file):
+        record = json.loads(line)
+        baseline[json.dumps(record['config'], sort_keys=True)] = record
+    for record in results:
+        old = baseline.get(json.dumps(record['config'], sort_keys=True))
+        if old is None:
+            continue
+        for name, value in sorted(record['metrics'].items()):
+            change = value / old['metrics'][name] - 1.0
+            worse = -change if name in HIGHER_BETTER else change
+            print('%-60s %-20s %+7.1f%% %s' % (
+                json.dumps(record['config'], sort_keys=True), name,
+                100 * change, 'REGRESSION' if worse > tolerance else ''))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def float_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+if __name__ == '__main__':
+    desc = 'benchmark ReRaLSTM on synthetic markets'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-n', type=int_list, default=[100, 400],
+                        help='numbers of tickers, comma separated')
+    parser.add_argument('-t', type=int_list, default=[1100],
+                        help='numbers of trading days, comma separated; '
+                             'validation and test start at VALID_SHARE and '
+                             'TEST_SHARE of them')
+    parser.add_argument('-k', type=int_list, default=[5],
+                        help='numbers of relation types, comma separated')
+    parser.add_argument('-density', type=float_list, default=[0.01, 0.1],
+                        help='relation edge densities, comma separated')
+    parser.add_argument('-l', type=int, default=16,
+                        help='length of historical sequence for feature')
+    parser.add_argument('-u', type=int, default=64,
+                        help='number of hidden units in lstm')
+    parser.add_argument('-gp', type=int, default=32,
+                        help='number of graph partitions')
+    parser.add_argument('-ratio', type=float, default=0.1,
+                        help='share of the training days to run')
+    parser.add_argument('-extra', type=str, default='',
+                        help='extra arguments of relation_rank_lstm_all.py')
+    parser.add_argument('-o', '--output', type=str,
+                        default='benchmark_results.jsonl',
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('-baseline', type=str, default=None,
+                        help='previous results to compare with')
+    parser.add_argument('-tolerance', type=float, default=0.1,
+                        help='relative change reported as a regression')
+    parser.add_argument('-keep', action='store_true',
+                        help='keep the generated data')
+    parser.add_argument('-child', type=str, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        print(RESULT_TAG + json.dumps(run_config(json.loads(args.child))))
+        sys.exit(0)
+
+    results = []
+    for tickers, days, relations, density in itertools.product(
+            args.n, args.t, args.k, args.density):
+        config = {'tickers': tickers, 'days': days, 'relations': relations,
+                  'density': density, 'seq': args.l, 'units': args.u,
+                  'parts': args.gp, 'ratio': args.ratio, 'extra': args.extra}
+        root = tempfile.mkdtemp(prefix='ar_stock_bench_')
+        try:
+            t1 = time()
+            eod_path, tickers_fname, emb_fname = generate_market(
+                root, tickers=tickers, days=days, relations=relations,
+                density=density, units=args.u, parts=args.gp)
+            print('config:', config, 'generated in %.2fs' % (time() - t1))
+            child = dict(config, root=root, market='NASDAQ',
+                         eod_path=eod_path, tickers_fname=tickers_fname,
+                         emb_fname=emb_fname, extra=args.extra.split())
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '-child',
+                 json.dumps(child)],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                universal_newlines=True)
+            lines = [line for line in out.stdout.splitlines()
+                     if line.startswith(RESULT_TAG)]
+            if out.returncode != 0 or not lines:
+                print(out.stdout[-2000:])
+                raise RuntimeError('benchmark run failed: %s' % config)
+            metrics = json.loads(lines[-1][len(RESULT_TAG):])
+        finally:
+            if args.keep:
+                print('data kept in', root)
+            else:
+                shutil.rmtree(root)
+        record = {'config': config, 'metrics': metrics,
+                  'host': platform.node(), 'time': time()}
+        print('metrics:', metrics)
+        results.append(record)
+        with open(args.output, 'a') as fout:
+            fout.write(json.dumps(record) + '\n')
+
+    if args.baseline is not None:
+        compare(results, args.baseline, args.tolerance)
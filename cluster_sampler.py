@@ -0,0 +1,28 @@
+import numpy as np
+
+
+class ClusterSampler:
+    def __init__(self, part_label, clusters, seed=0):
+        '''
+        Cluster-GCN batches: every train step runs on the tickers of a few
+        graph partitions and the relations among them
+        part_label: partition of every ticker, as loaded for -self part
+        clusters: partitions drawn per step
+        '''
+        self.part_label = np.asarray(part_label)
+        self.parts = np.unique(self.part_label)
+        self.clusters = min(clusters, len(self.parts))
+        self.seed = seed
+        # tickers of every partition
+        order = np.argsort(self.part_label, kind='stable')
+        bounds = np.searchsorted(self.part_label[order], self.parts)
+        self.members = np.split(order.astype(np.int32), bounds[1:])
+
+    def sample(self, step):
+        '''
+        returns: sorted indices of the tickers of the partitions drawn for
+            step, the same for the same seed and step
+        '''
+        rng = np.random.RandomState((self.seed * 1000003 + step) % 2 ** 32)
+        picked = rng.choice(len(self.parts), self.clusters, replace=False)
+        return np.sort(np.concatenate([self.members[i] for i in picked]))
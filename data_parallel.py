@@ -0,0 +1,262 @@
+import copy
+import logging
+import multiprocessing
+import queue
+import random
+from time import time
+
+import numpy as np
+import tensorflow as tf
+
+from evaluator import HorizonEvaluator
+from thread_tuner import apply_thread_config, available_cpus, session_config
+
+
+class _Shared:
+    def __init__(self, context, workers, params, state_size):
+        '''
+        shared-memory buffers of the local all-reduce
+        grads: workers x params, one gradient row per worker
+        active: whether each worker had a day in the current step
+        stats: workers x (3 losses + evaluator state), per-epoch sums
+        '''
+        self.barrier = context.Barrier(workers)
+        self._grads = context.RawArray('f', workers * params)
+        self._active = context.RawArray('d', workers)
+        self._stats = context.RawArray('d', workers * (3 + state_size))
+        self.shapes = (workers, params, state_size)
+
+    def attach(self):
+        workers, params, state_size = self.shapes
+        self.grads = np.frombuffer(self._grads, dtype=np.float32).reshape(
+            workers, params)
+        self.active = np.frombuffer(self._active, dtype=np.float64)
+        self.stats = np.frombuffer(self._stats, dtype=np.float64).reshape(
+            workers, 3 + state_size)
+        return self
+
+
+def _count_params(model):
+    with tf.Graph().as_default():
+        graph = model.build_graph(external_gradients=True)
+        return sum(int(np.prod(var.shape.as_list()))
+                   for var in graph['variables'])
+
+
+def _gather(shared, rank, values):
+    '''
+    returns: workers x len(values), the values (a flat array) of all workers
+    '''
+    shared.stats[rank, :len(values)] = values
+    shared.barrier.wait()
+    gathered = shared.stats[:, :len(values)].copy()
+    shared.barrier.wait()
+    return gathered
+
+
+def _all_reduce(shared, rank, values):
+    '''
+    sums values (a flat array) over all workers
+    '''
+    return np.sum(_gather(shared, rank, values), axis=0)
+
+
+def evaluate_days(model, graph, sess, offsets, evaluator, version):
+    '''
+    version: key of the current weights, see ReRaLSTM.relation_feed
+    returns: summed loss, reg_loss and rank_loss over offsets, whose
+        predictions are added to evaluator
+    '''
+    losses = np.zeros(3)
+    for cur_offset in offsets:
+        emb_batch, mask_batch, price_batch, gt_batch = model.get_batch(
+            cur_offset)
+        feed_dict = {
+            graph['feature']: emb_batch,
+            graph['mask']: mask_batch,
+            graph['ground_truth']: gt_batch,
+            graph['base_price']: price_batch
+        }
+        feed_dict.update(model.relation_feed(sess, graph, version))
+        cur_loss, cur_reg_loss, cur_rank_loss, cur_rr = sess.run(
+            (graph['loss'], graph['reg_loss'], graph['rank_loss'],
+             graph['return_ratio']), feed_dict)
+        losses += [cur_loss, cur_reg_loss, cur_rank_loss]
+        evaluator.update(cur_rr, gt_batch, mask_batch)
+    return losses
+
+
+def _worker(model, rank, workers, shared, results):
+    shared.attach()
+    cpus = available_cpus()
+    share = max(len(cpus) // workers, 1)
+    thread_config = {
+        'intra': share, 'inter': 1, 'blas': 1,
+        'affinity': [cpus[(rank * share + i) % len(cpus)]
+                     for i in range(share)]
+    }
+    thread_limiter = apply_thread_config(thread_config)
+    random.seed(model.seed)
+    np.random.seed(model.seed)
+    tf.set_random_seed(model.seed)
+    graph = model.build_graph(external_gradients=True)
+    sess = tf.Session(config=session_config(thread_config))
+    sess.run(tf.global_variables_initializer())
+    model._relation_cache = (None, {})
+
+    # start from the weights of worker 0
+    variables = graph['variables']
+    sizes = [int(np.prod(var.shape.as_list())) for var in variables]
+    bounds = np.cumsum([0] + sizes)
+    if rank == 0:
+        shared.grads[0] = np.concatenate(
+            [value.ravel() for value in sess.run(variables)])
+    shared.barrier.wait()
+    if rank != 0:
+        for var, start, end in zip(variables, bounds[:-1], bounds[1:]):
+            var.load(shared.grads[0, start: end].reshape(
+                var.shape.as_list()), sess)
+    shared.barrier.wait()
+
+    seq_len = model.parameters['seq']
+    end_index = model.valid_index - seq_len - model.steps + 1
+    start_index = int(end_index * (1 - model.ratio))
+    rounds = -(-(end_index - start_index) // workers)
+    valid_offsets = np.arange(model.valid_index - seq_len - model.steps + 1,
+                              model.test_index - seq_len - model.steps + 1)
+    test_offsets = np.arange(model.test_index - seq_len - model.steps + 1,
+                             model.test_end - seq_len - model.steps + 1)
+    valid_eval = HorizonEvaluator(model.horizons)
+    test_eval = HorizonEvaluator(model.horizons)
+    best_valid_perf = {
+        'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0
+    }
+    best_test_perf = {
+        'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0
+    }
+    best_valid_loss = np.inf
+
+    batch_offsets = np.arange(start=0, stop=model.valid_index, dtype=int)
+    for i in range(model.epochs):
+        t1 = time()
+        # every worker draws the same order and takes every workers-th day
+        np.random.seed(model.seed)
+        np.random.shuffle(batch_offsets)
+        tra_losses = np.zeros(3)
+        for r in range(rounds):
+            j = start_index + r * workers + rank
+            shared.active[rank] = j < end_index
+            if j < end_index:
+                emb_batch, mask_batch, price_batch, gt_batch = \
+                    model.get_batch(batch_offsets[j])
+                feed_dict = {
+                    graph['feature']: emb_batch,
+                    graph['mask']: mask_batch,
+                    graph['ground_truth']: gt_batch,
+                    graph['base_price']: price_batch
+                }
+                feed_dict.update(model.step_feed(graph, j + i * end_index))
+                cur_loss, cur_reg_loss, cur_rank_loss, grads = sess.run(
+                    (graph['loss'], graph['reg_loss'], graph['rank_loss'],
+                     graph['gradients']), feed_dict)
+                tra_losses += [cur_loss, cur_reg_loss, cur_rank_loss]
+                shared.grads[rank] = np.concatenate(
+                    [grad.ravel() for grad in grads])
+            shared.barrier.wait()
+            # same rows summed in the same order: identical on every worker
+            active = shared.active > 0
+            mean_grad = np.sum(shared.grads[active], axis=0) / np.sum(active)
+            shared.barrier.wait()
+            sess.run(graph['optimizer'], dict(
+                (feed, mean_grad[start: end].reshape(feed.shape.as_list()))
+                for feed, start, end in zip(graph['grad_feeds'], bounds[:-1],
+                                            bounds[1:])))
+        tra_losses = _all_reduce(shared, rank, tra_losses)
+        if rank == 0:
+            model.profiler.record('train', time() - t1, epoch=i,
+                                  steps=end_index - start_index)
+            print('Train Loss:', *(tra_losses / end_index))
+
+        valid_eval.reset()
+        val_losses = evaluate_days(model, graph, sess,
+                                    valid_offsets[rank::workers], valid_eval,
+                                    i)
+        val_stats = _all_reduce(shared, rank, np.concatenate(
+            [val_losses, valid_eval.state()]))
+        test_eval.reset()
+        test_losses = evaluate_days(model, graph, sess,
+                                     test_offsets[rank::workers], test_eval,
+                                     i)
+        test_stats = _all_reduce(shared, rank, np.concatenate(
+            [test_losses, test_eval.state()]))
+        checksums = _gather(shared, rank, np.array([np.sum(
+            [np.sum(value, dtype=np.float64)
+             for value in sess.run(variables)])]))
+        if rank != 0:
+            continue
+
+        if np.any(checksums != checksums[0]):
+            logging.warning('data-parallel workers diverged at epoch %d', i)
+            print('WARNING: data-parallel workers diverged at epoch', i)
+        valid_eval.reset()
+        valid_eval.add_state(val_stats[3:])
+        test_eval.reset()
+        test_eval.add_state(test_stats[3:])
+        cur_valid_perf = valid_eval.performance()
+        cur_test_perf = test_eval.performance()
+        val_loss = val_stats[0] / (model.test_index - model.valid_index)
+        print('Valid MSE:',
+              *(val_stats[:3] / (model.test_index - model.valid_index)))
+        print('\t Valid preformance:', cur_valid_perf)
+        print('Test MSE:',
+              *(test_stats[:3] / (model.test_end - model.test_index)))
+        print('\t Test performance:', cur_test_perf)
+        if val_loss < best_valid_loss:
+            best_valid_loss = val_loss
+            best_valid_perf = copy.copy(cur_valid_perf)
+            best_test_perf = copy.copy(cur_test_perf)
+            print('Better valid loss:', best_valid_loss)
+        t4 = time()
+        model.profiler.record('epoch', t4 - t1, epoch=i)
+        print('epoch:', i, ('time: %.4f ' % (t4 - t1)))
+    sess.close()
+    if rank == 0:
+        results.put((best_valid_perf, best_test_perf))
+
+
+def train_data_parallel(model, workers):
+    '''
+    trains model with workers processes that each compute the gradient of a
+    different day of batch_offsets; the gradients are averaged through
+    shared memory, so every step applies the same update on every worker
+    and their weights stay identical
+    model: ReRaLSTM, with its data loaded and no TF session created yet
+    returns: best validation and test performance, as printed by train
+    '''
+    context = multiprocessing.get_context('fork')
+    shared = _Shared(context, workers, _count_params(model),
+                     len(HorizonEvaluator(model.horizons).state()))
+    results = context.Queue()
+    processes = [context.Process(target=_worker,
+                                 args=(model, rank, workers, shared, results))
+                 for rank in range(workers)]
+    for process in processes:
+        process.start()
+    while True:
+        try:
+            best_valid_perf, best_test_perf = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if any(process.exitcode not in (None, 0)
+                   for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError('a data-parallel worker failed')
+    for process in processes:
+        process.join()
+    model.best_valid_perf = best_valid_perf
+    model.best_test_perf = best_test_perf
+    print('\nBest Valid performance:', best_valid_perf)
+    print('\tBest Test performance:', best_test_perf)
+    logging.info('\tBest Test performance:' + str(best_test_perf))
+    return best_valid_perf, best_test_perf
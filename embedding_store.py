@@ -0,0 +1,135 @@
+import argparse
+import io
+import numpy as np
+import os
+
+
+class EmbeddingStore:
+    def __init__(self, emb_file, day_major=False, tickers=None):
+        '''
+        read-only, memory-mapped view of a pretrained sequential embedding
+        emb_file: .npy file, N x T x U (ticker-major, as produced by the
+            rank lstm) or T x N x U (day-major, see convert_embedding)
+        day_major: layout of emb_file
+        tickers: number of tickers, to check the layout
+        '''
+        self.emb_file = emb_file
+        self.day_major = day_major
+        self.data = np.load(emb_file, mmap_mode='r')
+        if day_major:
+            self.shape = (self.data.shape[1], self.data.shape[0],
+                          self.data.shape[2])
+        else:
+            self.shape = self.data.shape
+        if tickers is not None:
+            assert self.shape[0] == tickers, \
+                'embedding has %d tickers, expected %d (wrong layout?)' % \
+                (self.shape[0], tickers)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def day(self, offset):
+        '''
+        returns: N x U float32 embedding of one day, upcast from the stored
+            precision
+        '''
+        if self.day_major:
+            emb = self.data[offset]
+        else:
+            emb = self.data[:, offset, :]
+        return np.asarray(emb, dtype=np.float32)
+
+
+def convert_embedding(src_file, dst_file, day_major=True, dtype=np.float16,
+                      chunk_days=64):
+    '''
+    rewrite a ticker-major N x T x U embedding file in the layout and
+    precision read by EmbeddingStore, chunk by chunk of days so that the
+    source never has to fit into memory
+    '''
+    src = np.load(src_file, mmap_mode='r')
+    tickers, days, units = src.shape
+    shape = (days, tickers, units) if day_major else src.shape
+    dst = np.lib.format.open_memmap(dst_file, mode='w+', dtype=dtype,
+                                    shape=shape)
+    for start in range(0, days, chunk_days):
+        chunk = src[:, start: start + chunk_days, :]
+        if day_major:
+            dst[start: start + chunk_days] = chunk.transpose(1, 0, 2)
+        else:
+            dst[:, start: start + chunk_days, :] = chunk
+    dst.flush()
+    del dst
+    print('embedding', src.shape, src.dtype, '->', shape, np.dtype(dtype))
+
+
+def append_days(emb_file, days, day_major=True):
+    '''
+    append the embedding of new days to emb_file in place
+    days: D x N x U for a day-major file, N x D x U otherwise
+    '''
+    days = np.asarray(days)
+    with open(emb_file, 'r+b') as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = \
+                np.lib.format.read_array_header_2_0(fp)
+        header_len = fp.tell()
+        assert not fortran_order, 'fortran ordered embedding file'
+        if day_major:
+            assert days.shape[1:] == shape[1:], 'shape mis-match'
+            new_shape = (shape[0] + days.shape[0],) + shape[1:]
+        else:
+            assert days.shape[0] == shape[0] and days.shape[2] == shape[2], \
+                'shape mis-match'
+            new_shape = (shape[0], shape[1] + days.shape[1], shape[2])
+
+        header = io.BytesIO()
+        header_data = {'descr': np.lib.format.dtype_to_descr(dtype),
+                       'fortran_order': False, 'shape': new_shape}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, header_data)
+        else:
+            np.lib.format.write_array_header_2_0(header, header_data)
+        # day-major days go to the end of the file, only the header changes
+        if day_major and len(header.getvalue()) == header_len:
+            fp.seek(0, os.SEEK_END)
+            fp.write(np.ascontiguousarray(days, dtype=dtype).tobytes())
+            fp.flush()
+            fp.seek(0)
+            fp.write(header.getvalue())
+            return
+
+    # the header grew or the file is ticker-major, rewrite it
+    src = np.load(emb_file, mmap_mode='r')
+    tmp_file = emb_file + '.tmp.npy'
+    dst = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype,
+                                    shape=new_shape)
+    if day_major:
+        dst[:shape[0]] = src
+        dst[shape[0]:] = days
+    else:
+        dst[:, :shape[1], :] = src
+        dst[:, shape[1]:, :] = days
+    dst.flush()
+    del dst, src
+    os.replace(tmp_file, emb_file)
+
+
+if __name__ == '__main__':
+    desc = 'convert a pretrained sequential embedding for EmbeddingStore'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('src', help='ticker-major N x T x U .npy file')
+    parser.add_argument('dst', help='output .npy file')
+    parser.add_argument('-ticker_major', action='store_true',
+                        help='keep the N x T x U layout')
+    parser.add_argument('-dtype', type=str, default='float16',
+                        help='storage precision: float16 or float32')
+    args = parser.parse_args()
+    convert_embedding(args.src, args.dst, day_major=not args.ticker_major,
+                      dtype=np.dtype(args.dtype))
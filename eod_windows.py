@@ -0,0 +1,49 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+class EODWindows:
+    def __init__(self, eod_data, mask_data, seq):
+        '''
+        the [offset, offset + seq) windows of the raw EOD features as
+        read-only views, with the normalization statistics of every window
+        computed once
+        eod_data: N x T x F, as loaded by load_EOD_data
+        mask_data: N x T, 0 on missing days, which the statistics skip
+        seq: window length
+        '''
+        self.seq = seq
+        # T x N x F, so that every window is one contiguous block
+        self.days = np.ascontiguousarray(np.transpose(eod_data, (1, 0, 2)),
+                                         dtype=np.float32)
+        days, tickers, features = self.days.shape
+        self.count = days - seq + 1
+        step = self.days.strides[0]
+        # windows x seq x N x F, overlapping views of self.days
+        self.windows = as_strided(
+            self.days, (self.count, seq, tickers, features),
+            (step, step) + self.days.strides[1:], writeable=False)
+
+        # per-window sums over the valid days by differences of cumsums
+        valid = np.transpose(mask_data)[:, :, None].astype(np.float64)
+        totals = [np.concatenate([np.zeros((1, tickers, features)),
+                                  np.cumsum(valid * self.days ** power,
+                                            axis=0)])
+                  for power in range(3)]
+        count, total, total_sq = [values[seq:] - values[:-seq]
+                                  for values in totals]
+        count = np.maximum(count, 1.0)
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+        # constant windows are only centered
+        std[std < 1e-6] = 1.0
+        # windows x N x F
+        self.mean = mean.astype(np.float32)
+        self.std = std.astype(np.float32)
+
+    def window(self, offset):
+        '''
+        returns: the seq x N x F window at offset and its N x F mean and
+            standard deviation, views without a copy
+        '''
+        return self.windows[offset], self.mean[offset], self.std[offset]
@@ -1,89 +1,428 @@
-import math
+import copy
+
 import numpy as np
-import scipy.stats as sps
-from sklearn.metrics import mean_squared_error, mean_absolute_error
 
 
-def evaluate(prediction, ground_truth, mask, report=False):
+def masked_top_k(scores, valid, k):
+    '''
+    scores: N x T
+    valid: N x T boolean, tickers to consider on each day
+    k: number of tickers to pick per day
+    returns: k x T indices of the highest valid scores (best first) and the
+        k x T flags telling whether each pick is a valid ticker
+    '''
+    k = min(k, scores.shape[0])
+    masked = np.where(valid, scores, -np.inf)
+    if k < scores.shape[0]:
+        top = np.argpartition(-masked, k - 1, axis=0)[:k]
+    else:
+        top = np.tile(np.arange(scores.shape[0])[:, None],
+                      (1, scores.shape[1]))
+    order = np.argsort(-np.take_along_axis(masked, top, axis=0), axis=0,
+                       kind='stable')
+    top = np.take_along_axis(top, order, axis=0)
+    return top, np.take_along_axis(valid, top, axis=0)
+
+
+def daily_metrics(prediction, ground_truth, mask, top_k=(1, 5, 10)):
+    '''
+    per-day terms of the ranking metrics, vectorized over all days
+    prediction, ground_truth, mask: N x T
+    returns: dict of length-T arrays
+        'hit': the day has at least one valid ticker
+        'rr': reciprocal rank of the predicted top-1 in the ground truth
+        'ret<k>': mean ground-truth return of the predicted top-k
+    '''
+    valid = mask >= 0.5
+    days = np.arange(prediction.shape[1])
+    pre_top, pre_valid = masked_top_k(prediction, valid, max(top_k))
+
+    # position of the predicted top-1 among the valid ground-truth ranking:
+    # the valid tickers from the top of the ground-truth argsort down to the
+    # pick, ties in the order of np.argsort as in the per-day loop
+    gt_position = np.empty(ground_truth.shape, dtype=int)
+    gt_position[np.argsort(ground_truth, axis=0), days] = \
+        np.arange(ground_truth.shape[0])[:, None]
+    top1_pos_in_gt = np.sum(
+        valid & (gt_position >= gt_position[pre_top[0], days]), axis=0)
+    hit = pre_valid[0]
+    metrics = {
+        'hit': hit,
+        'rr': np.where(hit, 1.0 / top1_pos_in_gt, 0.0)
+    }
+
+    pre_ret = np.where(pre_valid, ground_truth[pre_top, days], 0.0)
+    for k in top_k:
+        metrics['ret%d' % k] = np.sum(pre_ret[:k], axis=0) / k
+    return metrics
+
+
+def evaluate(prediction, ground_truth, mask, report=False, horizons=None):
+    '''
+    prediction, ground_truth, mask: N x T, or N x T x H for H horizons, then
+        every metric is reported per horizon as <metric>@<horizon>
+    '''
     assert ground_truth.shape == prediction.shape, 'shape mis-match'
+    if prediction.ndim == 3:
+        performance = {}
+        for h, horizon in enumerate(horizons or
+                                    range(1, prediction.shape[2] + 1)):
+            for name, value in evaluate(prediction[:, :, h],
+                                        ground_truth[:, :, h],
+                                        mask[:, :, h], report).items():
+                performance['%s@%d' % (name, horizon)] = value
+        return performance
     print(prediction.shape)
     performance = {}
     performance['mse'] = np.linalg.norm((prediction - ground_truth) * mask)**2\
         / np.sum(mask)
-    mrr_top = 0.0
-    all_miss_days_top = 0
-    bt_long = 1.0
-    bt_long5 = 1.0
-    bt_long10 = 1.0
-
-    for i in range(prediction.shape[1]):
-        rank_gt = np.argsort(ground_truth[:, i])
-        gt_top1 = set()
-        gt_top5 = set()
-        gt_top10 = set()
-        for j in range(1, prediction.shape[0] + 1):
-            cur_rank = rank_gt[-1 * j]
-            if mask[cur_rank][i] < 0.5:
-                continue
-            if len(gt_top1) < 1:
-                gt_top1.add(cur_rank)
-            if len(gt_top5) < 5:
-                gt_top5.add(cur_rank)
-            if len(gt_top10) < 10:
-                gt_top10.add(cur_rank)
-
-        rank_pre = np.argsort(prediction[:, i])
-
-        pre_top1 = set()
-        pre_top5 = set()
-        pre_top10 = set()
-        for j in range(1, prediction.shape[0] + 1):
-            cur_rank = rank_pre[-1 * j]
-            if mask[cur_rank][i] < 0.5:
-                continue
-            if len(pre_top1) < 1:
-                pre_top1.add(cur_rank)
-            if len(pre_top5) < 5:
-                pre_top5.add(cur_rank)
-            if len(pre_top10) < 10:
-                pre_top10.add(cur_rank)
-
-        # calculate mrr of top1
-        top1_pos_in_gt = 0
-        for j in range(1, prediction.shape[0] + 1):
-            cur_rank = rank_gt[-1 * j]
-            if mask[cur_rank][i] < 0.5:
-                continue
-            else:
-                top1_pos_in_gt += 1
-                if cur_rank in pre_top1:
-                    break
-        if top1_pos_in_gt == 0:
-            all_miss_days_top += 1
-        else:
-            mrr_top += 1.0 / top1_pos_in_gt
-
-        # back testing on top 1
-        real_ret_rat_top = ground_truth[list(pre_top1)[0]][i]
-        bt_long += real_ret_rat_top
-
-        # back testing on top 5
-        real_ret_rat_top5 = 0
-        for pre in pre_top5:
-            real_ret_rat_top5 += ground_truth[pre][i]
-        real_ret_rat_top5 /= 5
-        bt_long5 += real_ret_rat_top5
-
-        # back testing on top 10
-        real_ret_rat_top10 = 0
-        for pre in pre_top10:
-            real_ret_rat_top10 += ground_truth[pre][i]
-        real_ret_rat_top10 /= 10
-        bt_long10 += real_ret_rat_top10
-
-
-    performance['mrrt'] = mrr_top / (prediction.shape[1] - all_miss_days_top)
-    performance['btl'] = bt_long
-    # performance['btl5'] = bt_long5
-    # performance['btl10'] = bt_long10
+
+    metrics = daily_metrics(prediction, ground_truth, mask)
+    performance['mrrt'] = np.sum(metrics['rr']) / np.sum(metrics['hit'])
+    # back testing on top 1, 5 and 10
+    performance['btl'] = 1.0 + np.sum(metrics['ret1'])
+    performance['btl5'] = 1.0 + np.sum(metrics['ret5'])
+    performance['btl10'] = 1.0 + np.sum(metrics['ret10'])
     return performance
+
+
+class StreamingEvaluator:
+    def __init__(self, buffer_days=None, top_k=(1, 5, 10)):
+        '''
+        accumulates the metrics of evaluate one day, or one batch of days,
+        at a time, without keeping the N x T matrices
+        buffer_days: if set, keep the raw predictions, ground truth and mask
+            of the last buffer_days days
+        '''
+        self.buffer_days = buffer_days
+        self.top_k = top_k
+        self.reset()
+
+    def reset(self):
+        self.days = 0
+        self.sq_err = 0.0
+        self.mask_sum = 0.0
+        self.rr_sum = 0.0
+        self.hit_days = 0
+        self.ret_sum = dict((k, 0.0) for k in self.top_k)
+        # a new buffer per pass, so that arrays handed out by buffered()
+        # are never overwritten
+        self._buffer = None
+        self._buffer_pos = 0
+
+    def update(self, prediction, ground_truth, mask):
+        '''
+        prediction, ground_truth, mask: N (one day) or N x B (B days)
+        '''
+        prediction = np.asarray(prediction, dtype=float)
+        ground_truth = np.asarray(ground_truth, dtype=float)
+        mask = np.asarray(mask, dtype=float)
+        if prediction.ndim == 1:
+            prediction = prediction[:, None]
+            ground_truth = ground_truth[:, None]
+            mask = mask[:, None]
+        assert ground_truth.shape == prediction.shape, 'shape mis-match'
+        self.sq_err += np.sum(np.square((prediction - ground_truth) * mask))
+        self.mask_sum += np.sum(mask)
+
+        metrics = daily_metrics(prediction, ground_truth, mask, self.top_k)
+        self.rr_sum += np.sum(metrics['rr'])
+        self.hit_days += np.sum(metrics['hit'])
+        for k in self.top_k:
+            self.ret_sum[k] += np.sum(metrics['ret%d' % k])
+        self.days += prediction.shape[1]
+
+        if self.buffer_days:
+            self._store(prediction, ground_truth, mask)
+
+    def _store(self, prediction, ground_truth, mask):
+        if self._buffer is None:
+            self._buffer = np.zeros([3, prediction.shape[0], self.buffer_days],
+                                    dtype=float)
+        # only the last buffer_days days can survive
+        days = min(prediction.shape[1], self.buffer_days)
+        columns = (self._buffer_pos + prediction.shape[1] - days +
+                   np.arange(days)) % self.buffer_days
+        self._buffer[0][:, columns] = prediction[:, -days:]
+        self._buffer[1][:, columns] = ground_truth[:, -days:]
+        self._buffer[2][:, columns] = mask[:, -days:]
+        self._buffer_pos += prediction.shape[1]
+
+    def buffered(self):
+        '''
+        returns: prediction, ground truth and mask of the buffered days
+            (N x min(days, buffer_days), oldest first)
+        '''
+        if self._buffer is None:
+            return None, None, None
+        if self._buffer_pos <= self.buffer_days:
+            buffer = self._buffer[:, :, :self._buffer_pos]
+        else:
+            buffer = np.roll(self._buffer,
+                             -(self._buffer_pos % self.buffer_days), axis=2)
+        return buffer[0], buffer[1], buffer[2]
+
+    def state(self):
+        '''
+        returns: the accumulators as a flat array, see add_state
+        '''
+        return np.array([self.days, self.sq_err, self.mask_sum, self.rr_sum,
+                         self.hit_days] +
+                        [self.ret_sum[k] for k in self.top_k], dtype=float)
+
+    def add_state(self, state):
+        '''
+        adds the accumulators of an evaluator over other days, e.g. of
+        another process
+        '''
+        self.days += int(state[0])
+        self.sq_err += state[1]
+        self.mask_sum += state[2]
+        self.rr_sum += state[3]
+        self.hit_days += int(state[4])
+        for k, ret in zip(self.top_k, state[5:]):
+            self.ret_sum[k] += ret
+
+    def performance(self):
+        performance = {}
+        performance['mse'] = self.sq_err / self.mask_sum
+        performance['mrrt'] = self.rr_sum / self.hit_days
+        for k in self.top_k:
+            performance['btl' if k == 1 else 'btl%d' % k] = \
+                1.0 + self.ret_sum[k]
+        return performance
+
+
+class HorizonEvaluator:
+    def __init__(self, horizons=(1,), buffer_days=None, top_k=(1, 5, 10)):
+        '''
+        a StreamingEvaluator per prediction horizon, the metrics of a single
+        horizon are reported as by StreamingEvaluator, the ones of several
+        horizons as <metric>@<horizon>
+        '''
+        self.horizons = list(horizons)
+        self.evaluators = [StreamingEvaluator(buffer_days, top_k)
+                           for _ in self.horizons]
+
+    def reset(self):
+        for evaluator in self.evaluators:
+            evaluator.reset()
+
+    def update(self, prediction, ground_truth, mask):
+        '''
+        prediction, ground_truth, mask: N x H (one day) or N x B x H (B days)
+        '''
+        for h, evaluator in enumerate(self.evaluators):
+            evaluator.update(prediction[..., h], ground_truth[..., h],
+                             mask[..., h])
+
+    def buffered(self):
+        '''
+        returns: prediction, ground truth and mask of the buffered days, N x D
+            for a single horizon and N x D x H otherwise
+        '''
+        buffers = [evaluator.buffered() for evaluator in self.evaluators]
+        if len(buffers) == 1 or buffers[0][0] is None:
+            return buffers[0]
+        return tuple(np.stack([buffer[i] for buffer in buffers], axis=2)
+                     for i in range(3))
+
+    def state(self):
+        return np.concatenate([evaluator.state()
+                               for evaluator in self.evaluators])
+
+    def add_state(self, state):
+        for evaluator, part in zip(self.evaluators, np.split(
+                np.asarray(state), len(self.evaluators))):
+            evaluator.add_state(part)
+
+    def performance(self):
+        if len(self.evaluators) == 1:
+            return self.evaluators[0].performance()
+        performance = {}
+        for horizon, evaluator in zip(self.horizons, self.evaluators):
+            for name, value in evaluator.performance().items():
+                performance['%s@%d' % (name, horizon)] = value
+        return performance
+
+
+def relation_groups(rel_encoding):
+    '''
+    rel_encoding: N x N x K, e.g. the sector_industry relation
+    returns: N x G membership of the tickers in the G relation types that
+        link different tickers (the self-loop type is skipped), and the
+        indices of those types
+    '''
+    related = rel_encoding != 0
+    diagonal = np.arange(rel_encoding.shape[0])
+    self_only = np.sum(related, axis=(0, 1)) == \
+        np.sum(related[diagonal, diagonal], axis=0)
+    types = np.nonzero(~self_only)[0]
+    return np.any(related[:, :, types], axis=1), types
+
+
+class GroupedEvaluator:
+    def __init__(self, membership, names=None, top_k=(1, 5, 10)):
+        '''
+        the metrics of evaluate within every group of tickers (a ticker may
+        be in several groups), computed for all groups at once
+        membership: N x G boolean, see relation_groups; empty groups are
+            dropped
+        names: of the G groups, their indices by default
+        '''
+        membership = np.asarray(membership, dtype=bool)
+        names = list(range(membership.shape[1])) if names is None else \
+            list(names)
+        keep = np.any(membership, axis=0)
+        self.names = [name for name, kept in zip(names, keep) if kept]
+        self.top_k = top_k
+        # (ticker, group) pairs sorted by group, a segment per group
+        self.pair_group, self.pair_ticker = np.nonzero(membership[:, keep].T)
+        self.starts = np.searchsorted(self.pair_group,
+                                      np.arange(len(self.names)))
+        self.ends = np.append(self.starts[1:], len(self.pair_group))
+        self.position = np.arange(len(self.pair_group)) - \
+            self.starts[self.pair_group]
+        self.group_key = self.pair_group.astype(
+            np.int16 if len(self.names) < 2 ** 15 else np.int32)
+        self.reset()
+
+    @classmethod
+    def from_relation(cls, rel_encoding, names=None, top_k=(1, 5, 10)):
+        '''
+        names: of the K relation types
+        '''
+        membership, types = relation_groups(rel_encoding)
+        if names is None:
+            names = types
+        else:
+            names = [names[t] for t in types]
+        return cls(membership, names, top_k)
+
+    @classmethod
+    def from_labels(cls, labels, top_k=(1, 5, 10)):
+        '''
+        labels: group of every ticker, e.g. a sector or a partition
+        '''
+        labels = np.asarray(labels)
+        names = np.unique(labels)
+        return cls(labels[:, None] == names[None, :], names, top_k)
+
+    def reset(self):
+        groups = len(self.names)
+        self.days = 0
+        self.sq_err = np.zeros(groups)
+        self.mask_sum = np.zeros(groups)
+        self.rr_sum = np.zeros(groups)
+        self.hit_days = np.zeros(groups)
+        self.ret_sum = dict((k, np.zeros(groups)) for k in self.top_k)
+
+    def update(self, prediction, ground_truth, mask):
+        '''
+        prediction, ground_truth, mask: N (one day) or N x B (B days)
+        '''
+        prediction = np.asarray(prediction, dtype=float)
+        ground_truth = np.asarray(ground_truth, dtype=float)
+        mask = np.asarray(mask, dtype=float)
+        if prediction.ndim == 1:
+            prediction = prediction[:, None]
+            ground_truth = ground_truth[:, None]
+            mask = mask[:, None]
+        # day-major B x P pairs, every day sorted as one contiguous row
+        prediction = np.ascontiguousarray(prediction[self.pair_ticker].T)
+        ground_truth = np.ascontiguousarray(ground_truth[self.pair_ticker].T)
+        mask = np.ascontiguousarray(mask[self.pair_ticker].T)
+        valid = mask >= 0.5
+        self.sq_err += np.add.reduceat(
+            np.square((prediction - ground_truth) * mask), self.starts, axis=1
+        ).sum(axis=0)
+        self.mask_sum += np.add.reduceat(mask, self.starts, axis=1).sum(axis=0)
+
+        # segment top-k: order every day by descending score with the
+        # invalid tickers last, then by group with a stable sort of small
+        # integers (a radix sort), the segments stay in place
+        order = np.argsort(-np.where(valid, prediction, -np.inf), axis=1)
+        order = np.take_along_axis(order, np.argsort(
+            self.group_key[order], axis=1, kind='stable'), axis=1)
+        sorted_gt = np.take_along_axis(ground_truth, order, axis=1)
+        sorted_valid = np.take_along_axis(valid, order, axis=1)
+
+        # position of the predicted top-1 among the valid ground-truth ranking
+        # of its group, ties in the order of np.argsort over the tickers of
+        # the group, as evaluate on them
+        hit = sorted_valid[:, self.starts]
+        days = np.arange(prediction.shape[0])[:, None]
+        gt_position = np.empty(ground_truth.shape, dtype=int)
+        for start, end in zip(self.starts, self.ends):
+            gt_position[days, start + np.argsort(
+                ground_truth[:, start:end], axis=1)] = np.arange(end - start)
+        top1 = np.take_along_axis(gt_position, order[:, self.starts], axis=1)
+        better = valid & (gt_position >= top1[:, self.pair_group])
+        top1_pos_in_gt = np.add.reduceat(better.astype(int), self.starts,
+                                         axis=1)
+        self.rr_sum += np.sum(np.where(hit, 1.0 / top1_pos_in_gt, 0.0),
+                              axis=0)
+        self.hit_days += np.sum(hit, axis=0)
+        for k in self.top_k:
+            picks = sorted_valid & (self.position < k)
+            self.ret_sum[k] += np.add.reduceat(
+                np.where(picks, sorted_gt, 0.0), self.starts, axis=1
+            ).sum(axis=0) / k
+        self.days += prediction.shape[0]
+
+    def performance(self):
+        '''
+        returns: dict of group name to the metrics of evaluate
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mse = self.sq_err / self.mask_sum
+            mrrt = self.rr_sum / self.hit_days
+        performance = {}
+        for g, name in enumerate(self.names):
+            performance[name] = {'mse': mse[g], 'mrrt': mrrt[g]}
+            for k in self.top_k:
+                performance[name]['btl' if k == 1 else 'btl%d' % k] = \
+                    1.0 + self.ret_sum[k][g]
+        return performance
+
+    def evaluate(self, prediction, ground_truth, mask):
+        self.reset()
+        self.update(prediction, ground_truth, mask)
+        return self.performance()
+
+
+class HorizonGroupedEvaluator:
+    def __init__(self, grouped, horizons=(1,)):
+        '''
+        a copy of the GroupedEvaluator grouped per prediction horizon, the
+        metrics of a group for several horizons are named
+        <metric>@<horizon>, as by HorizonEvaluator
+        '''
+        self.horizons = list(horizons)
+        self.evaluators = [copy.deepcopy(grouped) for _ in self.horizons]
+
+    def reset(self):
+        for evaluator in self.evaluators:
+            evaluator.reset()
+
+    def update(self, prediction, ground_truth, mask):
+        '''
+        prediction, ground_truth, mask: N x H (one day) or N x B x H (B days)
+        '''
+        for h, evaluator in enumerate(self.evaluators):
+            evaluator.update(prediction[..., h], ground_truth[..., h],
+                             mask[..., h])
+
+    def performance(self):
+        '''
+        returns: dict of group name to the metrics of every horizon
+        '''
+        if len(self.evaluators) == 1:
+            return self.evaluators[0].performance()
+        performance = {}
+        for horizon, evaluator in zip(self.horizons, self.evaluators):
+            for group, metrics in evaluator.performance().items():
+                for name, value in metrics.items():
+                    performance.setdefault(group, {})[
+                        '%s@%d' % (name, horizon)] = value
+        return performance
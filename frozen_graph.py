@@ -0,0 +1,179 @@
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+GRAPH_FILE = 'graph.pb'
+META_FILE = 'meta.json'
+
+
+def relation_logits(encoding, kernel, bias, alpha=0.2):
+    '''
+    leaky_relu(encoding kernel + bias) of the trained relation layer, the N x
+    N logits of a new relation encoding, e.g. a RelationStore snapshot
+    '''
+    pre_act = np.tensordot(encoding.astype(np.float32), kernel[:, 0],
+                           axes=([2], [0])) + bias[0]
+    return np.where(pre_act > 0, pre_act, alpha * pre_act).astype(np.float32)
+
+
+def _edges(logit, mask):
+    edges = np.stack(np.nonzero(mask == 0), axis=1).astype(np.int32)
+    return edges, logit[edges[:, 0], edges[:, 1]].astype(np.float32)
+
+
+def _relation_inputs(name, logit, mask, sparse):
+    '''
+    placeholders with the exported logits and mask as defaults, fed to swap
+    in another relation without exporting again
+    returns: the logit and mask tensors of the attention
+    '''
+    if not sparse:
+        return tf.placeholder_with_default(logit, [None, None],
+                                           name=name + '_logit'), \
+            tf.placeholder_with_default(mask.astype(np.float32), [None, None],
+                                        name=name + '_mask')
+    edges, values = _edges(logit, mask)
+    edges = tf.placeholder_with_default(edges, [None, 2],
+                                        name=name + '_edges')
+    values = tf.placeholder_with_default(values, [None],
+                                         name=name + '_edge_logit')
+    shape = tf.constant(logit.shape, dtype=tf.int32)
+    # 0 on the edges and -1e9 elsewhere, as rel_mask; exact in float32
+    dense_mask = tf.scatter_nd(edges, tf.fill(tf.shape(values), 1e9),
+                               shape) - 1e9
+    return tf.scatter_nd(edges, values, shape), dense_mask
+
+
+def export_frozen_graph(model, checkpoint, folder, sparse=False):
+    '''
+    writes the scoring graph of model with the weights of checkpoint folded
+    into constants: the N x N x K relation and its dense layer are replaced
+    by the precomputed N x N relation logits, and the losses, optimizer and
+    part/reg heads are stripped
+    sparse: store the logits of the related pairs only, E x 2 edges and E
+        logits, instead of the N x N logits and mask
+    writes folder/graph.pb and folder/meta.json, see FrozenPredictor
+    '''
+    if model.windows is not None:
+        raise ValueError('the frozen graph reads the pretrained embedding, '
+                         'not -raw_windows')
+    graph = tf.Graph()
+    # the dense attention exposes the relation logits to replace
+    modes = model.attn_block, model.fanout, model.clusters
+    model.attn_block, model.fanout, model.clusters = 0, 0, 0
+    try:
+        with graph.as_default():
+            tensors = model.build_graph()
+            saver = tf.train.Saver()
+    finally:
+        model.attn_block, model.fanout, model.clusters = modes
+    if not tensors['relation']:
+        raise ValueError('no relation logits to precompute in this graph')
+    with tf.Session(graph=graph) as sess:
+        saver.restore(sess, checkpoint)
+        frozen = tf.graph_util.convert_variables_to_constants(
+            sess, graph.as_graph_def(), [tensors['return_ratio'].op.name])
+        relation = sess.run(tensors['relation'])
+        prefixes = [name[:-len('_logit')] for name in sorted(relation)
+                    if name.endswith('_logit')]
+        # the dense layer of every relation, e.g. rel and stru_rel of 2way
+        layers = {}
+        for prefix in prefixes:
+            kernel, bias = sess.run(
+                ['%s/%s:0' % (model._layer_name(prefix, shared=False), name)
+                 for name in ('kernel', 'bias')])
+            layers[prefix] = {'kernel': kernel.tolist(),
+                              'bias': bias.tolist()}
+
+    export = tf.Graph()
+    with export.as_default():
+        input_map = {}
+        for name in ('feature', 'base_price'):
+            input_map[tensors[name].name] = tf.placeholder(
+                tf.float32, tensors[name].shape, name=name)
+        for prefix in prefixes:
+            logit, mask = _relation_inputs(
+                prefix, relation[prefix + '_logit'],
+                relation[prefix + '_mask'], sparse)
+            input_map[tensors['relation'][prefix + '_logit'].name] = logit
+            input_map[tensors['relation'][prefix + '_mask'].name] = mask
+        return_ratio, = tf.import_graph_def(
+            frozen, input_map=input_map,
+            return_elements=[tensors['return_ratio'].name], name='frozen')
+        tf.identity(return_ratio, name='return_ratio')
+    # the relation constant and layer are no longer reachable from the output
+    graph_def = tf.graph_util.extract_sub_graph(export.as_graph_def(),
+                                                ['return_ratio'])
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(os.path.join(folder, GRAPH_FILE), 'wb') as fout:
+        fout.write(graph_def.SerializeToString())
+    with open(os.path.join(folder, META_FILE), 'w') as fout:
+        json.dump({'tickers': len(model.tickers),
+                   'unit': model.parameters['unit'],
+                   'horizons': model.horizons, 'relations': prefixes,
+                   'sparse': sparse, 'relation_layers': layers}, fout)
+    print('frozen graph of %d nodes written to %s' % (len(graph_def.node),
+                                                      folder))
+    return graph_def
+
+
+class FrozenPredictor:
+    def __init__(self, folder, config=None):
+        '''
+        scores days with a graph written by export_frozen_graph
+        config: tf.ConfigProto of the session, e.g. from session_config
+        '''
+        with open(os.path.join(folder, META_FILE)) as fin:
+            self.meta = json.load(fin)
+        graph_def = tf.GraphDef()
+        with open(os.path.join(folder, GRAPH_FILE), 'rb') as fin:
+            graph_def.ParseFromString(fin.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.sess = tf.Session(graph=self.graph, config=config)
+        # kernel and bias of the dense layer of every relation prefix
+        self.layers = dict(
+            (prefix, (np.array(layer['kernel'], dtype=np.float32),
+                      np.array(layer['bias'], dtype=np.float32)))
+            for prefix, layer in self.meta['relation_layers'].items())
+        # relation feeds replacing the exported defaults, see swap_relation
+        self.relation_feed = {}
+
+    def swap_relation(self, encoding, mask, prefix='rel'):
+        '''
+        scores with the N x N x K relation encoding and its N x N mask from
+        now on, e.g. a RelationStore snapshot with the same N
+        prefix: relation replaced, rel or, with -unify 2way, stru_rel; with
+            2way, rel is encoded by all relation types but the last and
+            stru_rel by the last one, N x N x 1
+        '''
+        if prefix not in self.layers:
+            raise ValueError('no relation %s in the exported graph, only %s'
+                             % (prefix, ', '.join(sorted(self.layers))))
+        kernel, bias = self.layers[prefix]
+        logit = relation_logits(encoding, kernel, bias)
+        if self.meta['sparse']:
+            edges, values = _edges(logit, mask)
+            self.relation_feed[prefix + '_edges:0'] = edges
+            self.relation_feed[prefix + '_edge_logit:0'] = values
+        else:
+            self.relation_feed[prefix + '_logit:0'] = logit
+            self.relation_feed[prefix + '_mask:0'] = mask.astype(np.float32)
+
+    def predict(self, feature, base_price):
+        '''
+        feature: N x U embeddings of a day
+        base_price: N x 1 prices of the day
+        returns: N x H predicted return ratios
+        '''
+        feed_dict = {'feature:0': feature, 'base_price:0': base_price}
+        feed_dict.update(self.relation_feed)
+        return self.sess.run('return_ratio:0', feed_dict)
+
+    def close(self):
+        self.sess.close()
@@ -9,9 +9,11 @@ def load_EOD_data(data_path, market_name, tickers, steps=1):
     market_name: 'NASDAQ'
     tickers: ../data/NASDAQ_tickers_qualify_dr-0.98_min-5_smooth.csv
     relation_name: wiki_data 
-    steps: 计算return的步数
+    steps: 计算return的步数, or a list of horizons, then ground_truth is
+        N x day x len(steps)
     '''
-    
+    horizons = list(steps) if isinstance(steps, (list, tuple)) else [steps]
+
     eod_data = []
     masks = []
     ground_truth = []
@@ -32,23 +34,28 @@ def load_EOD_data(data_path, market_name, tickers, steps=1):
                                  single_EOD.shape[1] - 1], dtype=np.float32)
             masks = np.ones([len(tickers), single_EOD.shape[0]],
                             dtype=np.float32)
-            ground_truth = np.zeros([len(tickers), single_EOD.shape[0]],
-                                    dtype=np.float32)
+            ground_truth = np.zeros([len(tickers), single_EOD.shape[0],
+                                     len(horizons)], dtype=np.float32)
             base_price = np.zeros([len(tickers), single_EOD.shape[0]],
                                   dtype=np.float32)
         for row in range(single_EOD.shape[0]):
             if abs(single_EOD[row][-1] + 1234) < 1e-8:
                 masks[index][row] = 0.0
-            elif row > steps - 1 and abs(single_EOD[row - steps][-1] + 1234) \
-                    > 1e-8:
-                ground_truth[index][row] = \
-                    (single_EOD[row][-1] - single_EOD[row - steps][-1]) / \
-                    single_EOD[row - steps][-1]
+            else:
+                for h, step in enumerate(horizons):
+                    if row > step - 1 and \
+                            abs(single_EOD[row - step][-1] + 1234) > 1e-8:
+                        ground_truth[index][row][h] = \
+                            (single_EOD[row][-1] -
+                             single_EOD[row - step][-1]) / \
+                            single_EOD[row - step][-1]
             for col in range(single_EOD.shape[1]):
                 if abs(single_EOD[row][col] + 1234) < 1e-8:
                     single_EOD[row][col] = 1.1
         eod_data[index, :, :] = single_EOD[:, 1:]
         base_price[index, :] = single_EOD[:, -1]
+    if not isinstance(steps, (list, tuple)):
+        ground_truth = ground_truth[:, :, 0]
     return eod_data, masks, ground_truth, base_price
 
 
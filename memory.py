@@ -0,0 +1,132 @@
+import logging
+import os
+import resource
+import sys
+
+import numpy as np
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_mb():
+    '''
+    returns: current resident set size of this process, in MB
+    '''
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / 2.0 ** 20
+    try:
+        with open('/proc/self/statm') as fin:
+            pages = int(fin.read().split()[1])
+        return pages * resource.getpagesize() / 2.0 ** 20
+    except IOError:
+        # peak instead of current, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def largest_arrays(holder, top=3):
+    '''
+    returns: [name, MB, memory-mapped] of the largest NumPy arrays among the
+        attributes of holder, and one level below (e.g. an EmbeddingStore)
+    '''
+    arrays = []
+    for name, value in vars(holder).items():
+        if isinstance(value, np.ndarray):
+            arrays.append((name, value))
+        elif hasattr(value, '__dict__') and not isinstance(value, type):
+            arrays.extend(('%s.%s' % (name, sub_name), sub_value)
+                          for sub_name, sub_value in vars(value).items()
+                          if isinstance(sub_value, np.ndarray))
+    arrays.sort(key=lambda item: -item[1].nbytes)
+    return [[name, value.nbytes / 2.0 ** 20, isinstance(value, np.memmap)]
+            for name, value in arrays[:top]]
+
+
+def largest_tf_buffers(top=3):
+    '''
+    returns: [op name, MB] of the largest constants and variables in the
+        default TF graph, empty if TF has not been imported
+    '''
+    tf = sys.modules.get('tensorflow')
+    if tf is None:
+        return []
+    buffers = []
+    for op in tf.get_default_graph().get_operations():
+        if op.type not in ('Const', 'VariableV2'):
+            continue
+        elements = op.outputs[0].shape.num_elements()
+        if elements:
+            buffers.append([op.name, elements * op.outputs[0].dtype.size /
+                            2.0 ** 20])
+    buffers.sort(key=lambda item: -item[1])
+    return buffers[:top]
+
+
+def estimate_graph_mb(tickers, relations, two_way=False, reg=False,
+                      block=0, edges=0):
+    '''
+    rough size of the N x N buffers of the training graph: the N x N x K
+    relation constant and, per attention, the N x N relation weight, mask,
+    logits, masked logits, softmax and their gradients, in float32
+    block: columns of the tiled attention, whose relation constant is uint8
+        and whose buffers are N x block, see tiled_attention.py
+    edges: related pairs of the edge list attention, whose relation and
+        buffers are per edge, see sparse_attention.py
+    '''
+    pairs = tickers * tickers
+    if edges:
+        floats = edges * relations / 4.0 + edges * 8
+    elif block:
+        floats = pairs * relations / 4.0 + tickers * min(block, tickers) * 8
+    else:
+        floats = pairs * relations + pairs * 8
+    if two_way:
+        floats += pairs * 8
+    if reg:
+        floats += pairs * relations + pairs * 8
+    return floats * 4 / 2.0 ** 20
+
+
+class MemoryMonitor:
+    def __init__(self, profiler=None, budget_mb=None):
+        '''
+        profiler: Profiler the snapshots are logged to
+        budget_mb: RSS budget, warn when it is (about to be) exceeded
+        '''
+        self.profiler = profiler
+        self.budget_mb = budget_mb
+        self.peak_mb = 0.0
+
+    def snapshot(self, stage, holder=None):
+        rss = rss_mb()
+        self.peak_mb = max(self.peak_mb, rss)
+        arrays = largest_arrays(holder) if holder is not None else []
+        buffers = largest_tf_buffers()
+        print('memory after %s: %.1f MB RSS' % (stage, rss))
+        if self.profiler is not None:
+            self.profiler.log('memory', stage=stage, rss_mb=rss,
+                              largest_numpy=arrays, largest_tf=buffers)
+        if self.budget_mb is not None and rss > self.budget_mb:
+            self.warn('%.1f MB RSS after %s exceeds the budget of %.1f MB' %
+                      (rss, stage, self.budget_mb))
+        return rss
+
+    def check_budget(self, stage, extra_mb):
+        '''
+        warns if allocating extra_mb on top of the current RSS would exceed
+        the budget, call it before building large buffers
+        '''
+        if self.budget_mb is None:
+            return True
+        rss = rss_mb()
+        if rss + extra_mb <= self.budget_mb:
+            return True
+        self.warn('%s needs about %.1f MB on top of %.1f MB RSS, over the '
+                  'budget of %.1f MB' % (stage, extra_mb, rss,
+                                         self.budget_mb))
+        return False
+
+    def warn(self, message):
+        print('WARNING:', message)
+        logging.warning(message)
@@ -0,0 +1,152 @@
+import copy
+import logging
+from time import time
+
+import numpy as np
+import tensorflow as tf
+
+from data_parallel import evaluate_days
+from evaluator import HorizonEvaluator
+from thread_tuner import apply_thread_config, load_thread_config, \
+    session_config
+
+
+def _train_offsets(model):
+    '''
+    returns: the shuffled train days of model, in the order of train
+    '''
+    seq_len = model.parameters['seq']
+    end_index = model.valid_index - seq_len - model.steps + 1
+    start_index = int(end_index * (1 - model.ratio))
+    batch_offsets = np.arange(start=0, stop=model.valid_index, dtype=int)
+    np.random.seed(model.seed)
+    np.random.shuffle(batch_offsets)
+    return batch_offsets[start_index:end_index]
+
+
+def _interleave(counts):
+    '''
+    spreads the days of every market evenly over an epoch
+    counts: train days of every market
+    returns: (market, day) pairs, e.g. 2 markets of 4 and 2 days give
+        (0, 0), (1, 0), (0, 1), (0, 2), (1, 1), (0, 3)
+    '''
+    return sorted(((m, k) for m, count in enumerate(counts)
+                   for k in range(count)),
+                  key=lambda pair: ((pair[1] + 0.5) / counts[pair[0]],
+                                    pair[0]))
+
+
+def train_multi_market(models, market_heads=False):
+    '''
+    trains one model on the days of several markets in one session: the
+    head, tail and prediction layers are shared, the relation layers, whose
+    relation types differ per market, are not
+    models: ReRaLSTM of every market, with its data loaded and the same
+        parameters, e.g. -u, and no TF session created yet
+    market_heads: a prediction layer per market instead of a shared one
+    returns: best validation and test performance of every market, at the
+        epoch with the lowest validation loss over all markets
+    '''
+    first = models[0]
+    for model in models:
+        model.market_scope = model.market_name
+        model.market_heads = market_heads
+    t0 = time()
+    adam = tf.train.AdamOptimizer(learning_rate=first.parameters['lr'])
+    with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+        graphs = [model.build_graph(optimizer=adam) for model in models]
+    thread_config = first.thread_config or load_thread_config(
+        max(len(model.tickers) for model in models),
+        first.parameters['unit'], first.thread_file)
+    thread_limiter = apply_thread_config(thread_config)
+    sess = tf.Session(config=session_config(thread_config))
+    sess.run(tf.global_variables_initializer())
+    if first.warm_start is not None:
+        tf.train.Saver().restore(sess, first.warm_start)
+    for model in models:
+        model._relation_cache = (None, {})
+    first.profiler.record('graph', time() - t0)
+
+    seq_len = first.parameters['seq']
+    valid_offsets, test_offsets = [], []
+    for model in models:
+        valid_offsets.append(np.arange(
+            model.valid_index - seq_len - model.steps + 1,
+            model.test_index - seq_len - model.steps + 1))
+        test_offsets.append(np.arange(
+            model.test_index - seq_len - model.steps + 1,
+            model.test_end - seq_len - model.steps + 1))
+    best_valid_perf = [{'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0}
+                       for _ in models]
+    best_test_perf = copy.deepcopy(best_valid_perf)
+    best_valid_loss = np.inf
+
+    train_step = 0
+    for i in range(first.epochs):
+        t1 = time()
+        schedules = [_train_offsets(model) for model in models]
+        tra_losses = np.zeros((len(models), 3))
+        for m, k in _interleave([len(days) for days in schedules]):
+            model, graph = models[m], graphs[m]
+            emb_batch, mask_batch, price_batch, gt_batch = \
+                model.get_batch(schedules[m][k])
+            feed_dict = {
+                graph['feature']: emb_batch,
+                graph['mask']: mask_batch,
+                graph['ground_truth']: gt_batch,
+                graph['base_price']: price_batch
+            }
+            feed_dict.update(model.step_feed(graph, train_step))
+            cur_loss, cur_reg_loss, cur_rank_loss, _ = sess.run(
+                (graph['loss'], graph['reg_loss'], graph['rank_loss'],
+                 graph['optimizer']), feed_dict)
+            tra_losses[m] += [cur_loss, cur_reg_loss, cur_rank_loss]
+            train_step += 1
+        first.profiler.record('train', time() - t1, epoch=i,
+                              steps=sum(len(days) for days in schedules))
+
+        val_loss = 0.0
+        cur_valid_perf, cur_test_perf = [], []
+        for m, (model, graph) in enumerate(zip(models, graphs)):
+            valid_eval = HorizonEvaluator(model.horizons)
+            test_eval = HorizonEvaluator(model.horizons)
+            val_losses = evaluate_days(model, graph, sess, valid_offsets[m],
+                                       valid_eval, train_step)
+            test_losses = evaluate_days(model, graph, sess, test_offsets[m],
+                                        test_eval, train_step)
+            cur_valid_perf.append(valid_eval.performance())
+            cur_test_perf.append(test_eval.performance())
+            val_loss += val_losses[0]
+            print('%s Train Loss:' % model.market_name,
+                  *(tra_losses[m] / len(schedules[m])))
+            print('%s Valid MSE:' % model.market_name,
+                  *(val_losses / len(valid_offsets[m])))
+            print('\t Valid preformance:', cur_valid_perf[m])
+            print('%s Test MSE:' % model.market_name,
+                  *(test_losses / len(test_offsets[m])))
+            print('\t Test performance:', cur_test_perf[m])
+        # per day over all markets
+        val_loss /= sum(len(offsets) for offsets in valid_offsets)
+        if val_loss < best_valid_loss:
+            best_valid_loss = val_loss
+            best_valid_perf = copy.deepcopy(cur_valid_perf)
+            best_test_perf = copy.deepcopy(cur_test_perf)
+            print('Better valid loss:', best_valid_loss)
+        t4 = time()
+        first.profiler.record('epoch', t4 - t1, epoch=i)
+        print('epoch:', i, ('time: %.4f ' % (t4 - t1)))
+    sess.close()
+
+    results = {}
+    for m, model in enumerate(models):
+        model.best_valid_perf = best_valid_perf[m]
+        model.best_test_perf = best_test_perf[m]
+        results[model.market_name] = best_valid_perf[m], best_test_perf[m]
+        print('\n%s Best Valid performance:' % model.market_name,
+              best_valid_perf[m])
+        print('\t%s Best Test performance:' % model.market_name,
+              best_test_perf[m])
+        logging.info('\t%s Best Test performance:' % model.market_name +
+                     str(best_test_perf[m]))
+    return results
@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+ARRAYS = ('prediction', 'ground_truth', 'mask')
+
+
+class ArchiveWriter:
+    def __init__(self, folder, tickers, days, horizons=1, first_day=0,
+                 chunk_days=64):
+        '''
+        writes the scored days of one split and epoch into day-major
+        memory-mapped chunks, folder/<array>_<chunk>.npy of
+        chunk_days x N x H
+        '''
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+        self.folder = folder
+        self.meta = {'tickers': tickers, 'days': days, 'horizons': horizons,
+                     'first_day': first_day, 'chunk_days': chunk_days,
+                     'complete': False}
+        self.chunks = {}
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.folder, 'meta.json'), 'w') as fout:
+            json.dump(self.meta, fout)
+
+    def _chunk(self, chunk):
+        if chunk not in self.chunks:
+            days = min(self.meta['chunk_days'],
+                       self.meta['days'] - chunk * self.meta['chunk_days'])
+            self.chunks[chunk] = [np.lib.format.open_memmap(
+                os.path.join(self.folder, '%s_%04d.npy' % (name, chunk)),
+                mode='w+', dtype=np.float32,
+                shape=(days, self.meta['tickers'], self.meta['horizons']))
+                for name in ARRAYS]
+        return self.chunks[chunk]
+
+    def write(self, day, prediction, ground_truth, mask):
+        '''
+        day: absolute index of the scored day, from first_day
+        prediction, ground_truth, mask: N or N x H
+        '''
+        chunk, row = divmod(day - self.meta['first_day'],
+                            self.meta['chunk_days'])
+        for array, value in zip(self._chunk(chunk),
+                                (prediction, ground_truth, mask)):
+            array[row] = np.reshape(value, array.shape[1:])
+
+    def close(self):
+        for arrays in self.chunks.values():
+            for array in arrays:
+                array.flush()
+        self.chunks = {}
+        self.meta['complete'] = True
+        self._write_meta()
+
+
+class PredictionArchive:
+    def __init__(self, root, run='run', keep='best', chunk_days=64):
+        '''
+        on-disk predictions keyed by run, seed, split and epoch:
+        root/<run>/seed_<seed>/<split>/<slot>/, see ArchiveWriter, or
+        root/<run>/seed_<seed>/window_<window>/<split>/<slot>/ for a train
+        window of walk_forward
+        keep: 'all' keeps every epoch; 'best' keeps the best epoch and the
+            one being scored in two slots, the best one is chosen by a
+            pointer in best.json next to the splits, never by copying
+        '''
+        self.root = os.path.join(root, run)
+        self.keep = keep
+        self.chunk_days = chunk_days
+
+    def _seed_folder(self, seed, window=None):
+        folder = os.path.join(self.root, 'seed_%d' % seed)
+        if window is None:
+            return folder
+        return os.path.join(folder, 'window_%d' % window)
+
+    def start(self, seed, window=None):
+        '''
+        drops the predictions and the best pointer of seed (and window) left
+        by an earlier run, call it before scoring the first epoch
+        '''
+        folder = self._seed_folder(seed, window)
+        for split in ('valid', 'test'):
+            if os.path.exists(os.path.join(folder, split)):
+                shutil.rmtree(os.path.join(folder, split))
+        if os.path.exists(os.path.join(folder, 'best.json')):
+            os.remove(os.path.join(folder, 'best.json'))
+
+    def _pointer(self, seed, window=None):
+        pointer_file = os.path.join(self._seed_folder(seed, window),
+                                    'best.json')
+        if not os.path.exists(pointer_file):
+            return None
+        with open(pointer_file) as fin:
+            return json.load(fin)
+
+    def _slot(self, seed, epoch, window=None):
+        if self.keep == 'all':
+            return 'epoch_%d' % epoch
+        best = self._pointer(seed, window)
+        # the slot that does not hold the best epoch
+        if best is not None and best['slot'] == 'slot_0':
+            return 'slot_1'
+        return 'slot_0'
+
+    def writer(self, seed, split, epoch, tickers, days, horizons=1,
+               first_day=0, window=None):
+        folder = os.path.join(self._seed_folder(seed, window), split,
+                              self._slot(seed, epoch, window))
+        return ArchiveWriter(folder, tickers, days, horizons, first_day,
+                             self.chunk_days)
+
+    def mark_best(self, seed, epoch, window=None):
+        '''
+        points the best snapshot of every split of seed to epoch
+        '''
+        pointer_file = os.path.join(self._seed_folder(seed, window),
+                                    'best.json')
+        with open(pointer_file + '.tmp', 'w') as fout:
+            json.dump({'epoch': epoch,
+                       'slot': self._slot(seed, epoch, window)}, fout)
+        os.replace(pointer_file + '.tmp', pointer_file)
+
+    def read(self, seed, split, epoch='best', days=None, tickers=None,
+             window=None):
+        '''
+        epoch: an epoch kept by keep='all', or 'best'
+        window: train window of walk_forward, None outside walk_forward
+        days: (first, last + 1) absolute day indices, all days if None
+        tickers: indices of the tickers to read, all if None
+        returns: prediction, ground truth and mask, N x D (x H if the split
+            was written with several horizons), memory-mapped chunks only
+            opened where days overlap them
+        '''
+        if epoch == 'best':
+            best = self._pointer(seed, window)
+            if best is None:
+                return None, None, None
+            slot = best['slot']
+        else:
+            slot = 'epoch_%d' % epoch
+        folder = os.path.join(self._seed_folder(seed, window), split, slot)
+        with open(os.path.join(folder, 'meta.json')) as fin:
+            meta = json.load(fin)
+        first, last = (0, meta['days']) if days is None else \
+            (days[0] - meta['first_day'], days[1] - meta['first_day'])
+        first, last = max(first, 0), min(last, meta['days'])
+        size = meta['chunk_days']
+        result = []
+        for name in ARRAYS:
+            parts = []
+            for chunk in range(first // size, (last - 1) // size + 1):
+                array = np.load(os.path.join(
+                    folder, '%s_%04d.npy' % (name, chunk)), mmap_mode='r')
+                part = array[max(first - chunk * size, 0):
+                             last - chunk * size]
+                parts.append(part if tickers is None else part[:, tickers])
+            values = np.concatenate(parts, axis=0) if parts else \
+                np.zeros((0, meta['tickers'] if tickers is None else
+                          len(tickers), meta['horizons']), dtype=np.float32)
+            values = np.transpose(values, (1, 0, 2))
+            result.append(values[:, :, 0] if meta['horizons'] == 1 else
+                          values)
+        return tuple(result)
@@ -0,0 +1,91 @@
+import json
+import os
+from contextlib import contextmanager
+from time import time
+
+
+def parse_steps(steps):
+    '''
+    '100-110' -> (100, 110), '100' -> (100, 100), None -> None
+    '''
+    if not steps:
+        return None
+    first, _, last = str(steps).partition('-')
+    return int(first), int(last or first)
+
+
+class Profiler:
+    def __init__(self, log_file=None, trace_steps=None, trace_dir='.',
+                 **fields):
+        '''
+        emits per-phase timings as JSON lines
+        log_file: path of the JSON lines file, '-' for stdout, None to
+            disable the log
+        trace_steps: 'first-last' range of training steps to trace with the
+            TF RunMetadata timeline, None to disable tracing
+        trace_dir: folder of the chrome trace files
+        fields: added to every record and to the trace file names, e.g. seed
+        '''
+        self.log_file = log_file
+        self.trace_steps = parse_steps(trace_steps)
+        self.trace_dir = trace_dir
+        self.fields = fields
+        self.totals = {}
+
+    def record(self, phase, seconds, **fields):
+        self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+        self.log(phase, seconds=seconds, **fields)
+
+    def log(self, phase, **fields):
+        if self.log_file is None:
+            return
+        entry = {'phase': phase, 'time': time()}
+        entry.update(self.fields)
+        entry.update(fields)
+        line = json.dumps(entry)
+        if self.log_file == '-':
+            print(line)
+        else:
+            with open(self.log_file, 'a') as fout:
+                fout.write(line + '\n')
+
+    @contextmanager
+    def phase(self, phase, **fields):
+        start = time()
+        yield
+        self.record(phase, time() - start, **fields)
+
+    def tracing(self, step):
+        return self.trace_steps is not None and \
+            self.trace_steps[0] <= step <= self.trace_steps[1]
+
+    def run_options(self, step):
+        '''
+        returns: keyword arguments of sess.run, empty unless step is traced
+        '''
+        if not self.tracing(step):
+            return {}
+        import tensorflow as tf
+        return {
+            'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            'run_metadata': tf.RunMetadata()
+        }
+
+    def write_trace(self, step, run_kwargs):
+        '''
+        saves the chrome trace of a traced step, see chrome://tracing
+        '''
+        if 'run_metadata' not in run_kwargs:
+            return
+        from tensorflow.python.client import timeline
+        trace = timeline.Timeline(run_kwargs['run_metadata'].step_stats)
+        if not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+        # runs of other seeds write to the same folder
+        run = ''.join('_%s_%s' % (name, value)
+                      for name, value in sorted(self.fields.items()))
+        trace_file = os.path.join(self.trace_dir,
+                                  'timeline%s_step_%d.json' % (run, step))
+        with open(trace_file, 'w') as fout:
+            fout.write(trace.generate_chrome_trace_format())
+        self.record('trace', 0.0, step=step, file=trace_file)
@@ -1,34 +1,33 @@
-import argparse
 import copy
 import numpy as np
 import os
-# import psutil
 import random
-import tensorflow as tf
 from time import time
 import logging
-try:
-    from tensorflow.python.ops.nn_ops import leaky_relu
-except ImportError:
-    from tensorflow.python.framework import ops
-    from tensorflow.python.ops import math_ops
-
-
-    def leaky_relu(features, alpha=0.2, name=None):
-        with ops.name_scope(name, "LeakyRelu", [features, alpha]):
-            features = ops.convert_to_tensor(features, name="features")
-            alpha = ops.convert_to_tensor(alpha, name="alpha")
-            return math_ops.maximum(alpha * features, features)
-
 from load_data import load_EOD_data, load_relation_data
-from evaluator import evaluate
-
+from evaluator import GroupedEvaluator, HorizonEvaluator, \
+    HorizonGroupedEvaluator
+from embedding_store import EmbeddingStore
+from eod_windows import EODWindows
+from batch_index import BatchIndex
+from relation_store import RelationStore
+from prediction_archive import PredictionArchive
+from profiler import Profiler
+from memory import MemoryMonitor, estimate_graph_mb
+from cluster_sampler import ClusterSampler
+from thread_tuner import apply_thread_config, load_thread_config, \
+    session_config, tune_threads
+from arguments import market_file, parse_args, part_path, relation_path
+# TensorFlow and the modules built on it are imported where they are used,
+# so that argument errors and -h return without loading them
 
 
 class ReRaLSTM:
     def __init__(self, data_path, market_name, tickers_fname, relation_name,
-                 emb_fname, parameters, steps=1, epochs=50, batch_size=None, flat=False, in_pro=False, seed=123456789, geom=False,args=None):
+                 emb_fname, parameters, steps=1, epochs=50, batch_size=None, flat=False, in_pro=False, seed=123456789, geom=False,args=None,
+                 keep_pred=True, data=None, thread_config=None):
 
+        import tensorflow as tf
         seed = seed
         random.seed(seed)
         np.random.seed(seed)
@@ -44,90 +43,277 @@ class ReRaLSTM:
         self.unify = args.unify
         self.two_way_b = args.two_way_b
         self.geom=geom
+        # columns of the attention computed at a time, 0 for all at once
+        self.attn_block = args.attn_block
+        # in-neighbors per column sampled at every train step, 0 for all
+        self.fanout = args.fanout
+        # graph partitions of every train step, 0 for all tickers
+        self.clusters = args.clusters
+        # layer name suffix and per-market prediction layer of multi-market
+        # training, see multi_market.py
+        self.market_scope = None
+        self.market_heads = False
+        self.profiler = Profiler(args.timing_log, args.trace_steps,
+                                 args.trace_dir, seed=seed)
+        self.memory = MemoryMonitor(self.profiler, args.mem_budget)
+        self.thread_file = args.thread_file
+        # overrides the tuned thread settings of thread_file
+        self.thread_config = thread_config
         self.ratio=args.ratio
+        # prediction horizons in days, trained jointly
+        self.horizons = args.horizons or [steps]
         # load data
         self.tickers = np.genfromtxt(os.path.join(data_path, '..', tickers_fname),
                                      dtype=str, delimiter='\t', skip_header=False)
 
         print('#tickers selected:', len(self.tickers))
-        self.eod_data, self.mask_data, self.gt_data, self.price_data = \
-            load_EOD_data(data_path, market_name, self.tickers, steps)
+        # arrays loaded beforehand, e.g. shared by the runs of sweep.py
+        data = data or {}
+        with self.profiler.phase('load_eod'):
+            if 'eod_data' in data:
+                self.eod_data, self.mask_data, self.gt_data, \
+                    self.price_data = data['eod_data'], data['mask_data'], \
+                    data['gt_data'], data['price_data']
+            else:
+                self.eod_data, self.mask_data, self.gt_data, \
+                    self.price_data = load_EOD_data(
+                        data_path, market_name, self.tickers,
+                        self.horizons)
+        self.memory.snapshot('load_eod', self)
 
         # relation data
-        rname_tail = {'sector_industry': '_industry_relation.npy',
-                      'wikidata': '_wiki_relation.npy'}
-        if geom:
-            self.rel_encoding, self.rel_mask = load_relation_data(
-                os.path.join(self.data_path, '..', 'relation', self.relation_name,
-                            self.market_name + rname_tail[self.relation_name][:-4] + "_geom_{}.npy".format(args.thresh))
-            )
-        else:
-            self.rel_encoding, self.rel_mask = load_relation_data(
-                os.path.join(self.data_path, '..', 'relation', self.relation_name,
-                            self.market_name + rname_tail[self.relation_name])
-            )
-        if self.reg=="part":
-            self.part_label = np.load("../data/{}_part_{}.npy".format(self.market_name, args.gp))
+        with self.profiler.phase('load_relation'):
+            if 'rel_encoding' in data:
+                self.rel_encoding, self.rel_mask = \
+                    data['rel_encoding'], data['rel_mask']
+            elif args.rel_deltas is None:
+                self.rel_encoding, self.rel_mask = load_relation_data(
+                    relation_path(self.data_path, self.market_name,
+                                  self.relation_name, geom, args.thresh))
+        if self.reg=="part" or self.clusters:
+            if 'part_label' in data:
+                self.part_label = data['part_label']
+            else:
+                self.part_label = np.load(part_path(
+                    self.data_path, self.market_name, args.gp))
+        # relation file plus the delta files of a folder, see
+        # relation_store.py
+        self.relation_store = None
+        if 'rel_encoding' not in data and args.rel_deltas is not None:
+            with self.profiler.phase('load_relation'):
+                self.relation_store = RelationStore(
+                    relation_path(self.data_path, self.market_name,
+                                  self.relation_name, geom, args.thresh),
+                    self.tickers, getattr(self, 'part_label', None),
+                    args.rel_deltas)
+                self.relation_store.poll()
+            if self.relation_store.tickers != list(self.tickers):
+                raise ValueError('the tickers of %s and of the relation '
+                                 'deltas differ' % tickers_fname)
+            self.rel_encoding, self.rel_mask = \
+                self.relation_store.encoding, self.relation_store.mask
+            if self.reg=="part" or self.clusters:
+                self.part_label = self.relation_store.part_label
+            print('relation version:', self.relation_store.version)
 
         print('relation encoding shape:', self.rel_encoding.shape)
         print('relation mask shape:', self.rel_mask.shape)
-
-        self.embedding = np.load(
-            os.path.join(self.data_path, '..', 'pretrain', emb_fname))
-        print('embedding shape:', self.embedding.shape)
+        self.memory.snapshot('load_relation', self)
 
         self.parameters = copy.copy(parameters)
-        self.steps = steps
+        # the rank lstm runs on the raw EOD windows instead of reading the
+        # pretrained embedding, see eod_windows.py
+        self.windows = None
+        self.embedding = None
+        if args.raw_windows:
+            with self.profiler.phase('load_embedding'):
+                self.windows = EODWindows(self.eod_data, self.mask_data,
+                                          self.parameters['seq'])
+            print('raw windows:', self.windows.windows.shape)
+        else:
+            with self.profiler.phase('load_embedding'):
+                self.embedding = EmbeddingStore(
+                    os.path.join(self.data_path, '..', 'pretrain',
+                                 emb_fname),
+                    day_major=args.emb_day_major, tickers=len(self.tickers))
+            print('embedding shape:', self.embedding.shape)
+        self.memory.snapshot('load_embedding', self)
+
+        # the longest horizon bounds the usable offsets
+        self.steps = max(self.horizons)
         self.epochs = epochs
         self.flat = flat
         self.inner_prod = in_pro
+        # keep the best raw predictions in memory to be returned by train
+        self.keep_pred = keep_pred
+        # test metrics per industry of the sector_industry relation, for
+        # every horizon; its relation types are the industries only, the
+        # sector of an industry is not in the data, so there is no metric
+        # per sector
+        self.group_eval = None
+        if args.group_eval:
+            self.group_eval = HorizonGroupedEvaluator(
+                GroupedEvaluator.from_relation(np.load(relation_path(
+                    data_path, market_name, 'sector_industry'))),
+                self.horizons)
+        # or on disk, written as the days are scored
+        self.archive = None
+        if args.pred_archive is not None:
+            self.archive = PredictionArchive(args.pred_archive,
+                                             args.archive_run,
+                                             args.archive_keep)
+        # train window of walk_forward, a folder of its own in the archive
+        self.archive_window = None
         if batch_size is None:
             self.batch_size = len(self.tickers)
         else:
             self.batch_size = batch_size
 
-        self.valid_index = 756
-        self.test_index = 1008
+        self.valid_index = args.valid_index
+        self.test_index = args.test_index
         self.trade_dates = self.mask_data.shape[1]
+        # the test days are [test_index, test_end)
+        self.test_end = self.trade_dates
+        # best checkpoint to save and checkpoint to start from, see
+        # walk_forward.py
+        self.checkpoint = None
+        self.warm_start = None
+        # (parameter version, relation feeds), see relation_feed
+        self._relation_cache = (None, {})
+        # masks, prices and ground truths of every offset, see get_batch
+        self.batches = None
         self.fea_dim = 5
 
     def get_batch(self, offset=None):
         if offset is None:
             offset = random.randrange(0, self.valid_index)
         seq_len = self.parameters['seq']
-        mask_batch = self.mask_data[:, offset: offset + seq_len + self.steps]
-        mask_batch = np.min(mask_batch, axis=1)
-        return self.embedding[:, offset, :], \
-               np.expand_dims(mask_batch, axis=1), \
-               np.expand_dims(
-                   self.price_data[:, offset + seq_len - 1], axis=1
-               ), \
-               np.expand_dims(
-                   self.gt_data[:, offset + seq_len + self.steps - 1], axis=1
-               )
+        # built on first use, again if update_model changes seq
+        if self.batches is None or self.batches.seq != seq_len:
+            self.batches = BatchIndex(self.mask_data, self.gt_data,
+                                      self.price_data, seq_len,
+                                      self.horizons)
+        mask_batch, price_batch, gt_batch = self.batches.batch(offset)
+        if self.windows is not None:
+            feature_batch = self.windows.window(offset)
+        else:
+            feature_batch = self.embedding.day(offset)
+        return feature_batch, mask_batch, price_batch, gt_batch
 
 
-    def train(self):
-        # if self.gpu == True:
-        #     device_name = '/gpu:0'
-        # else:
-        #     device_name = '/cpu:0'
-        # print('device name:', device_name)
-        # with tf.device(device_name):
+    def relation_feed(self, sess, graph, version):
+        '''
+        the values of graph['cache'], which only depend on the weights, to
+        be fed to every day of an evaluation pass instead of recomputing the
+        relation layer over N x N x K per day; computed again once version
+        changes
+        version: key of the weights, e.g. the optimizer steps run in sess
+        '''
+        if self._relation_cache[0] != version:
+            self._relation_cache = (version, dict(zip(
+                graph['cache'], sess.run(graph['cache']))))
+        return self._relation_cache[1]
 
-        # tf.reset_default_graph()
-        seed = self.seed
-        random.seed(seed)
-        np.random.seed(seed)
-        tf.set_random_seed(seed)
+    def step_feed(self, graph, step):
+        '''
+        the tickers (-clusters) and neighbors (-fanout) sampled for train
+        step step, the same for the same seed and step; evaluation uses all
+        of them
+        '''
+        feed_dict = {}
+        if 'edge_ids' in graph:
+            feed_dict[graph['edge_ids']] = graph['sampler'].sample(step)
+        if 'batch_ids' in graph:
+            feed_dict[graph['batch_ids']] = \
+                graph['cluster_sampler'].sample(step)
+        return feed_dict
+
+    def _layer_name(self, name, shared=True):
+        '''
+        name of a layer of build_graph, suffixed by the market in
+        multi-market training unless shared, see multi_market.py
+        '''
+        if self.market_scope is None or shared:
+            return name
+        return '%s_%s' % (name, self.market_scope)
 
-        ground_truth = tf.placeholder(tf.float32, [self.batch_size, 1])
-        mask = tf.placeholder(tf.float32, [self.batch_size, 1])
-        feature = tf.placeholder(tf.float32,
+    def build_graph(self, external_gradients=False, optimizer=None):
+        '''
+        builds the training graph in the default TF graph
+        external_gradients: instead of minimizing the loss, expose the
+            gradients and apply the ones fed to 'grad_feeds', e.g. averaged
+            over data-parallel workers
+        optimizer: Adam optimizer shared with the graphs of other markets,
+            a new one if None
+        returns: dict of the placeholders and the ops run by train
+        '''
+        import tensorflow as tf
+        from tf_compat import leaky_relu
+        from tiled_attention import relation_constant, relation_variables, \
+            tiled_attention
+        from sparse_attention import NeighborSampler, relation_edges, \
+            sparse_attention
+        horizons = len(self.horizons)
+        ground_truth = tf.placeholder(tf.float32, [self.batch_size, horizons])
+        mask = tf.placeholder(tf.float32, [self.batch_size, horizons])
+        if self.windows is not None:
+            # the raw window and its statistics, fed as views by get_batch
+            feature = (
+                tf.placeholder(tf.float32, [self.parameters['seq'],
+                                            self.batch_size, self.fea_dim]),
+                tf.placeholder(tf.float32, [self.batch_size, self.fea_dim]),
+                tf.placeholder(tf.float32, [self.batch_size, self.fea_dim]))
+        else:
+            feature = tf.placeholder(tf.float32,
                                     [self.batch_size, self.parameters['unit']])
         base_price = tf.placeholder(tf.float32, [self.batch_size, 1])
         all_one = tf.ones([self.batch_size, 1], dtype=tf.float32)
+        inputs = feature, mask, ground_truth, base_price
+        if self.clusters:
+            # tickers of the step, all of them unless a cluster batch is
+            # fed, see step_feed
+            batch_ids = tf.placeholder_with_default(
+                np.arange(self.batch_size, dtype=np.int32), [None])
+            mask, ground_truth, base_price = [
+                tf.gather(tensor, batch_ids) for tensor in inputs[1:]]
+            if self.windows is not None:
+                feature = (tf.gather(feature[0], batch_ids, axis=1),
+                           tf.gather(feature[1], batch_ids),
+                           tf.gather(feature[2], batch_ids))
+            else:
+                feature = tf.gather(feature, batch_ids)
+            all_one = tf.ones(tf.stack([tf.shape(batch_ids)[0], 1]),
+                              dtype=tf.float32)
+        if self.windows is not None:
+            window, window_mean, window_std = feature
+            lstm_cell = tf.nn.rnn_cell.BasicLSTMCell(self.parameters['unit'])
+            outputs, _ = tf.nn.dynamic_rnn(
+                lstm_cell, (window - window_mean) / window_std,
+                dtype=tf.float32, time_major=True,
+                scope=self._layer_name('window_lstm'))
+            # the last hidden state, as the pretrained embedding
+            feature = outputs[-1]
+
+        def _batch(pairs):
+            '''
+            the rows and columns of an N x N (x K) constant of the tickers
+            of the step
+            '''
+            if not self.clusters:
+                return pairs
+            return tf.gather(tf.gather(pairs, batch_ids), batch_ids, axis=1)
+
         rel_shape = [self.rel_encoding.shape[0], self.rel_encoding.shape[1]]
+        # the relation types differ across markets
+        rel_layer = self._layer_name("rel", shared=False)
+        # the 2way structural attention stays dense
+        sampled = self.fanout and not (self.geom and self.unify=="2way")
+        tiled = self.attn_block and not (self.geom and self.unify=="2way")
+        if sampled and tiled:
+            raise ValueError('-fanout and -attn_block are exclusive')
+        if self.clusters and (sampled or tiled):
+            raise ValueError('-clusters runs on the dense attention, set '
+                             '-fanout 0 and -attn_block 0')
         if self.reg=="part":
             part_label = tf.constant(self.part_label, dtype=tf.float32)
         if self.geom and self.unify=="2way":
@@ -138,9 +324,9 @@ class ReRaLSTM:
                             np.sum(rel_encoding, axis=2))
             ori_mask = np.where(mask_flags, np.ones(rel_shape) * -1e9, np.zeros(rel_shape))
             
-            relation = tf.constant(rel_encoding, dtype=tf.float32)
-            rel_mask = tf.constant(ori_mask, dtype=tf.float32)
-            rel_weight = tf.layers.dense(relation, units=1,name="rel",
+            relation = _batch(tf.constant(rel_encoding, dtype=tf.float32))
+            rel_mask = _batch(tf.constant(ori_mask, dtype=tf.float32))
+            rel_weight = tf.layers.dense(relation, units=1,name=rel_layer,
                                             activation=leaky_relu)
             # structural
             stru_rel_encoding = self.rel_encoding[:,:,-1:]
@@ -148,39 +334,89 @@ class ReRaLSTM:
                             np.sum(stru_rel_encoding, axis=2))
             stru_mask = np.where(stru_mask_flags, np.ones(rel_shape) * -1e9, np.zeros(rel_shape))
 
-            stru_relation = tf.constant(stru_rel_encoding, dtype=tf.float32)
-            stru_rel_mask = tf.constant(stru_mask, dtype=tf.float32)
-            stru_rel_weight = tf.layers.dense(stru_relation, units=1,
-                                            activation=leaky_relu)
+            stru_relation = _batch(tf.constant(stru_rel_encoding,
+                                               dtype=tf.float32))
+            stru_rel_mask = _batch(tf.constant(stru_mask, dtype=tf.float32))
+            stru_rel_weight = tf.layers.dense(
+                stru_relation, units=1, activation=leaky_relu,
+                name=self._layer_name("stru_rel", shared=False))
+        elif sampled:
+            # edge list attention over the related pairs only
+            rel_encoding = self.rel_encoding
+            ori_mask = self.rel_mask
+            edges, edge_relation = relation_edges(self.rel_encoding,
+                                                  self.rel_mask)
+            relation = relation_constant(edge_relation)
+            kernel, bias = relation_variables(rel_layer,
+                                              rel_encoding.shape[2])
+            # all edges unless a sample is fed, see step_feed
+            edge_ids = tf.placeholder_with_default(
+                np.arange(edges.shape[0], dtype=np.int32), [None])
+        elif tiled:
+            # tiled attention, the relation constant is never cast whole
+            rel_encoding = self.rel_encoding
+            ori_mask = self.rel_mask
+            relation = relation_constant(self.rel_encoding)
+            kernel, bias = relation_variables(rel_layer,
+                                              rel_encoding.shape[2])
         else:
             # total
             # for reg use
             rel_encoding = self.rel_encoding
             ori_mask = self.rel_mask
-            relation = tf.constant(self.rel_encoding, dtype=tf.float32)
-            rel_mask = tf.constant(self.rel_mask, dtype=tf.float32)
-            rel_weight = tf.layers.dense(relation, units=1,name="rel",
+            relation = _batch(tf.constant(self.rel_encoding,
+                                          dtype=tf.float32))
+            rel_mask = _batch(tf.constant(self.rel_mask, dtype=tf.float32))
+            rel_weight = tf.layers.dense(relation, units=1,name=rel_layer,
                                             activation=leaky_relu)
 
         # original
-        if self.inner_prod:
+        if sampled:
+            if self.inner_prod:
+                raise ValueError('neighbor sampling supports the sum weight '
+                                 'only, set -fanout 0 with -ip 1')
+            print('sum weight, at most %d in-neighbors of %d in training' % (
+                self.fanout, np.max(np.bincount(edges[:, 1], minlength=1))))
+            head_weight = tf.layers.dense(feature, units=1,name="head",
+                                            activation=leaky_relu)
+            tail_weight = tf.layers.dense(feature, units=1,name="tail",
+                                            activation=leaky_relu)
+            outputs_proped = sparse_attention(
+                edge_ids, tf.constant(edges), relation, head_weight,
+                tail_weight, feature, kernel, bias)
+        elif tiled:
+            if self.inner_prod:
+                raise ValueError('tiled attention supports the sum weight '
+                                 'only, set -attn_block 0 with -ip 1')
+            print('sum weight, tiled by %d columns' % self.attn_block)
+            head_weight = tf.layers.dense(feature, units=1,name="head",
+                                            activation=leaky_relu)
+            tail_weight = tf.layers.dense(feature, units=1,name="tail",
+                                            activation=leaky_relu)
+            outputs_proped = tiled_attention(
+                relation, head_weight, tail_weight, feature, kernel, bias,
+                block=self.attn_block)
+        elif self.inner_prod:
             print('inner product weight')
             inner_weight = tf.matmul(feature, feature, transpose_b=True)
-            weight = tf.multiply(inner_weight, rel_weight[:, :, -1])
+            rel_logit = rel_weight[:, :, -1]
+            weight = tf.multiply(inner_weight, rel_logit)
         else:
             print('sum weight')
             head_weight = tf.layers.dense(feature, units=1,name="head",
                                             activation=leaky_relu)
             tail_weight = tf.layers.dense(feature, units=1,name="tail",
                                             activation=leaky_relu)
+            rel_logit = rel_weight[:, :, -1]
             weight = tf.add(
                 tf.add(
                     tf.matmul(head_weight, all_one, transpose_b=True),
                     tf.matmul(all_one, tail_weight, transpose_b=True)
-                ), rel_weight[:, :, -1]
+                ), rel_logit
             )
-        weight_masked = tf.nn.softmax(tf.add(rel_mask, weight), dim=0)
-        outputs_proped = tf.matmul(weight_masked, feature)
+        if not tiled and not sampled:
+            weight_masked = tf.nn.softmax(tf.add(rel_mask, weight), dim=0)
+            outputs_proped = tf.matmul(weight_masked, feature)
         # 2way structural
         if self.geom and self.unify=="2way":
             if self.inner_prod:
@@ -190,14 +426,17 @@ class ReRaLSTM:
             else:
                 print('sum weight')
                 head_weight = tf.layers.dense(feature, units=1,
-                                                activation=leaky_relu)
+                                                activation=leaky_relu,
+                                                name=self._layer_name("stru_head"))
                 tail_weight = tf.layers.dense(feature, units=1,
-                                                activation=leaky_relu)
+                                                activation=leaky_relu,
+                                                name=self._layer_name("stru_tail"))
+                stru_rel_logit = stru_rel_weight[:, :, -1]
                 weight = tf.add(
                     tf.add(
                         tf.matmul(head_weight, all_one, transpose_b=True),
                         tf.matmul(all_one, tail_weight, transpose_b=True)
-                    ), stru_rel_weight[:, :, -1]
+                    ), stru_rel_logit
                 )
             weight_masked = tf.nn.softmax(tf.add(stru_rel_mask, weight), dim=0)
             stru_outputs_proped = tf.matmul(weight_masked, feature)
@@ -208,6 +447,7 @@ class ReRaLSTM:
             outputs_concated = tf.layers.dense(
                 tf.concat([feature, outputs_proped], axis=1),
                 units=self.parameters['unit'], activation=leaky_relu,
+                name=self._layer_name('hidden'),
                 kernel_initializer=tf.glorot_uniform_initializer()
             )
         else:
@@ -215,7 +455,8 @@ class ReRaLSTM:
         
         # One hidden layer
         prediction = tf.layers.dense(
-            outputs_concated, units=1, activation=leaky_relu, name='reg_fc',
+            outputs_concated, units=horizons, activation=leaky_relu,
+            name=self._layer_name('reg_fc', shared=not self.market_heads),
             kernel_initializer=tf.glorot_uniform_initializer()
         )
         # delete
@@ -225,19 +466,21 @@ class ReRaLSTM:
             for i in range(rel_del_encoding.shape[0]):
                 rel_del_encoding[i,i,:] = zero
                 rel_del_mask[i,i] = -1e9
-            relation_del = tf.constant(rel_del_encoding, dtype=tf.float32)
-            rel_del_mask = tf.constant(rel_del_mask, dtype=tf.float32)
+            relation_del = _batch(tf.constant(rel_del_encoding,
+                                              dtype=tf.float32))
+            rel_del_mask = _batch(tf.constant(rel_del_mask, dtype=tf.float32))
             rel_del_weight = tf.layers.dense(relation_del, units=1,
-                                            activation=leaky_relu, name="rel", reuse=True)
+                                            activation=leaky_relu, name=rel_layer, reuse=True)
             head_weight = tf.layers.dense(feature, units=1,
                                                 activation=leaky_relu,name="head",reuse=True)
             tail_weight = tf.layers.dense(feature, units=1,
                                             activation=leaky_relu,name="tail",reuse=True)
+            rel_del_logit = rel_del_weight[:, :, -1]
             weight = tf.add(
                 tf.add(
                     tf.matmul(head_weight, all_one, transpose_b=True),
                     tf.matmul(all_one, tail_weight, transpose_b=True)
-                ), rel_del_weight[:, :, -1]
+                ), rel_del_logit
             )
 
             weight_del_masked = tf.nn.softmax(tf.add(rel_del_mask, weight), dim=0)
@@ -248,15 +491,14 @@ class ReRaLSTM:
         reg_loss = tf.losses.mean_squared_error(
             ground_truth, return_ratio, weights=mask
         )
+        # N x N x H pairwise differences, one ranking per horizon
         pre_pw_dif = tf.subtract(
-            tf.matmul(return_ratio, all_one, transpose_b=True),
-            tf.matmul(all_one, return_ratio, transpose_b=True)
+            tf.expand_dims(return_ratio, 1), tf.expand_dims(return_ratio, 0)
         )
         gt_pw_dif = tf.subtract(
-            tf.matmul(all_one, ground_truth, transpose_b=True),
-            tf.matmul(ground_truth, all_one, transpose_b=True)
+            tf.expand_dims(ground_truth, 0), tf.expand_dims(ground_truth, 1)
         )
-        mask_pw = tf.matmul(mask, mask, transpose_b=True)
+        mask_pw = tf.multiply(tf.expand_dims(mask, 1), tf.expand_dims(mask, 0))
         rank_loss = tf.reduce_mean(
             tf.nn.relu(
                 tf.multiply(
@@ -270,46 +512,117 @@ class ReRaLSTM:
                             rank_loss
         if self.reg=="part":
             part_prediction = tf.layers.dense(
-            outputs_concated, units=self.gp, activation=leaky_relu, name='reg_fc_part',
+            outputs_concated, units=self.gp, activation=leaky_relu, name=self._layer_name('reg_fc_part', shared=False),
             kernel_initializer=tf.glorot_uniform_initializer()
             )
-            part_loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=self.part_label,logits=part_prediction))
+            part_label = self.part_label
+            if self.clusters:
+                part_label = tf.gather(part_label, batch_ids)
+            part_loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=part_label,logits=part_prediction))
             loss+=self.reg_b*part_loss
         if self.reg=="reg":
             loss+=self.reg_b*regresion_loss
 
-        optimizer = tf.train.AdamOptimizer(
+        adam = optimizer or tf.train.AdamOptimizer(
             learning_rate=self.parameters['lr']
-        ).minimize(loss)
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
+        )
+        graph = {
+            'feature': inputs[0], 'mask': inputs[1],
+            'ground_truth': inputs[2], 'base_price': inputs[3],
+            'return_ratio': return_ratio,
+            'loss': loss, 'reg_loss': reg_loss, 'rank_loss': rank_loss
+        }
+        # N x N relation logits and masks that only depend on the trained
+        # relation layer, precomputed by frozen_graph.py
+        graph['relation'] = {}
+        if not tiled and not sampled:
+            graph['relation'].update(rel_logit=rel_logit, rel_mask=rel_mask)
+        if self.geom and self.unify=="2way" and not self.inner_prod:
+            graph['relation'].update(stru_rel_logit=stru_rel_logit,
+                                     stru_rel_mask=stru_rel_mask)
+        # parameter-only N x N x K terms, see relation_feed
+        graph['cache'] = [tensor for name, tensor in
+                          sorted(graph['relation'].items())
+                          if name.endswith('_logit')]
+        if self.reg=="reg":
+            graph['cache'].append(rel_del_logit)
+        if sampled:
+            graph['edge_ids'] = edge_ids
+            graph['sampler'] = NeighborSampler(edges, self.fanout, self.seed)
+        if self.clusters:
+            graph['batch_ids'] = batch_ids
+            graph['cluster_sampler'] = ClusterSampler(
+                self.part_label, self.clusters, self.seed)
+        if external_gradients:
+            grads_and_vars = [(grad, var) for grad, var in
+                              adam.compute_gradients(loss) if grad is not None]
+            graph['variables'] = [var for _, var in grads_and_vars]
+            graph['gradients'] = [grad for grad, _ in grads_and_vars]
+            graph['grad_feeds'] = [tf.placeholder(tf.float32, var.shape)
+                                   for var in graph['variables']]
+            graph['optimizer'] = adam.apply_gradients(
+                zip(graph['grad_feeds'], graph['variables']))
+        else:
+            graph['optimizer'] = adam.minimize(loss)
+        return graph
+
+    def train(self):
+        # if self.gpu == True:
+        #     device_name = '/gpu:0'
+        # else:
+        #     device_name = '/cpu:0'
+        # print('device name:', device_name)
+        # with tf.device(device_name):
+
+        # tf.reset_default_graph()
+        import tensorflow as tf
+        t0 = time()
+        seed = self.seed
+        random.seed(seed)
+        np.random.seed(seed)
+        tf.set_random_seed(seed)
+        # before any of the N x N x K constants is built
+        self.memory.check_budget('graph', estimate_graph_mb(
+            self.rel_encoding.shape[0], self.rel_encoding.shape[2],
+            two_way=self.geom and self.unify == "2way",
+            reg=self.reg == "reg",
+            block=0 if self.geom and self.unify == "2way" else
+            self.attn_block,
+            edges=0 if self.geom and self.unify == "2way" or not self.fanout
+            else int(np.sum(self.rel_mask == 0))))
+
+        graph = self.build_graph()
+        feature, mask = graph['feature'], graph['mask']
+        ground_truth, base_price = graph['ground_truth'], graph['base_price']
+        loss, reg_loss, rank_loss = \
+            graph['loss'], graph['reg_loss'], graph['rank_loss']
+        return_ratio, optimizer = graph['return_ratio'], graph['optimizer']
+        # thread settings tuned on this host, see thread_tuner.py
+        thread_config = self.thread_config or load_thread_config(
+            len(self.tickers), self.parameters['unit'], self.thread_file)
+        if thread_config is not None:
+            print('thread config:', thread_config)
+        thread_limiter = apply_thread_config(thread_config)
+        config = session_config(thread_config)
         sess = tf.Session(config=config)
         saver = tf.train.Saver()
         sess.run(tf.global_variables_initializer())
-        best_valid_pred = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
-        )
-        best_valid_gt = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
-        )
-        best_valid_mask = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
-        )
-        best_test_pred = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
+        if self.warm_start is not None:
+            saver.restore(sess, self.warm_start)
+        self._relation_cache = (None, {})
+        self.profiler.record('graph', time() - t0)
+        self.memory.snapshot('graph', self)
+        buffer_pred = self.keep_pred and self.archive is None
+        valid_eval = HorizonEvaluator(
+            self.horizons, buffer_days=self.test_index - self.valid_index
+            if buffer_pred else None
         )
-        best_test_gt = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
-        )
-        best_test_mask = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
+        test_eval = HorizonEvaluator(
+            self.horizons, buffer_days=self.test_end - self.test_index
+            if buffer_pred else None
         )
+        best_valid_pred, best_valid_gt, best_valid_mask = None, None, None
+        best_test_pred, best_test_gt, best_test_mask = None, None, None
         best_valid_perf = {
             'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0
         }
@@ -317,15 +630,22 @@ class ReRaLSTM:
             'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0
         }
         best_valid_loss = np.inf
+        if self.archive is not None:
+            self.archive.start(self.seed, self.archive_window)
+        # per industry at the best epoch, none if no epoch improves
+        self.best_group_perf = {}
 
         batch_offsets = np.arange(start=0, stop=self.valid_index, dtype=int)
+        train_step = 0
         for i in range(self.epochs):
             t1 = time()
             np.random.seed(self.seed)
             np.random.shuffle(batch_offsets)
+            epoch_step = train_step
             tra_loss = 0.0
             tra_reg_loss = 0.0
             tra_rank_loss = 0.0
+            step_tickers = 0
             end_index = self.valid_index - self.parameters['seq'] - self.steps + 1
             start_index = int(end_index*(1-self.ratio))
             for j in range(start_index, end_index):
@@ -337,12 +657,31 @@ class ReRaLSTM:
                     ground_truth: gt_batch,
                     base_price: price_batch
                 }
+                feed_dict.update(self.step_feed(graph, train_step))
+                step_tickers += len(feed_dict.get(graph.get('batch_ids'),
+                                                  self.tickers))
+                run_kwargs = self.profiler.run_options(train_step)
                 cur_loss, cur_reg_loss, cur_rank_loss, batch_out = \
                     sess.run((loss, reg_loss, rank_loss, optimizer),
-                             feed_dict)
+                             feed_dict, **run_kwargs)
+                self.profiler.write_trace(train_step, run_kwargs)
+                if train_step == 0:
+                    self.memory.snapshot('first_step', self)
+                train_step += 1
                 tra_loss += cur_loss
                 tra_reg_loss += cur_reg_loss
                 tra_rank_loss += cur_rank_loss
+            self.profiler.record('train', time() - t1, epoch=i,
+                                 steps=train_step - epoch_step,
+                                 tickers=step_tickers /
+                                 max(train_step - epoch_step, 1))
+            if self.clusters:
+                print('Cluster batches: %.1f of %d tickers per step, %.1f '
+                      'steps/s' % (step_tickers /
+                                   max(train_step - epoch_step, 1),
+                                   len(self.tickers),
+                                   (train_step - epoch_step) /
+                                   (time() - t1)))
             print('Train Loss:',
                   tra_loss / (self.valid_index - self.parameters['seq'] - self.steps + 1),
                   tra_reg_loss / (self.valid_index - self.parameters['seq'] - self.steps + 1),
@@ -350,18 +689,11 @@ class ReRaLSTM:
 
 
             # test on validation set
-            cur_valid_pred = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
-            cur_valid_gt = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
-            cur_valid_mask = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
+            valid_eval.reset()
+            valid_writer = self._archive_writer(
+                'valid', i, self.valid_index, self.test_index)
+            t2 = time()
+            eval_time = 0.0
             val_loss = 0.0
             val_reg_loss = 0.0
             val_rank_loss = 0.0
@@ -369,7 +701,6 @@ class ReRaLSTM:
                 self.valid_index - self.parameters['seq'] - self.steps + 1,
                 self.test_index - self.parameters['seq'] - self.steps + 1
             ):
-                time1 = time()
                 emb_batch, mask_batch, price_batch, gt_batch = self.get_batch(
                     cur_offset)
                 feed_dict = {
@@ -378,52 +709,48 @@ class ReRaLSTM:
                     ground_truth: gt_batch,
                     base_price: price_batch
                 }
+                feed_dict.update(self.relation_feed(sess, graph, train_step))
                 cur_loss, cur_reg_loss, cur_rank_loss, cur_rr, = \
                     sess.run((loss, reg_loss, rank_loss,
                               return_ratio), feed_dict)
-                time2 = time()
                 val_loss += cur_loss
                 val_reg_loss += cur_reg_loss
                 val_rank_loss += cur_rank_loss
-                cur_valid_pred[:, cur_offset - (self.valid_index -
-                                                self.parameters['seq'] -
-                                                self.steps + 1)] = \
-                    copy.copy(cur_rr[:, 0])
-                cur_valid_gt[:, cur_offset - (self.valid_index -
-                                              self.parameters['seq'] -
-                                              self.steps + 1)] = \
-                    copy.copy(gt_batch[:, 0])
-                cur_valid_mask[:, cur_offset - (self.valid_index -
-                                                self.parameters['seq'] -
-                                                self.steps + 1)] = \
-                    copy.copy(mask_batch[:, 0])
+                t3 = time()
+                valid_eval.update(cur_rr, gt_batch, mask_batch)
+                if valid_writer is not None:
+                    valid_writer.write(
+                        cur_offset + self.parameters['seq'] + self.steps - 1,
+                        cur_rr, gt_batch, mask_batch)
+                eval_time += time() - t3
+            if valid_writer is not None:
+                valid_writer.close()
             print('Valid MSE:',
                   val_loss / (self.test_index - self.valid_index),
                   val_reg_loss / (self.test_index - self.valid_index),
                   val_rank_loss / (self.test_index - self.valid_index))
-            cur_valid_perf = evaluate(cur_valid_pred, cur_valid_gt,
-                                      cur_valid_mask)
+            self.profiler.record('valid_inference', time() - t2 - eval_time,
+                                 epoch=i)
+            t3 = time()
+            cur_valid_perf = valid_eval.performance()
+            self.profiler.record('evaluate', eval_time + time() - t3,
+                                 epoch=i, split='valid')
             print('\t Valid preformance:', cur_valid_perf)
 
             # test on testing set
-            cur_test_pred = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
-            cur_test_gt = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
-            cur_test_mask = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
+            test_eval.reset()
+            test_writer = self._archive_writer(
+                'test', i, self.test_index, self.test_end)
+            if self.group_eval is not None:
+                self.group_eval.reset()
+            t2 = time()
+            eval_time = 0.0
             test_loss = 0.0
             test_reg_loss = 0.0
             test_rank_loss = 0.0
             for cur_offset in range(
                                             self.test_index - self.parameters['seq'] - self.steps + 1,
-                                            self.trade_dates - self.parameters['seq'] - self.steps + 1
+                                            self.test_end - self.parameters['seq'] - self.steps + 1
             ):
                 
                 emb_batch, mask_batch, price_batch, gt_batch = self.get_batch(
@@ -435,6 +762,7 @@ class ReRaLSTM:
                     ground_truth: gt_batch,
                     base_price: price_batch
                 }
+                feed_dict.update(self.relation_feed(sess, graph, train_step))
                 cur_loss, cur_reg_loss, cur_rank_loss, cur_rr = \
                     sess.run((loss, reg_loss, rank_loss,
                               return_ratio), feed_dict)
@@ -443,47 +771,77 @@ class ReRaLSTM:
                 test_reg_loss += cur_reg_loss
                 test_rank_loss += cur_rank_loss
 
-                cur_test_pred[:, cur_offset - (self.test_index -
-                                               self.parameters['seq'] -
-                                               self.steps + 1)] = \
-                    copy.copy(cur_rr[:, 0])
-                cur_test_gt[:, cur_offset - (self.test_index -
-                                             self.parameters['seq'] -
-                                             self.steps + 1)] = \
-                    copy.copy(gt_batch[:, 0])
-                cur_test_mask[:, cur_offset - (self.test_index -
-                                               self.parameters['seq'] -
-                                               self.steps + 1)] = \
-                    copy.copy(mask_batch[:, 0])
+                t3 = time()
+                test_eval.update(cur_rr, gt_batch, mask_batch)
+                if self.group_eval is not None:
+                    self.group_eval.update(cur_rr, gt_batch, mask_batch)
+                if test_writer is not None:
+                    test_writer.write(
+                        cur_offset + self.parameters['seq'] + self.steps - 1,
+                        cur_rr, gt_batch, mask_batch)
+                eval_time += time() - t3
+            if test_writer is not None:
+                test_writer.close()
             print('Test MSE:',
-                  test_loss / (self.trade_dates - self.test_index),
-                  test_reg_loss / (self.trade_dates - self.test_index),
-                  test_rank_loss / (self.trade_dates - self.test_index))
-            cur_test_perf = evaluate(cur_test_pred, cur_test_gt, cur_test_mask)
+                  test_loss / (self.test_end - self.test_index),
+                  test_reg_loss / (self.test_end - self.test_index),
+                  test_rank_loss / (self.test_end - self.test_index))
+            self.profiler.record('test_inference', time() - t2 - eval_time,
+                                 epoch=i)
+            t3 = time()
+            cur_test_perf = test_eval.performance()
+            self.profiler.record('evaluate', eval_time + time() - t3,
+                                 epoch=i, split='test')
             print('\t Test performance:', cur_test_perf)
             if val_loss / (self.test_index - self.valid_index) < \
                     best_valid_loss:
                 best_valid_loss = val_loss / (self.test_index -
                                               self.valid_index)
                 best_valid_perf = copy.copy(cur_valid_perf)
-                best_valid_gt = copy.copy(cur_valid_gt)
-                best_valid_pred = copy.copy(cur_valid_pred)
-                best_valid_mask = copy.copy(cur_valid_mask)
+                best_valid_pred, best_valid_gt, best_valid_mask = \
+                    valid_eval.buffered()
                 best_test_perf = copy.copy(cur_test_perf)
-                best_test_gt = copy.copy(cur_test_gt)
-                best_test_pred = copy.copy(cur_test_pred)
-                best_test_mask = copy.copy(cur_test_mask)
+                best_test_pred, best_test_gt, best_test_mask = \
+                    test_eval.buffered()
+                if self.checkpoint is not None:
+                    saver.save(sess, self.checkpoint)
+                if self.archive is not None:
+                    self.archive.mark_best(self.seed, i, self.archive_window)
+                if self.group_eval is not None:
+                    self.best_group_perf = self.group_eval.performance()
                 print('Better valid loss:', best_valid_loss)
             t4 = time()
+            self.profiler.record('epoch', t4 - t1, epoch=i)
             print('epoch:', i, ('time: %.4f ' % (t4 - t1)))
-        print('\nBest Valid performance:', best_valid_perf)
+        self.best_valid_perf = best_valid_perf
+        self.best_test_perf = best_test_perf
+        print('\nTime per phase:', self.profiler.totals)
+        print('Best Valid performance:', best_valid_perf)
         print('\tBest Test performance:', best_test_perf)
         logging.info('\tBest Test performance:'+ str(best_test_perf))
+        if self.group_eval is not None:
+            print('Best Test performance per industry:')
+            for name, perf in sorted(self.best_group_perf.items()):
+                print('\t', name, perf)
         sess.close()
         tf.reset_default_graph()
+        if self.archive is not None and self.keep_pred:
+            best_valid_pred, best_valid_gt, best_valid_mask = \
+                self.archive.read(self.seed, 'valid',
+                                  window=self.archive_window)
+            best_test_pred, best_test_gt, best_test_mask = \
+                self.archive.read(self.seed, 'test',
+                                  window=self.archive_window)
         return best_valid_pred, best_valid_gt, best_valid_mask, \
                best_test_pred, best_test_gt, best_test_mask
 
+    def _archive_writer(self, split, epoch, first_day, end_day):
+        if self.archive is None:
+            return None
+        return self.archive.writer(self.seed, split, epoch, len(self.tickers),
+                                   end_day - first_day, len(self.horizons),
+                                   first_day, self.archive_window)
+
     def update_model(self, parameters):
         for name, value in parameters.items():
             self.parameters[name] = value
@@ -491,64 +849,37 @@ class ReRaLSTM:
 
 
 if __name__ == '__main__':
-    desc = 'train a relational rank lstm model'
-    parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument('-p', help='path of EOD data',
-                        default='../data/2013-01-01')
-    parser.add_argument('-m', help='market name', default='NASDAQ')
-    parser.add_argument('-t', help='fname for selected tickers')
-    parser.add_argument('-l', default=4,
-                        help='length of historical sequence for feature')
-    parser.add_argument('-u', default=64,
-                        help='number of hidden units in lstm')
-    parser.add_argument('-s', default=1,
-                        help='steps to make prediction')
-    parser.add_argument('-r', default=0.001,
-                        help='learning rate')
-    parser.add_argument('-a', default=1,
-                        help='alpha, the weight of ranking loss')
-    parser.add_argument('-g', '--gpu', type=int, default=0, help='use gpu')
-    parser.add_argument('-e', '--emb_file', type=str,
-                        default='NASDAQ_rank_lstm_seq-16_unit-64_2.csv.npy',
-                        help='fname for pretrained sequential embedding')
-    parser.add_argument('-rn', '--rel_name', type=str,
-                        default='sector_industry',
-                        help='relation type: sector_industry or wikidata')
-    parser.add_argument('-ip', '--inner_prod', type=int, default=0)
-    parser.add_argument('-epoch', '--epoch', type=int, default=50)
-    parser.add_argument('-geom', action='store_true')
-    parser.add_argument('-unify', type=str, default="add",
-                            help='self supervised loss type: add or 2way')
-    parser.add_argument('-two_way_b', type=float, default=0.95,
-                            help='unify parameter for 2way')
-    parser.add_argument('-self', type=str, default="None",
-                help='self supervised loss type: part or reg')
-    parser.add_argument('-thresh', type=float, default=1.49,
-                help='threshold')
-    parser.add_argument('-gp', type=int, default=32,
-                help='number of graph partitions for loss part')
-    parser.add_argument('-self_b', type=float, default=1e-4)
-    parser.add_argument('-ratio', type=float, default=1)
-    args = parser.parse_args()
-
-    if args.t is None:
-        args.t = args.m + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
+    args, parameters = parse_args()
     os.environ["CUDA_VISIBLE_DEVICES"]=str(args.gpu)
-    parameters = {'seq': int(args.l), 'unit': int(args.u), 'lr': float(args.r),
-                  'alpha': float(args.a)}
     print('arguments:', args)
     print('parameters:', parameters)
     
-    args.inner_prod = (args.inner_prod == 1)
     seeds = list(range(5))
     # seeds = [3,4]
     logging.basicConfig(filename='few_log/{}_ratio_{}_geom_{}_thresh_{}_unify_{}_2wayb_{}_self_{}_gp_{}_selfb_{}_seeds_{}-{}.log'.format(args.m,args.ratio,args.geom,args.thresh,args.unify,args.two_way_b,args.self,args.gp,args.self_b,seeds[0],seeds[-1]), level=logging.INFO)
     
     logging.info(" ")
+    import tensorflow as tf
     for seed in seeds:
         tf.reset_default_graph()
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        if args.markets is not None:
+            from multi_market import train_multi_market
+            train_multi_market([ReRaLSTM(
+                data_path=args.p,
+                market_name=market,
+                tickers_fname=market_file(args.t, args.m, market),
+                relation_name=args.rel_name,
+                emb_fname=market_file(args.emb_file, args.m, market),
+                parameters=parameters,
+                steps=1, epochs=args.epoch, batch_size=None,
+                in_pro=args.inner_prod,
+                seed=seed,
+                geom=args.geom,
+                args=args
+            ) for market in args.markets], args.market_heads)
+            continue
         RR_LSTM = ReRaLSTM(
             data_path=args.p,
             market_name=args.m,
@@ -560,6 +891,32 @@ if __name__ == '__main__':
             in_pro=args.inner_prod,
             seed=seed,
             geom=args.geom,
-            args=args
+            args=args,
+            # only walk_forward reads the best predictions
+            keep_pred=args.walk_forward > 0
         )
-        pred_all = RR_LSTM.train()
+        if args.tune_threads and seed == seeds[0]:
+            tune_threads(RR_LSTM, thread_file=args.thread_file)
+        if args.walk_forward > 0:
+            from walk_forward import walk_forward
+            walk_forward(RR_LSTM, args.walk_forward, args.wf_epochs,
+                         os.path.join(args.checkpoint_dir, 'seed_%d' % seed),
+                         args.wf_output and
+                         args.wf_output.replace('.npz', '') +
+                         '_seed_%d.npz' % seed)
+        elif args.workers > 1:
+            from data_parallel import train_data_parallel
+            train_data_parallel(RR_LSTM, args.workers)
+        else:
+            if args.export is not None:
+                RR_LSTM.checkpoint = os.path.join(
+                    args.checkpoint_dir, 'seed_%d' % seed, 'model')
+                if not os.path.exists(os.path.dirname(RR_LSTM.checkpoint)):
+                    os.makedirs(os.path.dirname(RR_LSTM.checkpoint))
+            RR_LSTM.train()
+            if args.export is not None:
+                from frozen_graph import export_frozen_graph
+                export_frozen_graph(
+                    RR_LSTM, RR_LSTM.checkpoint,
+                    os.path.join(args.export, 'seed_%d' % seed),
+                    sparse=args.export_sparse)
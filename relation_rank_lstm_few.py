@@ -2,32 +2,26 @@ import argparse
 import copy
 import numpy as np
 import os
-# import psutil
 import random
 import tensorflow as tf
 from time import time
 import logging
-try:
-    from tensorflow.python.ops.nn_ops import leaky_relu
-except ImportError:
-    from tensorflow.python.framework import ops
-    from tensorflow.python.ops import math_ops
-
-
-    def leaky_relu(features, alpha=0.2, name=None):
-        with ops.name_scope(name, "LeakyRelu", [features, alpha]):
-            features = ops.convert_to_tensor(features, name="features")
-            alpha = ops.convert_to_tensor(alpha, name="alpha")
-            return math_ops.maximum(alpha * features, features)
-
+from tf_compat import leaky_relu
 from load_data import load_EOD_data, load_relation_data
-from evaluator import evaluate
+from evaluator import StreamingEvaluator
+from embedding_store import EmbeddingStore
+from batch_index import BatchIndex
+from profiler import Profiler
+from memory import MemoryMonitor, estimate_graph_mb
+from thread_tuner import DEFAULT_FILE, apply_thread_config, \
+    load_thread_config, session_config
 
 
 
 class ReRaLSTM:
     def __init__(self, data_path, market_name, tickers_fname, relation_name,
-                 emb_fname, parameters, steps=1, epochs=50, batch_size=None, flat=False, in_pro=False, seed=123456789, geom=False,args=None):
+                 emb_fname, parameters, steps=1, epochs=50, batch_size=None, flat=False, in_pro=False, seed=123456789, geom=False,args=None,
+                 keep_pred=True):
 
         seed = seed
         random.seed(seed)
@@ -44,44 +38,55 @@ class ReRaLSTM:
         self.unify = args.unify
         self.two_way_b = args.two_way_b
         self.geom=geom
+        self.profiler = Profiler(args.timing_log, args.trace_steps,
+                                 args.trace_dir, seed=seed)
+        self.memory = MemoryMonitor(self.profiler, args.mem_budget)
+        self.thread_file = args.thread_file
         # load data
         self.tickers = np.genfromtxt(os.path.join(data_path, '..', tickers_fname),
                                      dtype=str, delimiter='\t', skip_header=False)
         self.train_ratio = float(args.train_ratio)
         self.train_size = int(self.train_ratio*len(self.tickers))
         print('#tickers selected:', self.train_size)
-        self.eod_data, self.mask_data, self.gt_data, self.price_data = \
-            load_EOD_data(data_path, market_name, self.tickers, steps)
+        with self.profiler.phase('load_eod'):
+            self.eod_data, self.mask_data, self.gt_data, self.price_data = \
+                load_EOD_data(data_path, market_name, self.tickers, steps)
+        self.memory.snapshot('load_eod', self)
 
         # relation data
         rname_tail = {'sector_industry': '_industry_relation.npy',
                       'wikidata': '_wiki_relation.npy'}
-        if geom:
-            self.rel_encoding, self.rel_mask = load_relation_data(
-                os.path.join(self.data_path, '..', 'relation', self.relation_name,
-                            self.market_name + rname_tail[self.relation_name][:-4] + "_geom_{}.npy".format(args.thresh))
-            )
-        else:
-            self.rel_encoding, self.rel_mask = load_relation_data(
-                os.path.join(self.data_path, '..', 'relation', self.relation_name,
-                            self.market_name + rname_tail[self.relation_name])
-            )
+        with self.profiler.phase('load_relation'):
+            if geom:
+                self.rel_encoding, self.rel_mask = load_relation_data(
+                    os.path.join(self.data_path, '..', 'relation', self.relation_name,
+                                self.market_name + rname_tail[self.relation_name][:-4] + "_geom_{}.npy".format(args.thresh))
+                )
+            else:
+                self.rel_encoding, self.rel_mask = load_relation_data(
+                    os.path.join(self.data_path, '..', 'relation', self.relation_name,
+                                self.market_name + rname_tail[self.relation_name])
+                )
         if self.reg=="part":
-            self.part_label = np.load("../data/{}_part_{}.npy".format(self.market_name, args.gp))
+            self.part_label = np.load(os.path.join(
+                self.data_path, '..', "{}_part_{}.npy".format(self.market_name, args.gp)))
 
         print('relation encoding shape:', self.rel_encoding.shape)
         print('relation mask shape:', self.rel_mask.shape)
+        self.memory.snapshot('load_relation', self)
 
-        self.embedding = np.load(
-            os.path.join(self.data_path, '..', 'pretrain', emb_fname))
+        with self.profiler.phase('load_embedding'):
+            self.embedding = EmbeddingStore(
+                os.path.join(self.data_path, '..', 'pretrain', emb_fname),
+                day_major=args.emb_day_major, tickers=len(self.tickers))
         print('embedding shape:', self.embedding.shape)
+        self.memory.snapshot('load_embedding', self)
 
         # for few training
         np.random.seed(int(args.train_ratio_seed))
         self.select_index = np.random.choice(len(self.tickers),size=self.train_size,replace=False)
         self.train_mask_data, self.train_gt_data, self.train_price_data = self.mask_data[self.select_index,:], self.gt_data[self.select_index,:], self.price_data[self.select_index,:]
-        self.train_embedding = self.embedding[self.select_index,:,:]
-        print("train embed gt:",self.train_embedding.shape,self.train_gt_data.shape)
+        print("train gt:",self.train_gt_data.shape)
         self.train_rel_encoding, self.train_rel_mask = self.rel_encoding[self.select_index,:,:][:,self.select_index,:], self.rel_mask[self.select_index,:][:,self.select_index]
         print("train rel_enc rel_mask:",self.rel_encoding.shape,self.train_rel_encoding.shape,self.train_rel_mask.shape)
         self.parameters = copy.copy(parameters)
@@ -89,45 +94,43 @@ class ReRaLSTM:
         self.epochs = epochs
         self.flat = flat
         self.inner_prod = in_pro
+        # keep the best raw predictions in memory to be returned by train
+        self.keep_pred = keep_pred
         if batch_size is None:
             self.batch_size = len(self.tickers)
         else:
             self.batch_size = batch_size
 
-        self.valid_index = 756
-        self.test_index = 1008
+        self.valid_index = args.valid_index
+        self.test_index = args.test_index
         self.trade_dates = self.mask_data.shape[1]
+        # the test days are [test_index, test_end)
+        self.test_end = self.trade_dates
+        # masks, prices and ground truths of every offset, of all tickers
+        # and of the few-shot train tickers
+        self.batches = None
+        self.train_batches = None
         self.fea_dim = 5
 
     def get_batch(self, offset=None):
         if offset is None:
             offset = random.randrange(0, self.valid_index)
         seq_len = self.parameters['seq']
-        mask_batch = self.mask_data[:, offset: offset + seq_len + self.steps]
-        mask_batch = np.min(mask_batch, axis=1)
-        return self.embedding[:, offset, :], \
-               np.expand_dims(mask_batch, axis=1), \
-               np.expand_dims(
-                   self.price_data[:, offset + seq_len - 1], axis=1
-               ), \
-               np.expand_dims(
-                   self.gt_data[:, offset + seq_len + self.steps - 1], axis=1
-               )
+        if self.batches is None or self.batches.seq != seq_len:
+            self.batches = BatchIndex(self.mask_data, self.gt_data,
+                                      self.price_data, seq_len, [self.steps])
+        return (self.embedding.day(offset),) + self.batches.batch(offset)
 
     def get_train_batch(self, offset=None):
         if offset is None:
             offset = random.randrange(0, self.valid_index)
         seq_len = self.parameters['seq']
-        train_mask_batch = self.train_mask_data[:, offset: offset + seq_len + self.steps]
-        train_mask_batch = np.min(train_mask_batch, axis=1)
-        return self.train_embedding[:, offset, :], \
-               np.expand_dims(train_mask_batch, axis=1), \
-               np.expand_dims(
-                   self.train_price_data[:, offset + seq_len - 1], axis=1
-               ), \
-               np.expand_dims(
-                   self.train_gt_data[:, offset + seq_len + self.steps - 1], axis=1
-               )
+        if self.train_batches is None or self.train_batches.seq != seq_len:
+            self.train_batches = BatchIndex(
+                self.train_mask_data, self.train_gt_data,
+                self.train_price_data, seq_len, [self.steps])
+        return (self.embedding.day(offset)[self.select_index],) + \
+            self.train_batches.batch(offset)
 
 
     def train(self):
@@ -139,10 +142,16 @@ class ReRaLSTM:
         # with tf.device(device_name):
 
         # tf.reset_default_graph()
+        t0 = time()
         seed = self.seed
         random.seed(seed)
         np.random.seed(seed)
         tf.set_random_seed(seed)
+        # before any of the N x N x K constants is built
+        self.memory.check_budget('graph', estimate_graph_mb(
+            self.rel_encoding.shape[0], self.rel_encoding.shape[2],
+            two_way=self.geom and self.unify == "2way",
+            reg=self.reg == "reg"))
 
         ground_truth = tf.placeholder(tf.float32, [None, 1])
         mask = tf.placeholder(tf.float32, [None, 1])
@@ -310,35 +319,28 @@ class ReRaLSTM:
         optimizer = tf.train.AdamOptimizer(
             learning_rate=self.parameters['lr']
         ).minimize(loss)
-        config = tf.ConfigProto()
-        config.gpu_options.allow_growth = True
+        # thread settings tuned on this host, see thread_tuner.py
+        thread_config = load_thread_config(
+            len(self.tickers), self.parameters['unit'], self.thread_file)
+        if thread_config is not None:
+            print('thread config:', thread_config)
+        thread_limiter = apply_thread_config(thread_config)
+        config = session_config(thread_config)
         sess = tf.Session(config=config)
         saver = tf.train.Saver()
         sess.run(tf.global_variables_initializer())
-        best_valid_pred = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
-        )
-        best_valid_gt = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
-        )
-        best_valid_mask = np.zeros(
-            [len(self.tickers), self.test_index - self.valid_index],
-            dtype=float
+        self.profiler.record('graph', time() - t0)
+        self.memory.snapshot('graph', self)
+        valid_eval = StreamingEvaluator(
+            buffer_days=self.test_index - self.valid_index
+            if self.keep_pred else None
         )
-        best_test_pred = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
-        )
-        best_test_gt = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
-        )
-        best_test_mask = np.zeros(
-            [len(self.tickers), self.trade_dates - self.parameters['seq'] -
-             self.test_index - self.steps + 1], dtype=float
+        test_eval = StreamingEvaluator(
+            buffer_days=self.test_end - self.test_index
+            if self.keep_pred else None
         )
+        best_valid_pred, best_valid_gt, best_valid_mask = None, None, None
+        best_test_pred, best_test_gt, best_test_mask = None, None, None
         best_valid_perf = {
             'mse': np.inf, 'mrrt': 0.0, 'btl': 0.0
         }
@@ -347,10 +349,12 @@ class ReRaLSTM:
         }
         best_valid_loss = np.inf
         batch_offsets = np.arange(start=0, stop=self.valid_index, dtype=int)
+        train_step = 0
         for i in range(self.epochs):
             t1 = time()
             np.random.seed(self.seed)
             np.random.shuffle(batch_offsets)
+            epoch_step = train_step
             tra_loss = 0.0
             tra_reg_loss = 0.0
             tra_rank_loss = 0.0
@@ -365,30 +369,28 @@ class ReRaLSTM:
                     base_price: price_batch,
                     is_train:True
                 }
+                run_kwargs = self.profiler.run_options(train_step)
                 cur_loss, cur_reg_loss, cur_rank_loss, batch_out = \
                     sess.run((loss, reg_loss, rank_loss, optimizer),
-                             feed_dict)
+                             feed_dict, **run_kwargs)
+                self.profiler.write_trace(train_step, run_kwargs)
+                if train_step == 0:
+                    self.memory.snapshot('first_step', self)
+                train_step += 1
                 tra_loss += cur_loss
                 tra_reg_loss += cur_reg_loss
                 tra_rank_loss += cur_rank_loss
+            self.profiler.record('train', time() - t1, epoch=i,
+                                 steps=train_step - epoch_step)
             print('Train Loss:',
                   tra_loss / (self.valid_index - self.parameters['seq'] - self.steps + 1),
                   tra_reg_loss / (self.valid_index - self.parameters['seq'] - self.steps + 1),
                   tra_rank_loss / (self.valid_index - self.parameters['seq'] - self.steps + 1))
 
             # test on validation set
-            cur_valid_pred = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
-            cur_valid_gt = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
-            cur_valid_mask = np.zeros(
-                [len(self.tickers), self.test_index - self.valid_index],
-                dtype=float
-            )
+            valid_eval.reset()
+            t2 = time()
+            eval_time = 0.0
             val_loss = 0.0
             val_reg_loss = 0.0
             val_rank_loss = 0.0
@@ -398,7 +400,6 @@ class ReRaLSTM:
             ):
                 emb_batch, mask_batch, price_batch, gt_batch = self.get_batch(
                     cur_offset)
-                time2 = time()
                 feed_dict = {
                     feature: emb_batch,
                     mask: mask_batch,
@@ -409,49 +410,35 @@ class ReRaLSTM:
                 cur_loss, cur_reg_loss, cur_rank_loss, cur_rr, = \
                     sess.run((loss, reg_loss, rank_loss,
                               return_ratio), feed_dict)
-                time3 = time()
                 val_loss += cur_loss
                 val_reg_loss += cur_reg_loss
                 val_rank_loss += cur_rank_loss
-                cur_valid_pred[:, cur_offset - (self.valid_index -
-                                                self.parameters['seq'] -
-                                                self.steps + 1)] = \
-                    copy.copy(cur_rr[:, 0])
-                cur_valid_gt[:, cur_offset - (self.valid_index -
-                                              self.parameters['seq'] -
-                                              self.steps + 1)] = \
-                    copy.copy(gt_batch[:, 0])
-                cur_valid_mask[:, cur_offset - (self.valid_index -
-                                                self.parameters['seq'] -
-                                                self.steps + 1)] = \
-                    copy.copy(mask_batch[:, 0])
+                t3 = time()
+                valid_eval.update(cur_rr[:, 0], gt_batch[:, 0],
+                                  mask_batch[:, 0])
+                eval_time += time() - t3
             print('Valid MSE:',
                   val_loss / (self.test_index - self.valid_index),
                   val_reg_loss / (self.test_index - self.valid_index),
                   val_rank_loss / (self.test_index - self.valid_index))
-            cur_valid_perf = evaluate(cur_valid_pred, cur_valid_gt,
-                                      cur_valid_mask)
+            self.profiler.record('valid_inference', time() - t2 - eval_time,
+                                 epoch=i)
+            t3 = time()
+            cur_valid_perf = valid_eval.performance()
+            self.profiler.record('evaluate', eval_time + time() - t3,
+                                 epoch=i, split='valid')
             print('\t Valid preformance:', cur_valid_perf)
 
             # test on testing set
-            cur_test_pred = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
-            cur_test_gt = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
-            cur_test_mask = np.zeros(
-                [len(self.tickers), self.trade_dates - self.test_index],
-                dtype=float
-            )
+            test_eval.reset()
+            t2 = time()
+            eval_time = 0.0
             test_loss = 0.0
             test_reg_loss = 0.0
             test_rank_loss = 0.0
             for cur_offset in range(
                                             self.test_index - self.parameters['seq'] - self.steps + 1,
-                                            self.trade_dates - self.parameters['seq'] - self.steps + 1
+                                            self.test_end - self.parameters['seq'] - self.steps + 1
             ):
                 emb_batch, mask_batch, price_batch, gt_batch = self.get_batch(
                     cur_offset)
@@ -469,40 +456,37 @@ class ReRaLSTM:
                 test_reg_loss += cur_reg_loss
                 test_rank_loss += cur_rank_loss
 
-                cur_test_pred[:, cur_offset - (self.test_index -
-                                               self.parameters['seq'] -
-                                               self.steps + 1)] = \
-                    copy.copy(cur_rr[:, 0])
-                cur_test_gt[:, cur_offset - (self.test_index -
-                                             self.parameters['seq'] -
-                                             self.steps + 1)] = \
-                    copy.copy(gt_batch[:, 0])
-                cur_test_mask[:, cur_offset - (self.test_index -
-                                               self.parameters['seq'] -
-                                               self.steps + 1)] = \
-                    copy.copy(mask_batch[:, 0])
+                t3 = time()
+                test_eval.update(cur_rr[:, 0], gt_batch[:, 0],
+                                 mask_batch[:, 0])
+                eval_time += time() - t3
             print('Test MSE:',
-                  test_loss / (self.trade_dates - self.test_index),
-                  test_reg_loss / (self.trade_dates - self.test_index),
-                  test_rank_loss / (self.trade_dates - self.test_index))
-            cur_test_perf = evaluate(cur_test_pred, cur_test_gt, cur_test_mask)
+                  test_loss / (self.test_end - self.test_index),
+                  test_reg_loss / (self.test_end - self.test_index),
+                  test_rank_loss / (self.test_end - self.test_index))
+            self.profiler.record('test_inference', time() - t2 - eval_time,
+                                 epoch=i)
+            t3 = time()
+            cur_test_perf = test_eval.performance()
+            self.profiler.record('evaluate', eval_time + time() - t3,
+                                 epoch=i, split='test')
             print('\t Test performance:', cur_test_perf)
             if val_loss / (self.test_index - self.valid_index) < \
                     best_valid_loss:
                 best_valid_loss = val_loss / (self.test_index -
                                               self.valid_index)
                 best_valid_perf = copy.copy(cur_valid_perf)
-                best_valid_gt = copy.copy(cur_valid_gt)
-                best_valid_pred = copy.copy(cur_valid_pred)
-                best_valid_mask = copy.copy(cur_valid_mask)
+                best_valid_pred, best_valid_gt, best_valid_mask = \
+                    valid_eval.buffered()
                 best_test_perf = copy.copy(cur_test_perf)
-                best_test_gt = copy.copy(cur_test_gt)
-                best_test_pred = copy.copy(cur_test_pred)
-                best_test_mask = copy.copy(cur_test_mask)
+                best_test_pred, best_test_gt, best_test_mask = \
+                    test_eval.buffered()
                 print('Better valid loss:', best_valid_loss)
             t4 = time()
+            self.profiler.record('epoch', t4 - t1, epoch=i)
             print('epoch:', i, ('time: %.4f ' % (t4 - t1)))
-        print('\nBest Valid performance:', best_valid_perf)
+        print('\nTime per phase:', self.profiler.totals)
+        print('Best Valid performance:', best_valid_perf)
         print('\tBest Test performance:', best_test_perf)
         logging.info('\tBest Test performance:'+ str(best_test_perf))
         sess.close()
@@ -516,7 +500,7 @@ class ReRaLSTM:
         return True
 
 
-if __name__ == '__main__':
+def parse_args(argv=None):
     desc = 'train a relational rank lstm model'
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument('-p', help='path of EOD data',
@@ -537,10 +521,30 @@ if __name__ == '__main__':
                         help='train ratio of stocks')
     parser.add_argument('-train_ratio_seed', default=0,
                         help='train ratio of stocks')                  
+    parser.add_argument('-valid_index', type=int, default=756,
+                        help='first validation day')
+    parser.add_argument('-test_index', type=int, default=1008,
+                        help='first test day')
     parser.add_argument('-g', '--gpu', type=int, default=0, help='use gpu')
     parser.add_argument('-e', '--emb_file', type=str,
                         default='NASDAQ_rank_lstm_seq-16_unit-64_2.csv.npy',
                         help='fname for pretrained sequential embedding')
+    parser.add_argument('-emb_day_major', action='store_true',
+                        help='the embedding file is stored as T x N x U, '
+                             'see embedding_store.py')
+    parser.add_argument('-timing_log', type=str, default=None,
+                        help='JSON lines file of per-phase timings, '
+                             '- for stdout')
+    parser.add_argument('-trace_steps', type=str, default=None,
+                        help='train steps to trace with the TF timeline, '
+                             'e.g. 100-110')
+    parser.add_argument('-trace_dir', type=str, default='trace',
+                        help='folder of the timeline traces')
+    parser.add_argument('-mem_budget', type=float, default=None,
+                        help='memory budget in MB, warn before exceeding it')
+    parser.add_argument('-thread_file', type=str, default=DEFAULT_FILE,
+                        help='tuned thread settings per host, empty to '
+                             'ignore them')
     parser.add_argument('-rn', '--rel_name', type=str,
                         default='sector_industry',
                         help='relation type: sector_industry or wikidata')
@@ -558,17 +562,22 @@ if __name__ == '__main__':
     parser.add_argument('-gp', type=int, default=32,
                 help='number of graph partitions for loss part')
     parser.add_argument('-self_b', type=float, default=1e-4)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.t is None:
         args.t = args.m + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
-    os.environ["CUDA_VISIBLE_DEVICES"]=str(args.gpu)
     parameters = {'seq': int(args.l), 'unit': int(args.u), 'lr': float(args.r),
                   'alpha': float(args.a)}
+    args.inner_prod = (args.inner_prod == 1)
+    return args, parameters
+
+
+if __name__ == '__main__':
+    args, parameters = parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"]=str(args.gpu)
     print('arguments:', args)
     print('parameters:', parameters)
     
-    args.inner_prod = (args.inner_prod == 1)
     seeds = list(range(5))
     # seeds = [3,4]
     logging.basicConfig(filename='few_log/{}_ratio_{}_seeds_{}.log'.format(args.m, args.train_ratio, args.train_ratio_seed), level=logging.INFO)
@@ -589,6 +598,7 @@ if __name__ == '__main__':
             in_pro=args.inner_prod,
             seed=seed,
             geom=args.geom,
-            args=args
+            args=args,
+            keep_pred=False
         )
-        pred_all = RR_LSTM.train()
\ No newline at end of file
+        RR_LSTM.train()
\ No newline at end of file
@@ -0,0 +1,216 @@
+import json
+import os
+
+import numpy as np
+
+
+class RelationStore:
+    def __init__(self, relation_file, tickers, part_label=None,
+                 delta_dir=None):
+        '''
+        the relation encoding of relation_file, updated in place by delta
+        files instead of being regenerated, see apply_delta
+        relation_file: N x N x K .npy, as read by load_relation_data; its
+            version and applied deltas are kept in <relation_file>.json by
+            save
+        tickers: tickers of the rows and columns, the first N are used
+        part_label: partition of every ticker, kept in sync when tickers are
+            added
+        delta_dir: folder polled for delta files (.jsonl), applied in name
+            order
+        '''
+        encoding = np.load(relation_file)
+        self.relation_file = relation_file
+        self.delta_dir = delta_dir
+        self.size = encoding.shape[0]
+        self._encoding = encoding
+        # 0 for related pairs, -1e9 otherwise, as in load_relation_data
+        self._mask = np.where(np.sum(encoding, axis=2) == 0, -1e9, 0.0)
+        # column sums of the adjacency, as in load_graph_relation_data
+        self._degree = np.sum(self._mask == 0, axis=0)
+        self._norm_adj = None
+        self._dirty = set()
+        self.tickers = [str(ticker) for ticker in tickers[:self.size]]
+        self.index = dict((ticker, i) for i, ticker in enumerate(self.tickers))
+        self.part_label = None if part_label is None else \
+            np.asarray(part_label)[:self.size].copy()
+        diagonal = np.arange(self.size)
+        self.self_loops = bool(np.all(encoding[diagonal, diagonal, -1]))
+        self.version = 0
+        self.applied = []
+        if os.path.exists(self._state_file()):
+            with open(self._state_file()) as fin:
+                state = json.load(fin)
+            self.version = state['version']
+            self.applied = state['applied']
+
+    @property
+    def encoding(self):
+        return self._encoding[:self.size, :self.size]
+
+    @property
+    def mask(self):
+        return self._mask[:self.size, :self.size]
+
+    def _state_file(self, relation_file=None):
+        return os.path.splitext(relation_file or self.relation_file)[0] + \
+            '.json'
+
+    def _set(self, src, dst, rel, value):
+        self._encoding[src, dst, rel] = value
+        related = bool(np.any(self._encoding[src, dst]))
+        if related != (self._mask[src, dst] == 0):
+            self._mask[src, dst] = 0.0 if related else -1e9
+            self._degree[dst] += 1 if related else -1
+            # the normalized adjacency changes on the row and column of dst
+            self._dirty.add(dst)
+
+    def _grow(self, capacity):
+        '''
+        reallocates with room for capacity tickers, doubling so that adding
+        tickers one by one is amortized O(N K) each
+        '''
+        encoding = np.zeros((capacity, capacity, self._encoding.shape[2]),
+                            dtype=self._encoding.dtype)
+        encoding[:self.size, :self.size] = self.encoding
+        mask = np.full((capacity, capacity), -1e9)
+        mask[:self.size, :self.size] = self.mask
+        degree = np.zeros(capacity, dtype=self._degree.dtype)
+        degree[:self.size] = self._degree[:self.size]
+        self._encoding, self._mask, self._degree = encoding, mask, degree
+        self._norm_adj = None
+
+    def add_ticker(self, ticker, part=None):
+        if ticker in self.index:
+            raise ValueError('ticker %s is already in the relations' % ticker)
+        if self.size == self._encoding.shape[0]:
+            self._grow(max(2 * self.size, 1))
+        i = self.size
+        self.size += 1
+        self.tickers.append(ticker)
+        self.index[ticker] = i
+        if self.part_label is not None:
+            # -1 until resolved from the neighbors, see _resolve_parts
+            self.part_label = np.append(self.part_label,
+                                        -1 if part is None else part)
+        if self.self_loops:
+            self._set(i, i, -1, 1)
+        self._dirty.add(i)
+        return i
+
+    def _pairs(self, record):
+        src, dst = self.index[record['src']], self.index[record['dst']]
+        if record.get('directed', False) or src == dst:
+            return [(src, dst)]
+        return [(src, dst), (dst, src)]
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'add_ticker':
+            self.add_ticker(record['ticker'], record.get('part'))
+            return
+        for src, dst in self._pairs(record):
+            if op == 'add_edge':
+                self._set(src, dst, record['type'], 1)
+            elif op == 'remove_edge':
+                types = [record['type']] if 'type' in record else \
+                    range(self._encoding.shape[2])
+                for rel in types:
+                    self._set(src, dst, rel, 0)
+            elif op == 'change_type':
+                self._set(src, dst, record['from'], 0)
+                self._set(src, dst, record['to'], 1)
+            else:
+                raise ValueError('unknown relation delta: %s' % op)
+
+    def _resolve_parts(self):
+        '''
+        added tickers without a partition join the most common one among
+        their neighbors, or the smallest one if they have none
+        '''
+        if self.part_label is None:
+            return
+        for i in np.nonzero(self.part_label < 0)[0]:
+            neighbors = np.nonzero(self.mask[:, i] == 0)[0]
+            labels = self.part_label[neighbors]
+            labels = labels[labels >= 0]
+            if len(labels):
+                self.part_label[i] = np.argmax(np.bincount(labels))
+            else:
+                self.part_label[i] = np.argmin(np.bincount(
+                    self.part_label[self.part_label >= 0], minlength=1))
+
+    def apply_delta(self, delta_file):
+        '''
+        applies one delta file, a JSON object per line:
+            {"op": "add_edge", "src": "AAPL", "dst": "MSFT", "type": 3}
+            {"op": "remove_edge", "src": ..., "dst": ..., "type": 3}, all
+                relation types if type is omitted
+            {"op": "change_type", "src": ..., "dst": ..., "from": 3, "to": 5}
+            {"op": "add_ticker", "ticker": "NEW", "part": 7}, part optional
+        edges are undirected unless "directed": true; every delta costs
+        O(K), plus amortized O(N K) per added ticker
+        returns: the new version
+        '''
+        with open(delta_file) as fin:
+            for line in fin:
+                if line.strip():
+                    self._apply(json.loads(line))
+        self._resolve_parts()
+        self.version += 1
+        self.applied.append(os.path.basename(delta_file))
+        return self.version
+
+    def poll(self):
+        '''
+        applies the delta files of delta_dir not applied yet
+        returns: True if the relations changed
+        '''
+        if self.delta_dir is None or not os.path.isdir(self.delta_dir):
+            return False
+        version = self.version
+        for fname in sorted(os.listdir(self.delta_dir)):
+            if fname.endswith('.jsonl') and fname not in self.applied:
+                self.apply_delta(os.path.join(self.delta_dir, fname))
+        return self.version != version
+
+    def normalized_adjacency(self, lap=False):
+        '''
+        D^-1/2 A D^-1/2 (I minus it if lap) as in load_graph_relation_data,
+        kept up to date on the rows and columns of the tickers whose degree
+        changed, O(N) each
+        '''
+        degree = self._degree[:self.size]
+        inv_sqrt = np.where(degree > 0, 1.0 / np.sqrt(np.maximum(degree, 1)),
+                            0.0)
+        if self._norm_adj is None or self._norm_adj.shape[0] != self.size:
+            self._norm_adj = inv_sqrt[:, None] * (self.mask == 0) * \
+                inv_sqrt[None, :]
+        else:
+            for i in self._dirty:
+                self._norm_adj[:, i] = inv_sqrt * (self.mask[:, i] == 0) * \
+                    inv_sqrt[i]
+                self._norm_adj[i, :] = inv_sqrt[i] * (self.mask[i, :] == 0) * \
+                    inv_sqrt
+        self._dirty = set()
+        if lap:
+            return np.identity(self.size) - self._norm_adj
+        return self._norm_adj.copy()
+
+    def snapshot(self):
+        '''
+        returns: version, encoding and mask copies that later deltas do not
+            modify, for a predictor to swap in at once
+        '''
+        return self.version, self.encoding.copy(), self.mask.copy()
+
+    def save(self, relation_file=None):
+        '''
+        writes the current encoding, so that the next full load starts from
+        it, and its version, applied deltas and tickers
+        '''
+        relation_file = relation_file or self.relation_file
+        np.save(relation_file, np.ascontiguousarray(self.encoding))
+        with open(self._state_file(relation_file), 'w') as fout:
+            json.dump({'version': self.version, 'applied': self.applied,
+                       'tickers': self.tickers}, fout)
@@ -0,0 +1,219 @@
+import argparse
+import numpy as np
+import os
+import random
+
+from load_data import load_EOD_data
+from embedding_store import append_days
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class SequenceEncoder:
+    def __init__(self, kernel, bias, seq, forget_bias=1.0):
+        '''
+        numpy forward pass of the rank lstm, with the weight layout of
+        tf.nn.rnn_cell.BasicLSTMCell
+        kernel: (F + U) x 4U
+        bias: 4U
+        seq: length of the windows to encode
+        '''
+        self.kernel = kernel
+        self.bias = bias
+        self.seq = seq
+        self.forget_bias = forget_bias
+        self.units = bias.shape[0] // 4
+
+    def encode(self, eod_data, start, end):
+        '''
+        eod_data: N x T x F
+        returns: N x (end - start) x U, the last hidden state of the windows
+            [offset, offset + seq) for every offset in [start, end)
+        '''
+        tickers, windows = eod_data.shape[0], end - start
+        h = np.zeros([tickers * windows, self.units], dtype=np.float32)
+        c = np.zeros([tickers * windows, self.units], dtype=np.float32)
+        for step in range(self.seq):
+            # day offset + step of every window, N * windows x F
+            x = eod_data[:, start + step: end + step, :].reshape(
+                tickers * windows, -1)
+            gates = np.dot(np.concatenate([x, h], axis=1), self.kernel) + \
+                self.bias
+            i, j, f, o = np.split(gates, 4, axis=1)
+            c = c * _sigmoid(f + self.forget_bias) + _sigmoid(i) * np.tanh(j)
+            h = np.tanh(c) * _sigmoid(o)
+        return h.reshape(tickers, windows, self.units)
+
+
+def fit_encoder(eod_data, mask_data, gt_data, price_data, parameters,
+                steps=1, epochs=50, train_days=756, seed=123456789):
+    '''
+    train the rank lstm on the windows before train_days and return its
+    encoder, as the external pretrain step did
+    parameters: {'seq', 'unit', 'lr', 'alpha'}
+    '''
+    import tensorflow as tf
+    from tf_compat import leaky_relu
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.set_random_seed(seed)
+    seq_len = parameters['seq']
+    tickers, fea_dim = eod_data.shape[0], eod_data.shape[2]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        feature = tf.placeholder(tf.float32, [tickers, seq_len, fea_dim])
+        ground_truth = tf.placeholder(tf.float32, [tickers, 1])
+        mask = tf.placeholder(tf.float32, [tickers, 1])
+        base_price = tf.placeholder(tf.float32, [tickers, 1])
+        all_one = tf.ones([tickers, 1], dtype=tf.float32)
+
+        lstm_cell = tf.nn.rnn_cell.BasicLSTMCell(parameters['unit'])
+        outputs, _ = tf.nn.dynamic_rnn(lstm_cell, feature, dtype=tf.float32)
+        prediction = tf.layers.dense(
+            outputs[:, -1, :], units=1, activation=leaky_relu,
+            kernel_initializer=tf.glorot_uniform_initializer()
+        )
+        return_ratio = tf.div(tf.subtract(prediction, base_price), base_price)
+        reg_loss = tf.losses.mean_squared_error(
+            ground_truth, return_ratio, weights=mask
+        )
+        pre_pw_dif = tf.subtract(
+            tf.matmul(return_ratio, all_one, transpose_b=True),
+            tf.matmul(all_one, return_ratio, transpose_b=True)
+        )
+        gt_pw_dif = tf.subtract(
+            tf.matmul(all_one, ground_truth, transpose_b=True),
+            tf.matmul(ground_truth, all_one, transpose_b=True)
+        )
+        mask_pw = tf.matmul(mask, mask, transpose_b=True)
+        rank_loss = tf.reduce_mean(
+            tf.nn.relu(tf.multiply(tf.multiply(pre_pw_dif, gt_pw_dif),
+                                   mask_pw))
+        )
+        loss = reg_loss + tf.cast(parameters['alpha'], tf.float32) * rank_loss
+        optimizer = tf.train.AdamOptimizer(
+            learning_rate=parameters['lr']).minimize(loss)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            batch_offsets = np.arange(train_days - seq_len - steps + 1)
+            for i in range(epochs):
+                np.random.shuffle(batch_offsets)
+                tra_loss = 0.0
+                for offset in batch_offsets:
+                    mask_batch = np.min(
+                        mask_data[:, offset: offset + seq_len + steps], axis=1)
+                    feed_dict = {
+                        feature: eod_data[:, offset: offset + seq_len, :],
+                        mask: mask_batch[:, None],
+                        ground_truth:
+                            gt_data[:, offset + seq_len + steps - 1, None],
+                        base_price: price_data[:, offset + seq_len - 1, None]
+                    }
+                    cur_loss, _ = sess.run((loss, optimizer), feed_dict)
+                    tra_loss += cur_loss
+                print('encoder epoch:', i, 'loss:',
+                      tra_loss / len(batch_offsets))
+            kernel, bias = sess.run(lstm_cell.weights)
+    return SequenceEncoder(kernel, bias, seq_len)
+
+
+def save_encoder(state_file, encoder, offsets):
+    '''
+    offsets: number of window offsets already written to the embedding
+    '''
+    np.savez(state_file, kernel=encoder.kernel, bias=encoder.bias,
+             seq=encoder.seq, offsets=offsets)
+
+
+def load_encoder(state_file):
+    state = np.load(state_file)
+    return SequenceEncoder(state['kernel'], state['bias'],
+                           int(state['seq'])), int(state['offsets'])
+
+
+def update_embedding(state_file, emb_file, eod_data, day_major=True,
+                     dtype=np.float32, chunk_days=64):
+    '''
+    embed the windows of eod_data that are not in emb_file yet, append them
+    to emb_file in place and record the progress in state_file
+    '''
+    encoder, done = load_encoder(state_file)
+    total = eod_data.shape[1] - encoder.seq + 1
+    if os.path.exists(emb_file):
+        stored = np.load(emb_file, mmap_mode='r').shape[0 if day_major else 1]
+        assert stored == done, \
+            'embedding has %d days, encoder state expects %d' % (stored, done)
+    print('embedding windows', done, '->', total)
+    for start in range(done, total, chunk_days):
+        emb = encoder.encode(eod_data, start, min(start + chunk_days, total))
+        if day_major:
+            emb = emb.transpose(1, 0, 2)
+        if start == 0:
+            np.save(emb_file, emb.astype(dtype))
+        else:
+            append_days(emb_file, emb, day_major=day_major)
+        save_encoder(state_file, encoder, start + emb.shape[0 if day_major
+                                                            else 1])
+    return total
+
+
+if __name__ == '__main__':
+    desc = 'compute the sequential embedding of the rank lstm in place'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-p', help='path of EOD data',
+                        default='../data/2013-01-01')
+    parser.add_argument('-m', help='market name', default='NASDAQ')
+    parser.add_argument('-t', help='fname for selected tickers')
+    parser.add_argument('-l', default=16,
+                        help='length of historical sequence for feature')
+    parser.add_argument('-u', default=64,
+                        help='number of hidden units in lstm')
+    parser.add_argument('-s', default=1,
+                        help='steps to make prediction')
+    parser.add_argument('-r', default=0.001,
+                        help='learning rate')
+    parser.add_argument('-a', default=1,
+                        help='alpha, the weight of ranking loss')
+    parser.add_argument('-e', '--emb_file', type=str,
+                        help='fname for the sequential embedding')
+    parser.add_argument('-state', type=str,
+                        help='fname for the encoder state (.npz)')
+    parser.add_argument('-fit', action='store_true',
+                        help='(re)train the encoder and embed all days')
+    parser.add_argument('-epoch', '--epoch', type=int, default=50)
+    parser.add_argument('-ticker_major', action='store_true',
+                        help='write N x T x U instead of T x N x U')
+    parser.add_argument('-dtype', type=str, default='float32',
+                        help='storage precision: float16 or float32')
+    args = parser.parse_args()
+
+    if args.t is None:
+        args.t = args.m + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
+    if args.emb_file is None:
+        args.emb_file = '%s_seq_emb_seq-%s_unit-%s.npy' % (args.m, args.l,
+                                                           args.u)
+    if args.state is None:
+        args.state = args.emb_file[:-4] + '_state.npz'
+    parameters = {'seq': int(args.l), 'unit': int(args.u), 'lr': float(args.r),
+                  'alpha': float(args.a)}
+    emb_path = os.path.join(args.p, '..', 'pretrain', args.emb_file)
+    state_path = os.path.join(args.p, '..', 'pretrain', args.state)
+
+    tickers = np.genfromtxt(os.path.join(args.p, '..', args.t),
+                            dtype=str, delimiter='\t', skip_header=False)
+    eod_data, mask_data, gt_data, price_data = \
+        load_EOD_data(args.p, args.m, tickers, int(args.s))
+    if args.fit or not os.path.exists(state_path):
+        encoder = fit_encoder(eod_data, mask_data, gt_data, price_data,
+                              parameters, steps=int(args.s),
+                              epochs=args.epoch)
+        if os.path.exists(emb_path):
+            os.remove(emb_path)
+        save_encoder(state_path, encoder, 0)
+    update_embedding(state_path, emb_path, eod_data,
+                     day_major=not args.ticker_major,
+                     dtype=np.dtype(args.dtype))
@@ -0,0 +1,76 @@
+import numpy as np
+import tensorflow as tf
+
+from tf_compat import leaky_relu
+from tiled_attention import ALPHA
+
+
+def relation_edges(rel_encoding, rel_mask):
+    '''
+    the related pairs of rel_mask as an edge list, grouped by column as the
+    softmax of the dense attention normalizes over dim 0
+    returns: E x 2 int32 (row, column) edges sorted by column, and their
+        E x K relation encoding
+    '''
+    columns, rows = np.nonzero(np.transpose(rel_mask) == 0)
+    edges = np.stack([rows, columns], axis=1).astype(np.int32)
+    return edges, rel_encoding[rows, columns]
+
+
+class NeighborSampler:
+    def __init__(self, edges, fanout, seed=0):
+        '''
+        caps every column of the attention to fanout edges drawn at random
+        edges: E x 2 edges sorted by column, see relation_edges
+        '''
+        self.fanout = fanout
+        self.seed = seed
+        self.size = edges.shape[0]
+        self.columns = edges[:, 1]
+        counts = np.bincount(self.columns)
+        self.column_start = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        self.capped = np.max(counts) > fanout if len(counts) else False
+
+    def sample(self, step):
+        '''
+        returns: sorted ids of the sampled edges, the same for the same seed
+            and step; all edges of the columns with at most fanout edges
+        '''
+        if not self.capped:
+            return np.arange(self.size, dtype=np.int32)
+        rng = np.random.RandomState((self.seed * 1000003 + step) % 2 ** 32)
+        order = np.lexsort((rng.random_sample(self.size), self.columns))
+        rank = np.arange(self.size) - self.column_start[self.columns[order]]
+        return np.sort(order[rank < self.fanout]).astype(np.int32)
+
+
+def sparse_attention(edge_ids, edges, relation, head, tail, feature, kernel,
+                     bias):
+    '''
+    the dense attention of ReRaLSTM restricted to the edges edge_ids: a
+    softmax over the rows of every column, as softmax(dim=0), computed per
+    edge, so the cost is O(E) instead of O(N x N); with all edges it equals
+    the dense attention as long as every column has an edge (self-loops)
+    edge_ids: ids of the edges used, e.g. from NeighborSampler.sample
+    edges: E x 2 int32 constant, see relation_edges
+    relation: E x K relation encoding of the edges, see relation_constant
+    head, tail: N x 1
+    feature: N x U
+    kernel, bias: K x 1 and 1, see relation_variables
+    returns: N x U
+    '''
+    size = tf.shape(feature)[0]
+    used = tf.gather(edges, edge_ids)
+    rows, columns = used[:, 0], used[:, 1]
+    rel = tf.cast(tf.gather(relation, edge_ids), tf.float32)
+    rel_logit = leaky_relu(
+        tf.nn.bias_add(tf.matmul(rel, kernel), bias)[:, 0], alpha=ALPHA)
+    logit = tf.gather(head[:, 0], rows) + tf.gather(tail[:, 0], columns) + \
+        rel_logit
+    # softmax over the edges of every column
+    logit_max = tf.unsorted_segment_max(logit, columns, size)
+    weight = tf.exp(logit - tf.gather(tf.stop_gradient(logit_max), columns))
+    weight = weight / tf.gather(
+        tf.unsorted_segment_sum(weight, columns, size), columns)
+    return tf.unsorted_segment_sum(
+        weight[:, None] * tf.gather(feature, columns), rows, size)
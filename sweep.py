@@ -0,0 +1,219 @@
+import argparse
+import ctypes
+import itertools
+import json
+import multiprocessing
+import os
+from time import time
+
+import numpy as np
+
+from arguments import parse_args, part_path, relation_path
+from load_data import load_EOD_data, load_relation_data
+from relation_rank_lstm_all import ReRaLSTM
+from thread_tuner import available_cpus
+
+
+# options that may vary across the runs of a sweep
+SWEEP_OPTIONS = ('l', 'u', 'a', 'r', 'self', 'gp', 'self_b', 'ratio', 'thresh')
+METRICS = ('mse', 'mrrt', 'btl', 'btl5', 'btl10')
+
+# market data of every run, filled before the pool forks its workers
+_DATA = {}
+
+
+def grid_configs(grid):
+    '''
+    ['l=4,16', 'u=32,64'] -> the 4 combinations, e.g. {'l': '4', 'u': '32'}
+    '''
+    names, values = [], []
+    for entry in grid:
+        name, _, options = entry.partition('=')
+        name = name.lstrip('-')
+        if name not in SWEEP_OPTIONS:
+            raise ValueError('cannot sweep over -%s, only over %s' %
+                             (name, ', '.join(SWEEP_OPTIONS)))
+        names.append(name)
+        values.append(options.split(','))
+    return [dict(zip(names, combination))
+            for combination in itertools.product(*values)]
+
+
+def read_configs(config_file):
+    '''
+    one JSON object per line, e.g. {"l": 16, "u": 64, "self": "part"}
+    '''
+    configs = []
+    for line in open(config_file):
+        if line.strip():
+            config = json.loads(line)
+            for name in config:
+                if name not in SWEEP_OPTIONS:
+                    raise ValueError('cannot sweep over -%s' % name)
+            configs.append(config)
+    return configs
+
+
+def config_argv(config):
+    argv = []
+    for name, value in sorted(config.items()):
+        argv += ['-' + name, str(value)]
+    return argv
+
+
+def _share(context, array):
+    '''
+    copies array into shared memory that forked workers read without
+    copying it again
+    '''
+    buffer = context.RawArray(ctypes.c_byte, max(array.nbytes, 1))
+    shared = np.frombuffer(buffer, dtype=array.dtype,
+                           count=array.size).reshape(array.shape)
+    shared[...] = array
+    return shared
+
+
+def _data_keys(args):
+    keys = [('eod', tuple(args.horizons or [1])),
+            ('relation', args.rel_name, args.geom,
+             args.thresh if args.geom else None)]
+    if args.self == 'part':
+        keys.append(('part', args.gp))
+    return keys
+
+
+def load_shared_data(context, runs):
+    '''
+    loads the EOD data once and every relation and partition file used by
+    runs into shared memory, keyed by _data_keys
+    '''
+    data = {}
+    tickers = None
+    for args, _, _ in runs:
+        for key in _data_keys(args):
+            if key in data:
+                continue
+            if key[0] == 'eod':
+                tickers = np.genfromtxt(
+                    os.path.join(args.p, '..', args.t), dtype=str,
+                    delimiter='\t', skip_header=False)
+                arrays = dict(zip(
+                    ['eod_data', 'mask_data', 'gt_data', 'price_data'],
+                    load_EOD_data(args.p, args.m, tickers,
+                                  list(key[1]))))
+            elif key[0] == 'relation':
+                arrays = dict(zip(['rel_encoding', 'rel_mask'],
+                                  load_relation_data(relation_path(
+                                      args.p, args.m, args.rel_name,
+                                      args.geom, args.thresh))))
+            else:
+                arrays = {'part_label': np.load(
+                    part_path(args.p, args.m, args.gp))}
+            data[key] = dict((name, _share(context, value))
+                             for name, value in arrays.items())
+    return data
+
+
+def _run(task):
+    '''
+    trains one configuration and seed inside a pool worker
+    '''
+    index, argv, seed, thread_config = task
+    args, parameters = parse_args(argv)
+    data = {}
+    for key in _data_keys(args):
+        data.update(_DATA[key])
+    t1 = time()
+    model = ReRaLSTM(
+        data_path=args.p, market_name=args.m, tickers_fname=args.t,
+        relation_name=args.rel_name, emb_fname=args.emb_file,
+        parameters=parameters, steps=1, epochs=args.epoch, batch_size=None,
+        in_pro=args.inner_prod, seed=seed, geom=args.geom, args=args,
+        keep_pred=False, data=data, thread_config=thread_config
+    )
+    model.train()
+    return index, seed, model.best_valid_perf, model.best_test_perf, \
+        time() - t1
+
+
+def print_table(results):
+    columns = ['valid_' + name for name in METRICS] + \
+        ['test_' + name for name in METRICS]
+    print('%-50s %4s ' % ('config', 'seed') +
+          ' '.join('%11s' % column for column in columns))
+    for record in results:
+        print('%-50s %4d ' % (json.dumps(record['config'], sort_keys=True),
+                              record['seed']) +
+              ' '.join('%11.5f' % record.get(column, np.nan)
+                       for column in columns))
+
+
+if __name__ == '__main__':
+    desc = 'hyperparameter sweep of relation_rank_lstm_all.py, the market ' \
+           'data is loaded once and shared by all runs'
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-grid', action='append', default=[],
+                        help='option=values, comma separated, e.g. '
+                             'u=32,64; repeat it for a grid over several '
+                             'options, one of: ' + ', '.join(SWEEP_OPTIONS))
+    parser.add_argument('-configs', type=str, default=None,
+                        help='JSON lines file of configurations, run '
+                             'instead of the grid')
+    parser.add_argument('-seeds', type=str, default='0',
+                        help='seeds of every configuration, comma separated')
+    parser.add_argument('-procs', type=int, default=2,
+                        help='runs trained at the same time')
+    parser.add_argument('-extra', type=str, default='',
+                        help='arguments of relation_rank_lstm_all.py shared '
+                             'by all runs, e.g. "-rn wikidata -epoch 50"')
+    parser.add_argument('-o', '--output', type=str,
+                        default='sweep_results.jsonl',
+                        help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    if args.configs is not None:
+        configs = read_configs(args.configs)
+    else:
+        configs = grid_configs(args.grid) or [{}]
+    seeds = [int(seed) for seed in args.seeds.split(',')]
+    runs = []
+    for config in configs:
+        argv = args.extra.split() + config_argv(config)
+        run_args, _ = parse_args(argv)
+        runs.append((run_args, argv, config))
+
+    # TF sizes its thread pools once per process: every run gets a fresh
+    # worker (maxtasksperchild=1) limited to its share of the cores
+    context = multiprocessing.get_context('fork')
+    _DATA.update(load_shared_data(context, runs))
+    cpus = available_cpus()
+    procs = max(min(args.procs, len(runs) * len(seeds)), 1)
+    share = max(len(cpus) // procs, 1)
+    thread_config = {'intra': share, 'inter': 1, 'blas': 1, 'affinity': None}
+    tasks = [(index, argv, seed, thread_config)
+             for index, (_, argv, _) in enumerate(runs) for seed in seeds]
+    print('%d runs on %d processes of %d threads' % (len(tasks), procs,
+                                                     share))
+
+    results = []
+    pool = context.Pool(procs, maxtasksperchild=1)
+    try:
+        for index, seed, valid_perf, test_perf, seconds in \
+                pool.imap_unordered(_run, tasks):
+            record = {'config': runs[index][2], 'seed': seed,
+                      'seconds': seconds}
+            record.update(('valid_' + name, float(value))
+                          for name, value in valid_perf.items())
+            record.update(('test_' + name, float(value))
+                          for name, value in test_perf.items())
+            results.append(record)
+            with open(args.output, 'a') as fout:
+                fout.write(json.dumps(record) + '\n')
+    finally:
+        pool.close()
+        pool.join()
+    results.sort(key=lambda record: (json.dumps(record['config'],
+                                                sort_keys=True),
+                                     record['seed']))
+    print()
+    print_table(results)
@@ -0,0 +1,103 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from evaluator import GroupedEvaluator, StreamingEvaluator, evaluate
+
+
+def loop_evaluate(prediction, ground_truth, mask):
+    '''
+    the per-day argsort loop that evaluate replaced
+    '''
+    mrr_top = 0.0
+    bt_long = 1.0
+    bt_long5 = 1.0
+    bt_long10 = 1.0
+    for i in range(prediction.shape[1]):
+        rank_gt = np.argsort(ground_truth[:, i])
+        rank_pre = np.argsort(prediction[:, i])
+        pre_top1 = set()
+        pre_top5 = set()
+        pre_top10 = set()
+        for j in range(1, prediction.shape[0] + 1):
+            cur_rank = rank_pre[-1 * j]
+            if mask[cur_rank][i] < 0.5:
+                continue
+            if len(pre_top1) < 1:
+                pre_top1.add(cur_rank)
+            if len(pre_top5) < 5:
+                pre_top5.add(cur_rank)
+            if len(pre_top10) < 10:
+                pre_top10.add(cur_rank)
+        top1_pos_in_gt = 0
+        for j in range(1, prediction.shape[0] + 1):
+            cur_rank = rank_gt[-1 * j]
+            if mask[cur_rank][i] < 0.5:
+                continue
+            top1_pos_in_gt += 1
+            if cur_rank in pre_top1:
+                break
+        if top1_pos_in_gt > 0:
+            mrr_top += 1.0 / top1_pos_in_gt
+        bt_long += ground_truth[list(pre_top1)[0]][i]
+        bt_long5 += sum(ground_truth[pre][i] for pre in pre_top5) / 5
+        bt_long10 += sum(ground_truth[pre][i] for pre in pre_top10) / 10
+    return {'mse': np.linalg.norm((prediction - ground_truth) * mask) ** 2 /
+            np.sum(mask), 'mrrt': mrr_top / prediction.shape[1],
+            'btl': bt_long, 'btl5': bt_long5, 'btl10': bt_long10}
+
+
+def tied_data(tickers=40, days=60, seed=0):
+    '''
+    returns rounded to 2 decimals, with the zero returns of unchanged closes
+    and of days after a missing one, so that the ground truth has ties
+    '''
+    rng = np.random.RandomState(seed)
+    prediction = rng.randn(tickers, days) * 0.02
+    ground_truth = np.round(rng.randn(tickers, days) * 0.02, 2)
+    ground_truth[rng.rand(tickers, days) < 0.2] = 0.0
+    mask = (rng.rand(tickers, days) > 0.1).astype(float)
+    # at least one valid ticker every day
+    mask[0] = 1.0
+    return prediction, ground_truth, mask
+
+
+def assert_same(performance, expected):
+    for name, value in expected.items():
+        assert np.isclose(performance[name], value, rtol=1e-12, atol=1e-12), \
+            (name, performance[name], value)
+
+
+def test_evaluate_ties():
+    for seed in range(5):
+        prediction, ground_truth, mask = tied_data(seed=seed)
+        expected = loop_evaluate(prediction, ground_truth, mask)
+        assert_same(evaluate(prediction, ground_truth, mask), expected)
+
+
+def test_streaming_ties():
+    prediction, ground_truth, mask = tied_data(seed=1)
+    evaluator = StreamingEvaluator()
+    for start in range(0, prediction.shape[1], 7):
+        evaluator.update(prediction[:, start: start + 7],
+                         ground_truth[:, start: start + 7],
+                         mask[:, start: start + 7])
+    assert_same(evaluator.performance(),
+                loop_evaluate(prediction, ground_truth, mask))
+
+
+def test_grouped_ties():
+    prediction, ground_truth, mask = tied_data(seed=2)
+    rng = np.random.RandomState(3)
+    membership = rng.rand(prediction.shape[0], 4) < 0.5
+    # the first ticker, valid every day, in every group
+    membership[0] = True
+    grouped = GroupedEvaluator(membership)
+    performance = grouped.evaluate(prediction, ground_truth, mask)
+    for g in range(membership.shape[1]):
+        members = np.nonzero(membership[:, g])[0]
+        assert_same(performance[g], loop_evaluate(
+            prediction[members], ground_truth[members], mask[members]))
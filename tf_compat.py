@@ -0,0 +1,13 @@
+# ops missing from older TF builds, shared by the graph-building modules
+try:
+    from tensorflow.python.ops.nn_ops import leaky_relu
+except ImportError:
+    from tensorflow.python.framework import ops
+    from tensorflow.python.ops import math_ops
+
+
+    def leaky_relu(features, alpha=0.2, name=None):
+        with ops.name_scope(name, "LeakyRelu", [features, alpha]):
+            features = ops.convert_to_tensor(features, name="features")
+            alpha = ops.convert_to_tensor(alpha, name="alpha")
+            return math_ops.maximum(alpha * features, features)
@@ -0,0 +1,186 @@
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+from time import time
+
+import numpy as np
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+DEFAULT_FILE = os.path.join(os.path.expanduser('~'), '.ar_stock_threads.json')
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def candidate_configs(cpus):
+    '''
+    intra-op threads from 1 to all cores, 1 or 2 inter-op pools, NumPy BLAS
+    limited to 1 thread or not (only with threadpoolctl), and the process
+    either free to use every core or pinned to as many cores as it uses
+    '''
+    cores = len(cpus)
+    intra_options = sorted(set([1, max(cores // 4, 1), max(cores // 2, 1),
+                                cores]))
+    blas_options = [None, 1] if threadpool_limits is not None else [None]
+    configs = []
+    for intra in intra_options:
+        for inter in [1, 2]:
+            for blas in blas_options:
+                configs.append({'intra': intra, 'inter': inter,
+                                'blas': blas, 'affinity': None})
+                if intra < cores:
+                    configs.append({'intra': intra, 'inter': inter,
+                                    'blas': blas,
+                                    'affinity': cpus[:intra + inter]})
+    return configs
+
+
+def session_config(thread_config=None):
+    import tensorflow as tf
+    config = tf.ConfigProto()
+    config.gpu_options.allow_growth = True
+    if thread_config is not None:
+        config.intra_op_parallelism_threads = thread_config['intra']
+        config.inter_op_parallelism_threads = thread_config['inter']
+    return config
+
+
+def apply_thread_config(thread_config):
+    '''
+    pins the process and limits the BLAS threads of NumPy, the TF pools are
+    set by session_config
+    returns: the threadpoolctl limiter, keep it alive while training
+    '''
+    if thread_config is None:
+        return None
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, thread_config['affinity'] or
+                             available_cpus())
+    if thread_config['blas'] is not None and threadpool_limits is not None:
+        return threadpool_limits(limits=thread_config['blas'],
+                                 user_api='blas')
+    return None
+
+
+def _key(tickers, units):
+    return 'N=%d,U=%d' % (tickers, units)
+
+
+def load_thread_config(tickers, units, thread_file=DEFAULT_FILE):
+    '''
+    returns: the config tuned on this host for N tickers and U units, or for
+        the closest N with the same U, None if there is none
+    '''
+    if not thread_file or not os.path.exists(thread_file):
+        return None
+    with open(thread_file) as fin:
+        tuned = json.load(fin).get(platform.node(), {})
+    if _key(tickers, units) in tuned:
+        return tuned[_key(tickers, units)]
+    same_units = [(abs(entry['tickers'] - tickers), key)
+                  for key, entry in tuned.items() if entry['units'] == units]
+    if not same_units:
+        return None
+    return tuned[min(same_units)[1]]
+
+
+def save_thread_config(thread_config, tickers, units,
+                       thread_file=DEFAULT_FILE):
+    tuned = {}
+    if os.path.exists(thread_file):
+        with open(thread_file) as fin:
+            tuned = json.load(fin)
+    thread_config = dict(thread_config, tickers=tickers, units=units)
+    tuned.setdefault(platform.node(), {})[_key(tickers, units)] = \
+        thread_config
+    with open(thread_file, 'w') as fout:
+        json.dump(tuned, fout, indent=2, sort_keys=True)
+
+
+def _time_steps(model, graph, sess, offsets):
+    '''
+    seconds of one train step plus one inference step, host-side batch
+    preparation included, averaged over offsets
+    '''
+    t1 = time()
+    for offset in offsets:
+        emb_batch, mask_batch, price_batch, gt_batch = model.get_batch(offset)
+        feed_dict = {
+            graph['feature']: emb_batch,
+            graph['mask']: mask_batch,
+            graph['ground_truth']: gt_batch,
+            graph['base_price']: price_batch
+        }
+        sess.run((graph['loss'], graph['optimizer']), feed_dict)
+        sess.run(graph['return_ratio'], feed_dict)
+    return (time() - t1) / len(offsets)
+
+
+def _run_candidate(model, thread_config, offsets, warmup, timings):
+    import tensorflow as tf
+    apply_thread_config(thread_config)
+    with tf.Graph().as_default():
+        tf.set_random_seed(model.seed)
+        graph = model.build_graph()
+        with tf.Session(config=session_config(thread_config)) as sess:
+            sess.run(tf.global_variables_initializer())
+            _time_steps(model, graph, sess, offsets[:warmup])
+            timings.put(_time_steps(model, graph, sess, offsets[warmup:]))
+
+
+def tune_threads(model, steps=10, warmup=2, thread_file=DEFAULT_FILE):
+    '''
+    times a few train and inference steps of model under every candidate
+    thread setting and saves the fastest one for this host, N and U
+    model: ReRaLSTM, with its data loaded and no TF session created yet
+    returns: the fastest config
+    '''
+    cpus = available_cpus()
+    offsets = np.arange(warmup + steps) % (model.valid_index -
+                                           model.parameters['seq'] -
+                                           model.steps + 1)
+    # TF sizes its thread pools once per process, so every candidate runs in
+    # a forked child that shares the loaded data
+    context = multiprocessing.get_context('fork')
+    results = []
+    for thread_config in candidate_configs(cpus):
+        timings = context.Queue()
+        worker = context.Process(target=_run_candidate, args=(
+            model, thread_config, offsets, warmup, timings))
+        worker.start()
+        seconds = None
+        while seconds is None:
+            try:
+                seconds = timings.get(timeout=1)
+            except queue.Empty:
+                # e.g. killed when out of memory or by a bad affinity
+                if worker.exitcode not in (None, 0):
+                    break
+        worker.join()
+        if seconds is None:
+            logging.warning('thread config %s failed with exit code %d',
+                            thread_config, worker.exitcode)
+            print('threads:', thread_config, 'failed with exit code',
+                  worker.exitcode)
+            continue
+        print('threads:', thread_config, 'sec/step: %.5f' % seconds)
+        results.append((seconds, thread_config))
+
+    if not results:
+        raise RuntimeError('every thread config failed')
+    seconds, best = min(results, key=lambda result: result[0])
+    best = dict(best, sec_per_step=seconds)
+    print('fastest threads:', best)
+    save_thread_config(best, len(model.tickers), model.parameters['unit'],
+                       thread_file)
+    return best
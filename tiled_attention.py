@@ -0,0 +1,114 @@
+import numpy as np
+import tensorflow as tf
+
+from tf_compat import leaky_relu
+
+
+ALPHA = 0.2  # slope of leaky_relu
+
+
+def relation_constant(rel_encoding):
+    '''
+    the N x N x K relation as a constant in its smallest exact dtype, cast to
+    float32 one block at a time by tiled_attention
+    '''
+    if np.issubdtype(rel_encoding.dtype, np.integer) or \
+            np.array_equal(rel_encoding, np.round(rel_encoding)):
+        if rel_encoding.min() >= 0 and rel_encoding.max() <= 255:
+            return tf.constant(rel_encoding.astype(np.uint8))
+    return tf.constant(rel_encoding, dtype=tf.float32)
+
+
+def relation_variables(name, relations):
+    '''
+    kernel and bias of tf.layers.dense(relation, units=1, name=name), so
+    that the dense and tiled attention share checkpoints and reuse=True
+    '''
+    with tf.variable_scope(name):
+        kernel = tf.get_variable('kernel', [relations, 1], tf.float32)
+        bias = tf.get_variable('bias', [1], tf.float32,
+                               initializer=tf.zeros_initializer())
+    return kernel, bias
+
+
+def tiled_attention(relation, head, tail, feature, kernel, bias, block=256):
+    '''
+    softmax(rel_mask + head 1^T + 1 tail^T + leaky_relu(relation kernel +
+    bias), dim=0) @ feature, as the dense attention of ReRaLSTM, computed
+    block columns at a time. The softmax normalizes every column
+    separately, so the blocks are exact; the backward pass recomputes each
+    block instead of keeping it, so activations are O(N x block)
+    relation: N x N x K constant, see relation_constant; the mask is -1e9
+        where a pair has no relation, as in load_relation_data
+    head, tail: N x 1
+    feature: N x U
+    kernel, bias: K x 1 and 1, see relation_variables
+    returns: N x U
+    '''
+    size = tf.shape(relation)[0]
+    blocks = (size + block - 1) // block
+
+    def _block_logits(start, head, tail, kernel, bias):
+        width = tf.minimum(block, size - start)
+        rel = tf.cast(tf.slice(relation, [0, start, 0], [-1, width, -1]),
+                      tf.float32)
+        pre_act = tf.nn.bias_add(tf.tensordot(rel, kernel, [[2], [0]]),
+                                 bias)[:, :, 0]
+        mask = tf.where(tf.equal(tf.reduce_sum(rel, axis=2), 0.0),
+                        tf.fill(tf.shape(pre_act), -1e9),
+                        tf.zeros_like(pre_act))
+        weight = tf.add(
+            tf.add(head, tf.transpose(tf.slice(tail, [start, 0], [width, 1]))),
+            leaky_relu(pre_act, alpha=ALPHA))
+        return rel, pre_act, tf.nn.softmax(tf.add(mask, weight), dim=0), \
+            width
+
+    @tf.custom_gradient
+    def _attention(head, tail, feature, kernel, bias):
+        def _forward(i, outputs):
+            start = i * block
+            _, _, weight_masked, width = _block_logits(start, head, tail,
+                                                       kernel, bias)
+            return i + 1, outputs + tf.matmul(
+                weight_masked, tf.slice(feature, [start, 0], [width, -1]))
+
+        _, outputs = tf.while_loop(
+            lambda i, _: i < blocks, _forward,
+            [tf.constant(0), tf.zeros_like(feature)], parallel_iterations=1)
+
+        def _grad(d_outputs):
+            def _backward(i, d_head, d_tail, d_feature, d_kernel, d_bias):
+                start = i * block
+                rel, pre_act, weight_masked, width = _block_logits(
+                    start, head, tail, kernel, bias)
+                values = tf.slice(feature, [start, 0], [width, -1])
+                d_weight = tf.matmul(d_outputs, values, transpose_b=True)
+                # softmax over dim 0, column by column
+                d_logits = weight_masked * (d_weight - tf.reduce_sum(
+                    weight_masked * d_weight, axis=0, keep_dims=True))
+                d_pre_act = tf.where(pre_act > 0, d_logits,
+                                     ALPHA * d_logits)
+                return i + 1, \
+                    d_head + tf.reduce_sum(d_logits, axis=1, keep_dims=True), \
+                    d_tail.write(i, tf.transpose(tf.reduce_sum(
+                        d_logits, axis=0, keep_dims=True))), \
+                    d_feature.write(i, tf.matmul(weight_masked, d_outputs,
+                                                 transpose_a=True)), \
+                    d_kernel + tf.tensordot(rel, d_pre_act,
+                                            [[0, 1], [0, 1]])[:, None], \
+                    d_bias + tf.reduce_sum(d_pre_act)[None]
+
+            _, d_head, d_tail, d_feature, d_kernel, d_bias = tf.while_loop(
+                lambda i, *_: i < blocks, _backward,
+                [tf.constant(0), tf.zeros_like(head),
+                 tf.TensorArray(tf.float32, size=blocks, infer_shape=False),
+                 tf.TensorArray(tf.float32, size=blocks, infer_shape=False),
+                 tf.zeros_like(kernel), tf.zeros_like(bias)],
+                parallel_iterations=1)
+            return d_head, tf.reshape(d_tail.concat(), tf.shape(tail)), \
+                tf.reshape(d_feature.concat(), tf.shape(feature)), \
+                d_kernel, d_bias
+
+        return outputs, _grad
+
+    return _attention(head, tail, feature, kernel, bias)
@@ -0,0 +1,219 @@
+import argparse
+import os
+import sys
+
+
+# data-prep, cache-building, evaluation and backtest commands that never
+# import TensorFlow; every command imports what it needs when it runs
+
+
+def _tickers(data_path, tickers_fname):
+    import numpy as np
+    return np.genfromtxt(os.path.join(data_path, '..', tickers_fname),
+                         dtype=str, delimiter='\t', skip_header=False)
+
+
+def check(args):
+    '''
+    parses the arguments of relation_rank_lstm_all.py and checks that its
+    input files exist
+    '''
+    from arguments import parse_args, part_path, relation_path
+    argv = args.train_args
+    if argv[:1] == ['--']:
+        argv = argv[1:]
+    train_args, parameters = parse_args(argv)
+    print('arguments:', train_args)
+    print('parameters:', parameters)
+    files = [os.path.join(train_args.p, '..', train_args.t),
+             relation_path(train_args.p, train_args.m, train_args.rel_name,
+                           train_args.geom, train_args.thresh)]
+    if not train_args.raw_windows:
+        files.append(os.path.join(train_args.p, '..', 'pretrain',
+                                  train_args.emb_file))
+    if train_args.self == 'part':
+        files.append(part_path(train_args.p, train_args.m, train_args.gp))
+    if train_args.group_eval:
+        files.append(relation_path(train_args.p, train_args.m,
+                                   'sector_industry'))
+    missing = [fname for fname in files if not os.path.exists(fname)]
+    for fname in missing:
+        print('missing:', fname)
+    return 1 if missing else 0
+
+
+def sfm(args):
+    from load_data import build_SFM_data
+    build_SFM_data(args.p, args.m, _tickers(args.p, args.t))
+    return 0
+
+
+def embedding(args):
+    import numpy as np
+    from embedding_store import convert_embedding
+    convert_embedding(args.src, args.dst, day_major=not args.ticker_major,
+                      dtype=np.dtype(args.dtype))
+    return 0
+
+
+def relations(args):
+    from relation_store import RelationStore
+    store = RelationStore(args.relation_file,
+                          _tickers(args.p, args.t), delta_dir=args.deltas)
+    if store.poll():
+        print('relations at version %d after %s' % (store.version,
+                                                   ', '.join(store.applied)))
+    else:
+        print('no new delta in', args.deltas)
+    store.save(args.output)
+    return 0
+
+
+def _predictions(args):
+    '''
+    returns: prediction, ground truth and mask, N x T (x H) of a walk-forward
+        .npz file or of the prediction archive
+    '''
+    import numpy as np
+    if args.archive is not None:
+        from prediction_archive import PredictionArchive
+        archive = PredictionArchive(args.archive, args.run)
+        epoch = args.epoch if args.epoch == 'best' else int(args.epoch)
+        return archive.read(args.seed, args.split, epoch,
+                            window=args.window)
+    saved = np.load(args.predictions)
+    return saved['prediction'], saved['ground_truth'], saved['mask']
+
+
+def evaluate(args):
+    from evaluator import evaluate as evaluate_predictions
+    prediction, ground_truth, mask = _predictions(args)
+    print('performance:', evaluate_predictions(prediction, ground_truth,
+                                               mask))
+    return 0
+
+
+def backtest(args):
+    from backtest import backtest as backtest_predictions
+    prediction, ground_truth, mask = _predictions(args)
+    if prediction.ndim == 3:
+        # the first horizon
+        prediction, ground_truth, mask = \
+            prediction[:, :, 0], ground_truth[:, :, 0], mask[:, :, 0]
+    top_k = [int(k) for k in args.top_k.split(',')]
+    strategies = args.strategies.split(',')
+    performance = backtest_predictions(
+        prediction, ground_truth, mask, top_k=top_k, strategies=strategies,
+        steps=args.steps, cost=args.cost)
+    print('%-12s %4s %10s %10s %10s %10s' % ('strategy', 'k', 'wealth',
+                                             'cum_return', 'turnover',
+                                             'sharpe'))
+    for g, strategy in enumerate(strategies):
+        for i, k in enumerate(top_k):
+            print('%-12s %4d %10.5f %10.5f %10.5f %10.5f' % (
+                strategy, k, performance['wealth'][g, i],
+                performance['cum_return'][g, i],
+                performance['turnover'][g, i], performance['sharpe'][g, i]))
+    return 0
+
+
+def _add_data_args(parser):
+    parser.add_argument('-p', help='path of EOD data',
+                        default='../data/2013-01-01')
+    parser.add_argument('-m', help='market name', default='NASDAQ')
+    parser.add_argument('-t', help='fname for selected tickers')
+
+
+def _add_prediction_args(parser):
+    parser.add_argument('predictions', nargs='?', default=None,
+                        help='.npz file of prediction, ground_truth and '
+                             'mask, e.g. from -wf_output')
+    parser.add_argument('-archive', type=str, default=None,
+                        help='prediction archive folder to read instead')
+    parser.add_argument('-run', type=str, default='run',
+                        help='run name in the prediction archive')
+    parser.add_argument('-seed', type=int, default=0)
+    parser.add_argument('-split', type=str, default='test',
+                        help='valid or test')
+    parser.add_argument('-epoch', type=str, default='best',
+                        help='archived epoch, or best')
+    parser.add_argument('-window', type=int, default=None,
+                        help='walk-forward window in the prediction archive')
+
+
+def build_parser():
+    desc = 'data preparation, caches, evaluation and backtests without ' \
+           'TensorFlow'
+    parser = argparse.ArgumentParser(description=desc)
+    commands = parser.add_subparsers(dest='command')
+
+    command = commands.add_parser(
+        'check', help='validate the arguments of relation_rank_lstm_all.py '
+                      'and its input files')
+    command.add_argument('train_args', nargs=argparse.REMAINDER,
+                         help='arguments of relation_rank_lstm_all.py')
+    command.set_defaults(func=check)
+
+    command = commands.add_parser(
+        'sfm', help='build the price data of the SFM baseline')
+    _add_data_args(command)
+    command.set_defaults(func=sfm)
+
+    command = commands.add_parser(
+        'embedding', help='convert a pretrained sequential embedding for '
+                          'EmbeddingStore')
+    command.add_argument('src', help='ticker-major N x T x U .npy file')
+    command.add_argument('dst', help='output .npy file')
+    command.add_argument('-ticker_major', action='store_true',
+                         help='keep the N x T x U layout')
+    command.add_argument('-dtype', type=str, default='float16',
+                         help='storage precision: float16 or float32')
+    command.set_defaults(func=embedding)
+
+    command = commands.add_parser(
+        'relations', help='apply new relation delta files to a relation '
+                          'file, see relation_store.py')
+    command.add_argument('relation_file', help='N x N x K .npy file')
+    command.add_argument('deltas', help='folder of delta files')
+    command.add_argument('-o', '--output', type=str, default=None,
+                         help='relation file written, relation_file if '
+                              'omitted')
+    _add_data_args(command)
+    command.set_defaults(func=relations)
+
+    command = commands.add_parser(
+        'evaluate', help='metrics of saved predictions')
+    _add_prediction_args(command)
+    command.set_defaults(func=evaluate)
+
+    command = commands.add_parser(
+        'backtest', help='portfolio backtest of saved predictions')
+    _add_prediction_args(command)
+    command.add_argument('-top_k', type=str, default='1,5,10',
+                         help='tickers held per leg, comma separated')
+    command.add_argument('-strategies', type=str, default='long,long_short',
+                         help='comma separated, see backtest.STRATEGIES')
+    command.add_argument('-steps', type=int, default=1,
+                         help='holding period in days')
+    command.add_argument('-cost', type=float, default=0.0,
+                         help='proportional transaction cost')
+    command.set_defaults(func=backtest)
+    return parser
+
+
+if __name__ == '__main__':
+    parser = build_parser()
+    argv = sys.argv[1:]
+    # check passes its options on to the parser of the training script
+    args = parser.parse_args(argv[:1] if argv[:1] == ['check'] else argv)
+    if args.command == 'check':
+        args.train_args = argv[1:]
+    if args.command is None:
+        parser.print_help()
+        sys.exit(2)
+    if getattr(args, 't', 'unset') is None:
+        args.t = args.m + '_tickers_qualify_dr-0.98_min-5_smooth.csv'
+    if args.command in ('evaluate', 'backtest') and \
+            args.predictions is None and args.archive is None:
+        parser.error('give a predictions file or -archive')
+    sys.exit(args.func(args))
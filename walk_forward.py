@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+from evaluator import HorizonEvaluator
+
+
+def windows(valid_index, test_index, trade_dates, stride):
+    '''
+    returns: (valid_index, test_index, test_end) of every window, rolled
+        forward by stride days; the test days of the windows tile
+        [test_index, trade_dates) without gaps or overlaps
+    '''
+    result = []
+    while test_index < trade_dates:
+        result.append((valid_index, test_index,
+                       min(test_index + stride, trade_dates)))
+        valid_index += stride
+        test_index += stride
+    return result
+
+
+def walk_forward(model, stride, warm_epochs=None, checkpoint_dir='checkpoint',
+                 output=None):
+    '''
+    retrains model on expanding windows: every stride days the validation
+    and test splits move forward, and the model of the next window starts
+    from the best checkpoint of the previous one
+    model: ReRaLSTM, created with keep_pred=True
+    warm_epochs: epochs of the warm-started windows, a quarter of
+        model.epochs if None
+    output: if set, the stitched test predictions, ground truth, mask and
+        day indices are saved to this .npz file
+    returns: N x D out-of-sample predictions, ground truth and mask of the
+        D stitched test days, and their performance
+    '''
+    if not model.keep_pred:
+        raise ValueError('walk_forward needs the predictions, create the '
+                         'model with keep_pred=True')
+    if warm_epochs is None:
+        warm_epochs = max(model.epochs // 4, 1)
+    saved = (model.valid_index, model.test_index, model.test_end,
+             model.epochs, model.checkpoint, model.warm_start,
+             model.archive_window)
+    predictions, ground_truths, masks = [], [], []
+    previous = None
+    for window, (valid_index, test_index, test_end) in enumerate(windows(
+            model.valid_index, model.test_index, model.trade_dates, stride)):
+        model.valid_index, model.test_index, model.test_end = \
+            valid_index, test_index, test_end
+        model.epochs = saved[3] if previous is None else warm_epochs
+        model.warm_start = previous
+        # archived predictions of every window, see PredictionArchive
+        model.archive_window = window
+        # the steps of every window start from 0, see Profiler.write_trace
+        model.profiler.fields['window'] = window
+        model.checkpoint = os.path.join(checkpoint_dir, 'window_%d' % window,
+                                        'model')
+        if not os.path.exists(os.path.dirname(model.checkpoint)):
+            os.makedirs(os.path.dirname(model.checkpoint))
+        print('walk-forward window %d: train [0, %d) valid [%d, %d) '
+              'test [%d, %d) epochs %d' % (window, valid_index, valid_index,
+                                           test_index, test_index, test_end,
+                                           model.epochs))
+        _, _, _, test_pred, test_gt, test_mask = model.train()
+        if test_pred is None:
+            # e.g. a NaN validation loss in every epoch
+            raise RuntimeError(
+                'walk-forward window %d (valid [%d, %d)) recorded no best '
+                'epoch, so it has no test predictions' %
+                (window, valid_index, test_index))
+        predictions.append(test_pred)
+        ground_truths.append(test_gt)
+        masks.append(test_mask)
+        previous = model.checkpoint
+    model.valid_index, model.test_index, model.test_end, model.epochs, \
+        model.checkpoint, model.warm_start, model.archive_window = saved
+    model.profiler.fields.pop('window', None)
+
+    prediction = np.concatenate(predictions, axis=1)
+    ground_truth = np.concatenate(ground_truths, axis=1)
+    mask = np.concatenate(masks, axis=1)
+    evaluator = HorizonEvaluator(model.horizons)
+    evaluator.update(*[value.reshape(value.shape[0], value.shape[1], -1)
+                       for value in (prediction, ground_truth, mask)])
+    performance = evaluator.performance()
+    print('\nWalk-forward out-of-sample performance:', performance)
+    if output is not None:
+        np.savez(output, prediction=prediction, ground_truth=ground_truth,
+                 mask=mask,
+                 days=np.arange(saved[1], saved[1] + prediction.shape[1]))
+    return prediction, ground_truth, mask, performance